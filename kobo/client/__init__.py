@@ -71,10 +71,15 @@ class Add_User(kobo.client.ClientCommand):
 
 import os
 import base64
+import concurrent.futures
+import functools
 import hashlib
+import socket
 import ssl
 import warnings
+from six.moves import http_client as httplib
 import six.moves.urllib.parse as urlparse
+import six.moves.urllib.request as urllib2
 from six.moves import xmlrpc_client as xmlrpclib
 
 import kobo.conf
@@ -95,6 +100,13 @@ __all__ = (
 )
 
 
+# max size of a task log chunk uploaded in a single request
+TASK_LOG_CHUNK_SIZE = 1024 ** 2
+
+# default size of a range of a file uploaded in a single request
+UPLOAD_RANGE_SIZE = 8 * 1024 ** 2
+
+
 class BaseClientCommandContainer(kobo.cli.CommandContainer):
     """A basic CommandContainer class that implements methods needed for CommandOptionParser"""
     def __init__(self):
@@ -151,6 +163,7 @@ class HubProxy(object):
         self._auth_method = self._conf["AUTH_METHOD"]
         self._logger = logger
         self._logged_in = False
+        self._hub_features = None
 
         if auto_logout is not None:
             warnings.warn("auto_logout is deprecated and has no effect", DeprecationWarning)
@@ -188,6 +201,11 @@ class HubProxy(object):
         except:
             raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
 
+    @property
+    def connection_pool(self):
+        """Keep-alive connections shared by XML-RPC calls and uploads (None with custom transports without one)."""
+        return getattr(self._transport, "connection_pool", None)
+
     @property
     def is_logged_in(self):
         return self._logged_in
@@ -454,6 +472,123 @@ class HubProxy(object):
         return '%s/%s@%s' % (service, hostname, realm)
 
     def upload_file(self, file_name, target_dir):
+        """
+        Upload a file to the hub.
+
+        The file is sent in ranges over several connections in parallel
+        (UPLOAD_PARALLEL in config).  If some ranges fail, only those are
+        sent again.  Hubs without ranged uploads get the whole file in
+        a single POST request.
+
+        @param file_name: path to the file
+        @type  file_name: str
+        @param target_dir: target directory on the hub
+        @type  target_dir: str
+        @return: (upload_id, HTTP status code, response body)
+        @rtype: (int, int, bytes)
+        """
+        fsize = os.path.getsize(file_name)
+        # use str only for large uploads to not break compatibility with older hubs
+        if fsize > xmlrpclib.MAXINT:
+            fsize = str(fsize)
+
+        try:
+            upload_id, upload_key = self.upload.register_ranged_upload(os.path.basename(file_name), fsize, target_dir)
+        except xmlrpclib.Fault:
+            # old hub
+            return self._upload_file_post(file_name, target_dir)
+
+        retries = self._conf.get("UPLOAD_RETRIES", 3)
+        for attempt in range(retries + 1):
+            try:
+                checksum, failure = self._upload_file_ranges(file_name, upload_id, upload_key)
+            except (socket.error, httplib.HTTPException) as ex:
+                if attempt >= retries:
+                    raise
+                self._logger and self._logger.warning("Upload of %s failed, resuming: %s" % (file_name, ex))
+                continue
+
+            if failure is None:
+                break
+            if attempt >= retries:
+                return (upload_id, ) + failure
+            self._logger and self._logger.warning("Upload of %s failed, resuming: %s %s" % ((file_name, ) + failure))
+
+        try:
+            self.upload.finish_upload(upload_id, checksum)
+        except xmlrpclib.Fault as ex:
+            return upload_id, 500, ex.faultString.encode()
+        return upload_id, 200, b"Upload finished."
+
+    def _upload_file_ranges(self, file_name, upload_id, upload_key):
+        """
+        Send ranges of a file the hub doesn't have yet.
+
+        The file is read once: each range is hashed (to compare it with
+        ranges on the hub) and added to the whole file checksum, then
+        queued for sending.
+
+        @return: (sha256 checksum of the file, None or (status, response body) of a failed range)
+        @rtype: (str, tuple)
+        """
+        scheme, netloc, path = urlparse.urlparse("%s/upload/" % self._hub_url)[:3]
+        if ":" in netloc:
+            host, port = netloc.split(":", 1)
+        else:
+            host, port = netloc, None
+
+        received = {}
+        for offset, size, range_checksum in self.upload.get_upload_ranges(upload_id):
+            received[int(offset)] = (int(size), range_checksum)
+
+        def send_range(offset, data, range_checksum):
+            query = urlparse.urlencode({"upload_id": upload_id, "upload_key": upload_key, "offset": offset})
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "X-Kobo-Checksum": range_checksum,
+            }
+            return kobo.http.send_pooled(
+                self.connection_pool, host, port, scheme == "https",
+                functools.partial(self._send_put, selector="%s?%s" % (path, query), body=data, headers=headers),
+            )
+
+        checksum = hashlib.sha256()
+        range_size = self._conf.get("UPLOAD_RANGE_SIZE", UPLOAD_RANGE_SIZE)
+        parallel = max(1, self._conf.get("UPLOAD_PARALLEL", 4))
+        pending = set()
+        finished = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+            try:
+                with open(file_name, "rb") as fo:
+                    offset = 0
+                    while True:
+                        data = fo.read(range_size)
+                        if not data:
+                            break
+                        checksum.update(data)
+                        range_checksum = hashlib.sha256(data).hexdigest().lower()
+                        if received.get(offset) != (len(data), range_checksum):
+                            pending.add(executor.submit(send_range, offset, data, range_checksum))
+                        offset += len(data)
+
+                        # limit number of ranges held in memory
+                        while len(pending) >= 2 * parallel:
+                            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                            finished.extend(done)
+            finally:
+                finished.extend(concurrent.futures.wait(pending)[0])
+
+        failure = None
+        for future in finished:
+            status, body = future.result()
+            if status != 200:
+                failure = failure or (status, body)
+
+        return checksum.hexdigest().lower(), failure
+
+    def _upload_file_post(self, file_name, target_dir):
+        """Upload a file in a single POST request (hubs without ranged uploads)."""
         scheme, netloc, path, params, query, fragment = urlparse.urlparse("%s/upload/" % self._hub_url)
         if ":" in netloc:
             host, port = netloc.split(":", 1)
@@ -478,7 +613,7 @@ class HubProxy(object):
         upload_id, upload_key = self.upload.register_upload(os.path.basename(file_name), checksum, fsize, target_dir)
 
         secure = (scheme == "https")
-        upload = kobo.http.POSTTransport()
+        upload = kobo.http.POSTTransport(connection_pool=self.connection_pool)
         upload.add_variable("upload_id", upload_id)
         upload.add_variable("upload_key", upload_key)
         upload.add_file("file", file_name)
@@ -486,6 +621,78 @@ class HubProxy(object):
         err_code, err_msg = upload.send_to_host(host, path, port, secure)
         return upload_id, err_code, err_msg
 
+    def _get_hub_features(self):
+        """Return optional features of the hub (see worker.get_hub_features), {} for old hubs."""
+        if self._hub_features is None:
+            try:
+                self._hub_features = self._hub.worker.get_hub_features()
+            except xmlrpclib.Fault:
+                self._hub_features = {}
+        return self._hub_features
+
+    def _put_task_log(self, file_obj, url, append, mode):
+        """
+        Upload a task log in binary PUT requests (see upload_task_log).
+
+        On failure, file_obj is left at the start of the chunk which
+        hasn't been uploaded.
+
+        @return: True on success, False if the hub refused the upload
+        @rtype: bool
+        """
+        scheme, netloc = urlparse.urlparse(self._hub_url)[:2]
+        if ":" in netloc:
+            host, port = netloc.split(":", 1)
+        else:
+            host, port = netloc, None
+
+        cookie_request = urllib2.Request("%s://%s/" % (scheme, netloc))
+        cookiejar = getattr(self._transport, "cookiejar", None)
+        if cookiejar is not None:
+            cookiejar.add_cookie_header(cookie_request)
+        cookie = cookie_request.get_header("Cookie")
+
+        first = True
+        while True:
+            chunk_start = file_obj.tell()
+            chunk = file_obj.read(TASK_LOG_CHUNK_SIZE)
+            if not chunk and (append or not first):
+                break
+            first = False
+
+            query = {"mode": "%o" % mode}
+            if not append:
+                query["offset"] = chunk_start
+
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "X-Kobo-Checksum": hashlib.sha256(chunk).hexdigest().lower(),
+            }
+            if cookie:
+                headers["Cookie"] = cookie
+
+            selector = "%s?%s" % (url, urlparse.urlencode(query))
+            try:
+                status, data = kobo.http.send_pooled(
+                    self.connection_pool, host, port, scheme == "https",
+                    functools.partial(self._send_put, selector=selector, body=chunk, headers=headers),
+                )
+            except:
+                file_obj.seek(chunk_start)
+                raise
+
+            if status != 200:
+                self._logger and self._logger.warning("Failed to upload task log over HTTP: %s %s" % (status, data[:200]))
+                file_obj.seek(chunk_start)
+                return False
+
+        return True
+
+    @staticmethod
+    def _send_put(request, selector, body, headers):
+        request.request("PUT", selector, body, headers)
+        return request.getresponse()
+
     def upload_task_log(self, file_obj, task_id, remote_file_name, append=True, mode=0o644):
         """
         Upload a task log to the hub.
@@ -502,6 +709,20 @@ class HubProxy(object):
         @type  mode: int
         """
 
+        upload_url = self._get_hub_features().get("upload_task_log_url")
+        if upload_url:
+            start = file_obj.tell()
+            url = upload_url % {"task_id": int(task_id), "path": urlparse.quote(remote_file_name)}
+            try:
+                if self._put_task_log(file_obj, url, append, mode):
+                    return
+            except (socket.error, httplib.HTTPException) as ex:
+                self._logger and self._logger.warning("Failed to upload task log over HTTP: %s" % ex)
+            # fall back to XML-RPC, it deals with authentication and retries;
+            # appended chunks which made it to the hub are not sent again
+            if not append:
+                file_obj.seek(start)
+
         for (chunk_start, chunk_len, chunk_checksum, encoded_chunk) in kobo.xmlrpc.encode_xmlrpc_chunks_iterator(file_obj):
             if append:
                 chunk_start = -1
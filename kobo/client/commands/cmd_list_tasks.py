@@ -7,6 +7,8 @@ try:
 except ImportError:
     import simplejson as json
 
+from six.moves.xmlrpc_client import Fault
+
 from kobo.client import ClientCommand
 from kobo.client.constants import TASK_STATES
 
@@ -47,6 +49,23 @@ class List_Tasks(ClientCommand):
             help="print results in json",
         )
 
+    def _get_tasks(self, state_list, page_size=1000):
+        """Get tasks in given states ordered by id, page by page."""
+        result = []
+        options = {"limit": page_size}
+        while True:
+            try:
+                tasks = self.hub.client.get_tasks([], state_list, options)
+            except Fault:
+                if result:
+                    raise
+                # older hubs don't take options and return all tasks at once
+                return sorted(self.hub.client.get_tasks([], state_list), key=lambda x: x["id"])
+            result.extend(tasks)
+            if len(tasks) < page_size:
+                return result
+            options["after_id"] = tasks[-1]["id"]
+
     def run(self, *args, **kwargs):
         username = kwargs.pop("username", None)
         password = kwargs.pop("password", None)
@@ -67,7 +86,7 @@ class List_Tasks(ClientCommand):
             self.parser.error("Use at least one from --free or --running options.")
 
         self.set_hub(username, password, hub)
-        result = sorted(self.hub.client.get_tasks([], filters), key=lambda x: x["id"])
+        result = self._get_tasks(filters)
         if use_json:
             print(json.dumps(result, indent=2, sort_keys=True))
         elif verbose:
@@ -3,6 +3,7 @@
 import sys
 import time
 import six.moves.urllib.request as urllib2
+from six.moves.urllib.error import HTTPError
 try:
     import json
 except ImportError:
@@ -32,7 +33,8 @@ class Watch_Log(ClientCommand):
             "--poll",
             default=MIN_POLL_INTERVAL,
             type="int",
-            help="Interval how often server should be polled for new info (seconds >= %s)" % MIN_POLL_INTERVAL
+            help="Interval how often server should be polled for new info (seconds >= %s), "
+                 "used only with hubs not supporting log streaming" % MIN_POLL_INTERVAL
         )
 
         self.parser.add_option(
@@ -61,6 +63,20 @@ class Watch_Log(ClientCommand):
         url = hub.replace('/xmlrpc', '') + '/task/%d/log-json/%s?offset=%d'
         offset = 0
         assert url.startswith(("http:", "https:"))
+
+        if not kwargs['nowait']:
+            stream_url = hub.replace('/xmlrpc', '') + '/task/%d/log-stream/%s?offset=%d'
+            try:
+                # the hub closes the stream after a while, reconnect
+                while True:
+                    offset, finished = self._follow(stream_url % (task_id, kwargs['type'], offset), offset)
+                    if finished:
+                        return
+            except HTTPError as ex:
+                if ex.code != 404:
+                    raise
+                # hub without log streaming, poll it
+
         while True:
             data = json.loads(
                 urllib2.urlopen(url % # nosec B310
@@ -79,3 +95,35 @@ class Watch_Log(ClientCommand):
             # it now. Otherwise, stick with the user's requested poll interval
             if next_poll != 0:
                 time.sleep(kwargs['poll'])
+
+    def _follow(self, url, offset):
+        """Print log content from a server-sent events stream.
+
+        Returns (offset, finished) when the stream is closed.
+        """
+        response = urllib2.urlopen(url)  # nosec B310
+        event = data = None
+        for line in response:
+            line = line.decode("utf-8").rstrip("\r\n")
+            if not line:
+                # end of event
+                if event == "finished":
+                    return offset, True
+                if data is not None:
+                    data = json.loads(data)
+                    sys.stdout.write(data['content'])
+                    sys.stdout.flush()
+                    offset = data['new_offset']
+                event = data = None
+                continue
+            if line.startswith(":"):
+                # keepalive comment
+                continue
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "event":
+                event = value
+            elif field == "data":
+                data = value
+        return offset, False
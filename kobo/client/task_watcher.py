@@ -5,6 +5,7 @@ from __future__ import print_function
 import sys
 import time
 import six
+from six.moves import xmlrpc_client
 
 
 __all__ = (
@@ -22,6 +23,49 @@ def display_tasklist_status(task_list):
     print("--> " + " ".join(( "%s: %s" % (key, state_dict[key]) for key in sorted(state_dict) )) + " [total: %s]" % sum(state_dict.values()))
 
 
+def _follow_task_changes(hub, task_list, sleep_time):
+    """Update watchers from the hub's change feed until all tasks finish.
+
+    Each tick costs a single get_task_changes call returning only the tasks
+    which changed.  Returns False if the hub doesn't support the call.
+    """
+    watchers = dict((task.task_id, task) for task in task_list)
+    root_ids = sorted(watchers)
+    token = ""
+    while True:
+        try:
+            result = hub.client.get_task_changes(root_ids, token)
+        except xmlrpc_client.Fault:
+            if not token:
+                # older hub, fall back to task_info() calls
+                return False
+            raise
+        token = result["token"]
+
+        for task_id in result["missing"]:
+            print("No such task id: %s" % task_id)
+            sys.exit(1)
+
+        changed = False
+        # parents have lower IDs than their subtasks
+        for task_info in result["tasks"]:
+            watcher = watchers.get(task_info["id"])
+            if watcher is None:
+                parent = watchers.get(task_info["parent"])
+                if parent is None:
+                    continue
+                watcher = TaskWatcher(parent.hub, task_info["id"], parent.indentation_level + 1)
+                parent.subtask_dict[watcher.task_id] = watcher
+                watchers[watcher.task_id] = watcher
+            changed |= watcher.set_task_info(task_info)
+
+        if changed:
+            display_tasklist_status(task_list)
+        if result["finished"]:
+            return True
+        time.sleep(sleep_time)
+
+
 def watch_tasks(hub, task_id_list, indentation_level=0, sleep_time=1, task_url=None):
     """Watch the task statuses until they finish."""
     if not task_id_list:
@@ -38,6 +82,9 @@ def watch_tasks(hub, task_id_list, indentation_level=0, sleep_time=1, task_url=N
             if task_url is not None:
                 print("Task url: %s" % (task_url % task_id))
 
+        if _follow_task_changes(hub, task_list, sleep_time):
+            return True
+
         while True:
             all_done = True
             changed = False
@@ -103,18 +150,29 @@ class TaskWatcher(object):
         if self.is_finished():
             return False
 
-        last = self.task_info
-        self.task_info = self.hub.client.task_info(self.task_id, False)
+        task_info = self.hub.client.task_info(self.task_id, False)
 
-        if self.task_info is None:
+        if task_info is None:
             print("No such task id: %s" % self.task_id)
             sys.exit(1)
 
         # watch new tasks
-        for i in self.task_info.get("subtask_id_list", []):
+        for i in task_info.get("subtask_id_list", []):
             if i not in self.subtask_dict:
                 self.subtask_dict[i] = TaskWatcher(self.hub, i, self.indentation_level + 1)
 
+        changed = self.set_task_info(task_info)
+
+        # update all subtasks
+        for key in sorted(self.subtask_dict.keys()):
+            changed |= self.subtask_dict[key].update()
+        return changed
+
+    def set_task_info(self, task_info):
+        """Set new task info and log if needed. Returns True on state change."""
+        last = self.task_info
+        self.task_info = task_info
+
         changed = False
         state = self.task_info["state"]
         if last:
@@ -127,10 +185,6 @@ class TaskWatcher(object):
             # first time we're seeing this task, so just show the current state
             print("%s: %s" % (self, self.display_state(self.task_info)))
             changed = True
-
-        # update all subtasks
-        for key in sorted(self.subtask_dict.keys()):
-            changed |= self.subtask_dict[key].update()
         return changed
 
     def get_state_dict(self):
@@ -3,7 +3,7 @@
 
 import django.contrib.admin as admin
 
-from .models import FileUpload
+from .models import FileUpload, FileUploadRange
 
 
 class FileUploadAdmin(admin.ModelAdmin):
@@ -12,3 +12,10 @@ class FileUploadAdmin(admin.ModelAdmin):
     search_fields = ('id', 'upload_key', 'name', 'dt_created', 'dt_finished')
 
 admin.site.register(FileUpload, FileUploadAdmin)
+
+
+class FileUploadRangeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'upload', 'offset', 'size', 'checksum')
+    raw_id_fields = ('upload',)
+
+admin.site.register(FileUploadRange, FileUploadRangeAdmin)
@@ -0,0 +1,32 @@
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('upload', '0002_alter_fileupload_size'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileupload',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='FileUploadRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField(validators=[django.core.validators.MinValueValidator(0)])),
+                ('size', models.BigIntegerField(validators=[django.core.validators.MinValueValidator(0)])),
+                ('checksum', models.CharField(max_length=255)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='upload.fileupload')),
+            ],
+            options={
+                'ordering': ('upload', 'offset'),
+                'unique_together': {('upload', 'offset')},
+            },
+        ),
+    ]
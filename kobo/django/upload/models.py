@@ -25,7 +25,8 @@ UPLOAD_STATES = Enum(
 class FileUpload(models.Model):
     owner       = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name        = models.CharField(max_length=255)
-    checksum    = models.CharField(max_length=255)
+    # empty until a ranged upload is finished
+    checksum    = models.CharField(max_length=255, blank=True)
     # models.PositiveBigIntegerField would be even better but it was introduced only in Django 3.1
     size        = models.BigIntegerField(validators=[MinValueValidator(0)])
     target_dir = models.CharField(max_length=255)
@@ -54,6 +55,10 @@ class FileUpload(models.Model):
     def get_full_path(self):
         return os.path.abspath(os.path.join(self.target_dir, self.name))
 
+    def get_part_path(self):
+        """Path to the incomplete file of a ranged upload."""
+        return os.path.abspath(os.path.join(self.target_dir, ".%s.upload-%s" % (self.name, self.id)))
+
     def __str__(self):
         return six.text_type(os.path.join(self.target_dir, self.name))
 
@@ -76,6 +81,12 @@ class FileUpload(models.Model):
 
     def delete(self):
         super(FileUpload, self).delete()
+        try:
+            os.unlink(self.get_part_path())
+        except OSError as ex:
+            if ex.errno != 2:
+                raise
+
         # if file was successfully uploaded it should be removed from
         # filesystem, otherwise it shouldn't be there
         if self.state == UPLOAD_STATES['FINISHED']:
@@ -99,3 +110,25 @@ class FileUpload(models.Model):
                     except OSError as ex:
                         break
                     file_dir = os.path.split(file_dir)[0]
+
+
+@six.python_2_unicode_compatible
+class FileUploadRange(models.Model):
+    """A received range of a ranged (resumable) upload."""
+    upload      = models.ForeignKey(FileUpload, related_name="ranges", on_delete=models.CASCADE)
+    offset      = models.BigIntegerField(validators=[MinValueValidator(0)])
+    size        = models.BigIntegerField(validators=[MinValueValidator(0)])
+    checksum    = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ("upload", "offset")
+        unique_together = (
+            ("upload", "offset"),
+        )
+
+    def export(self):
+        # offsets may not fit xmlrpc.client.MAXINT
+        return [str(self.offset), str(self.size), self.checksum]
+
+    def __str__(self):
+        return six.text_type("%s [%s+%s]" % (self.upload, self.offset, self.size))
@@ -8,11 +8,11 @@ import shutil
 import os
 import datetime
 
-from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseForbidden, HttpResponseServerError
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseForbidden, HttpResponseServerError
 from django.views.decorators.csrf import csrf_exempt
 from kobo.decorators import well_behaved
 
-from .models import UPLOAD_STATES, FileUpload
+from .models import UPLOAD_STATES, FileUpload, FileUploadRange
 
 
 @well_behaved
@@ -26,11 +26,81 @@ def catch_exceptions(old_view):
     return new_view
 
 
+def _read_request_body(request, block_size=1024 ** 2):
+    """Generator that returns request body in blocks without loading it to memory."""
+    while 1:
+        data = request.read(block_size)
+        if not data:
+            break
+        yield data
+
+
+def _file_upload_range(request):
+    """
+    Receive a range of a ranged upload (see upload.register_ranged_upload).
+
+    Query arguments: upload_id, upload_key, offset.
+    The X-Kobo-Checksum header must contain sha256 checksum of the range.
+    """
+    try:
+        upload = FileUpload.objects.get(id=request.GET.get("upload_id"), upload_key=request.GET.get("upload_key"))
+    except:
+        return HttpResponseForbidden(b"Not allowed to upload the file.")
+
+    if upload.state not in (UPLOAD_STATES["NEW"], UPLOAD_STATES["STARTED"]):
+        return HttpResponseForbidden(b"Upload is not in progress.")
+
+    try:
+        offset = int(request.GET["offset"])
+    except (KeyError, ValueError):
+        offset = -1
+    range_checksum = request.META.get("HTTP_X_KOBO_CHECKSUM", "").lower()
+    if offset < 0 or not range_checksum:
+        return HttpResponseBadRequest(b"Invalid offset or missing X-Kobo-Checksum header.")
+    if offset + int(request.META.get("CONTENT_LENGTH") or 0) > upload.size:
+        return HttpResponseBadRequest(b"Range exceeds file size.")
+
+    if upload.state == UPLOAD_STATES["NEW"]:
+        # ranges are received in parallel, don't overwrite other fields
+        FileUpload.objects.filter(id=upload.id, state=UPLOAD_STATES["NEW"]).update(state=UPLOAD_STATES["STARTED"])
+
+    os.makedirs(upload.target_dir, exist_ok=True)
+
+    # ranges are written in parallel, don't truncate or lock the file
+    checksum = hashlib.sha256()
+    size = 0
+    fd = os.open(upload.get_part_path(), os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        for chunk in _read_request_body(request):
+            # Content-Length is missing in chunked requests
+            if offset + size + len(chunk) > upload.size:
+                return HttpResponseBadRequest(b"Range exceeds file size.")
+            checksum.update(chunk)
+            while chunk:
+                written = os.pwrite(fd, chunk, offset + size)
+                size += written
+                chunk = chunk[written:]
+    finally:
+        os.close(fd)
+
+    if checksum.hexdigest().lower() != range_checksum:
+        return HttpResponseBadRequest(b"Checksum mismatch.")
+
+    FileUploadRange.objects.update_or_create(upload=upload, offset=offset, defaults={
+        "size": size,
+        "checksum": range_checksum,
+    })
+    return HttpResponse(b"Range received.")
+
+
 @csrf_exempt
 @catch_exceptions
 def file_upload(request):
+    if request.method == "PUT":
+        return _file_upload_range(request)
+
     if request.method != "POST":
-        return HttpResponseNotAllowed(["POST"])
+        return HttpResponseNotAllowed(["POST", "PUT"])
 
     upload_id = request.POST.get("upload_id")
     upload_key = request.POST.get("upload_key")
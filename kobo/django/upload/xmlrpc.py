@@ -1,27 +1,38 @@
 # -*- coding: utf-8 -*-
 
 
+import datetime
 import os
 
 from django.conf import settings
+from django.db import transaction
 
-from .models import FileUpload
+from .models import UPLOAD_STATES, FileUpload
 from kobo.django.xmlrpc.decorators import login_required
+from kobo.shortcuts import compute_file_checksums
 
 
 __all__ = (
     "register_upload",
+    "register_ranged_upload",
+    "get_upload_ranges",
+    "finish_upload",
     "delete_upload",
 )
 
 
-@login_required
-def register_upload(request, name, checksum, size, target_dir):
+def _get_target_dir(target_dir):
     upload_dir = getattr(settings, "UPLOAD_DIR", None)
     if upload_dir is not None:
         target_dir = os.path.join(upload_dir, target_dir)
         if not target_dir.startswith(upload_dir):
             raise RuntimeError("Target directory (%s) is outside upload dir: %s" % (target_dir, upload_dir))
+    return target_dir
+
+
+@login_required
+def register_upload(request, name, checksum, size, target_dir):
+    target_dir = _get_target_dir(target_dir)
 
     upload = FileUpload()
     upload.owner = request.user
@@ -33,6 +44,117 @@ def register_upload(request, name, checksum, size, target_dir):
     upload.save()
     return (upload.id, upload.upload_key)
 
+@login_required
+def register_ranged_upload(request, name, size, target_dir):
+    """
+    Register a resumable upload of a file sent in ranges.
+
+    Ranges are sent in PUT requests to the upload URL (see
+    kobo.django.upload.views.file_upload), possibly in parallel and in
+    any order.  Checksum of the whole file is passed to finish_upload().
+
+    @param name: file name
+    @type  name: str
+    @param size: file size (str if it doesn't fit xmlrpc.client.MAXINT)
+    @type  size: int
+    @param target_dir: target directory (relative to settings.UPLOAD_DIR if set)
+    @type  target_dir: str
+    @return: (upload_id, upload_key)
+    @rtype: (int, str)
+    """
+    upload = FileUpload()
+    upload.owner = request.user
+    upload.name = name
+    upload.size = int(size)
+    upload.target_dir = _get_target_dir(target_dir)
+    upload.save()
+    return (upload.id, upload.upload_key)
+
+
+@login_required
+def get_upload_ranges(request, upload_id):
+    """
+    Get ranges of a ranged upload received so far.
+
+    @param upload_id: upload ID
+    @type  upload_id: int
+    @return: [[offset, size, sha256 checksum]], offsets and sizes are str
+    @rtype: list
+    """
+    upload = FileUpload.objects.get(id=upload_id, owner=request.user)
+    return [i.export() for i in upload.ranges.all()]
+
+
+@login_required
+def finish_upload(request, upload_id, checksum):
+    """
+    Finish a ranged upload: check all ranges have been received and move
+    the file to the target directory.
+
+    Ranges are verified when they're received, the file is read once more
+    to verify the checksum of the whole file.
+
+    @param upload_id: upload ID
+    @type  upload_id: int
+    @param checksum: sha256 checksum of the whole file
+    @type  checksum: str
+    @rtype: bool
+    """
+    upload = FileUpload.objects.get(id=upload_id, owner=request.user)
+    if upload.state not in (UPLOAD_STATES["NEW"], UPLOAD_STATES["STARTED"]):
+        raise RuntimeError("Upload is not in progress: %s" % upload_id)
+
+    position = 0
+    for offset, size in upload.ranges.values_list("offset", "size"):
+        if offset != position:
+            break
+        position += size
+    if position != upload.size:
+        raise RuntimeError("Missing data at offset %s" % position)
+
+    upload_path = upload.get_full_path()
+    part_path = upload.get_part_path()
+    file_checksum = None
+    if not os.path.isfile(upload_path):
+        if not os.path.isdir(upload.target_dir):
+            os.makedirs(upload.target_dir)
+        # creates an empty file if no range has been sent
+        with open(part_path, "ab") as f:
+            f.truncate(upload.size)
+        # reading a large file takes long, don't hold the row lock meanwhile
+        file_checksum = compute_file_checksums(part_path, "sha256")["sha256"]
+
+    with transaction.atomic():
+        upload = FileUpload.objects.select_for_update().get(id=upload_id, owner=request.user)
+        if upload.state not in (UPLOAD_STATES["NEW"], UPLOAD_STATES["STARTED"]):
+            # finished by a concurrent call
+            raise RuntimeError("Upload is not in progress: %s" % upload_id)
+
+        # upload.save can also fail the upload if there is a race
+        error = "File already exists."
+        if file_checksum is None or os.path.isfile(upload_path):
+            # don't raise here, the state change would be rolled back
+            upload.state = UPLOAD_STATES["FAILED"]
+            upload.save()
+        elif file_checksum != checksum.lower():
+            error = "Checksum mismatch."
+            upload.state = UPLOAD_STATES["FAILED"]
+            upload.save()
+        else:
+            os.rename(part_path, upload_path)
+
+            upload.checksum = checksum.lower()
+            upload.state = UPLOAD_STATES["FINISHED"]
+            upload.dt_finished = datetime.datetime.now()
+            upload.save()
+            upload.ranges.all().delete()
+
+    if upload.state == UPLOAD_STATES["FAILED"]:
+        raise RuntimeError(error)
+
+    return True
+
+
 @login_required
 def delete_upload(request, upload_id):
     try:
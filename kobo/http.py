@@ -7,10 +7,73 @@
 from six.moves import http_client as httplib
 import mimetypes
 import os
+import socket
+import ssl
 
 from kobo.shortcuts import random_string
 
 
+__all__ = (
+    "POSTTransport",
+    "send_pooled",
+)
+
+
+def send_pooled(connection_pool, host, port, secure, send):
+    """
+    Send a request over a pooled keep-alive connection.
+
+    A pooled connection may have been closed by the server meanwhile,
+    the request is sent again over another connection then.
+
+    @param connection_pool: pool of keep-alive connections (None for a new connection)
+    @type connection_pool: kobo.xmlrpc.ConnectionPool
+    @param host: host address
+    @type host: str
+    @param port: port number
+    @type port: int
+    @param secure: use https
+    @type secure: bool
+    @param send: send(connection) sends the request and returns the response
+    @type send: callable
+    @return: (response status code, response data body)
+    @rtype: (int, str)
+    """
+    def new_connection():
+        if secure:
+            return httplib.HTTPSConnection(host, port) # nosec B309
+        return httplib.HTTPConnection(host, port)
+
+    pool_key = (secure and "https" or "http", (port and "%s:%s" % (host, port) or host).lower())
+    reused = False
+    while True:
+        if connection_pool is None:
+            request = new_connection()
+        else:
+            request, reused = connection_pool.acquire(pool_key, new_connection)
+
+        try:
+            response = send(request)
+            data = response.read()
+        except (httplib.CannotSendRequest, socket.error):
+            request.close()
+            if reused:
+                # pooled connection has been closed by the server meanwhile, try another one
+                continue
+            raise
+        except:
+            request.close()
+            raise
+        break
+
+    if connection_pool is None:
+        request.close()
+    else:
+        connection_pool.release(pool_key, request, response)
+
+    return response.status, data
+
+
 class POSTTransport(object):
     """
     POST transport.
@@ -23,7 +86,19 @@ class POSTTransport(object):
         t.send_to_host("somehost", "/cgi-bin/upload")
     """
 
-    def __init__(self):
+    # block size for sending files over TLS or with zero_copy disabled
+    SEND_BLOCK_SIZE = 4 * 1024**2
+
+    def __init__(self, connection_pool=None, zero_copy=True):
+        """
+        @param connection_pool: pool of keep-alive connections to use
+        @type connection_pool: kobo.xmlrpc.ConnectionPool
+        @param zero_copy: send files with sendfile() on plain HTTP connections
+                          and from a reused buffer over TLS
+        @type zero_copy: bool
+        """
+        self.connection_pool = connection_pool
+        self.zero_copy = zero_copy
         self._variables = []
         self._files = []
         self._boundary = random_string(32)
@@ -117,11 +192,18 @@ class POSTTransport(object):
         content_length += len(footer_data)
         content_type = "multipart/form-data; boundary=" + self._boundary
 
-        if secure:
-            request = httplib.HTTPSConnection(host, port) # nosec B309
-        else:
-            request = httplib.HTTPConnection(host, port)
+        status, data = send_pooled(
+            self.connection_pool, host, port, secure,
+            lambda request: self._send(request, selector, content_type, content_length, variables_data, files, footer_data),
+        )
+
+        if flush:
+            self.flush_data()
 
+        return status, data
+
+    def _send(self, request, selector, content_type, content_length, variables_data, files, footer_data):
+        """Send the request body prepared by send_to_host(), return the response."""
         request.putrequest("POST", selector)
         request.putheader("content-type", content_type)
         request.putheader("content-length", str(content_length))
@@ -130,18 +212,35 @@ class POSTTransport(object):
         request.send(b"\r\n")
         for file_name, file_data in files:
             request.send(file_data)
-            file_obj = open(file_name, "rb")
-            while 1:
-                chunk = file_obj.read(1024**2)
-                if not chunk:
-                    break
-                request.send(chunk)
+            with open(file_name, "rb") as file_obj:
+                self._send_file(request, file_obj)
             request.send(b"\r\n")
 
         request.send(footer_data)
-        response = request.getresponse()
+        return request.getresponse()
 
-        if flush:
-            self.flush_data()
-
-        return response.status, response.read()
+    def _send_file(self, request, file_obj):
+        """Send file contents over a connection with request headers already sent."""
+        sock = getattr(request, "sock", None)
+        if not self.zero_copy or not isinstance(sock, socket.socket):
+            while 1:
+                chunk = file_obj.read(self.SEND_BLOCK_SIZE)
+                if not chunk:
+                    break
+                request.send(chunk)
+            return
+
+        if not isinstance(sock, ssl.SSLSocket):
+            # the kernel copies data from the page cache to the socket
+            sock.sendfile(file_obj)
+            return
+
+        # data has to be encrypted in userspace, avoid allocating a new
+        # bytes object for every block
+        buf = bytearray(self.SEND_BLOCK_SIZE)
+        view = memoryview(buf)
+        while 1:
+            size = file_obj.readinto(buf)
+            if not size:
+                break
+            sock.sendall(view[:size])
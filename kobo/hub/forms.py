@@ -5,6 +5,7 @@ import django.forms as forms
 from django.db.models import Q
 from kobo.django.helpers import call_if_callable
 from kobo.hub.models import Task
+from kobo.hub.task_search import search_query, validate_search
 
 
 class TaskSearchForm(forms.Form):
@@ -16,6 +17,14 @@ class TaskSearchForm(forms.Form):
         self.order_by = kwargs.pop('order_by', ['-id'])
         return super(TaskSearchForm, self).__init__(*args, **kwargs)
 
+    def clean_search(self):
+        search = self.cleaned_data["search"]
+        try:
+            validate_search(search)
+        except ValueError as ex:
+            raise forms.ValidationError(str(ex))
+        return search
+
     def get_query(self, request):
         self.is_valid()
         search = self.cleaned_data["search"]
@@ -24,9 +33,8 @@ class TaskSearchForm(forms.Form):
         query = Q()
 
         if search:
-            query |= Q(method__icontains=search)
-            query |= Q(owner__username__icontains=search)
-            query |= Q(label__icontains=search)
+            # see kobo.hub.task_search for the syntax
+            query &= search_query(search)
 
         if my and call_if_callable(request.user.is_authenticated):
             query &= Q(owner=request.user)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Worker last-seen tracking.
+
+Workers call the hub several times per poll.  Instead of writing the time
+of every call, it is written at most once per
+settings.WORKER_LAST_SEEN_INTERVAL seconds (60 by default) per worker:
+to the cache backend named by settings.WORKER_LAST_SEEN_CACHE ("default")
+and to the worker state file in WORKER_DIR, which keeps the value across
+hub restarts and is shared by hub processes not sharing the cache.
+Reported times are therefore up to that interval old.
+"""
+
+
+import datetime
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+__all__ = (
+    "get_last_seen",
+    "prefetch_last_seen",
+    "update_last_seen",
+)
+
+
+# time of the last write by this process, saves cache lookups
+_written = {}
+
+
+def _get_interval():
+    return getattr(settings, "WORKER_LAST_SEEN_INTERVAL", 60)
+
+
+def _get_cache():
+    return caches[getattr(settings, "WORKER_LAST_SEEN_CACHE", "default")]
+
+
+def _cache_key(worker):
+    return "kobo.hub.last_seen.%s" % os.path.basename(worker._state_path)
+
+
+def update_last_seen(worker, force=False):
+    """
+    Mark worker as having communicated with hub at the current time.
+
+    @param worker: worker
+    @type  worker: kobo.hub.models.Worker
+    @param force: write even if the time has been written recently
+    @type  force: bool
+    @return: True if the time has been written
+    @rtype: bool
+    """
+    now = time.time()
+    key = _cache_key(worker)
+    interval = _get_interval()
+    cache = _get_cache()
+
+    if not force:
+        if now - _written.get(key, 0) < interval:
+            return False
+        # written by another hub process
+        written = cache.get(key)
+        if written is not None and now - written < interval:
+            _written[key] = written
+            return False
+
+    with open(worker._state_path, "w"):
+        pass
+    cache.set(key, now, None)
+    _written[key] = now
+    return True
+
+
+def get_last_seen(workers):
+    """
+    Get time of the last communication of workers with hub.
+
+    Times are looked up in the cache in a single call.  Cached times older
+    than WORKER_LAST_SEEN_INTERVAL may be outdated if the cache is not
+    shared by hub processes, state files are checked for them and for
+    workers missing in the cache, the newer time wins.
+
+    @param workers: workers
+    @type  workers: iterable of kobo.hub.models.Worker
+    @return: {worker id: datetime.datetime in UTC or None if unknown}
+    @rtype: dict
+    """
+    keys = dict((worker.id, _cache_key(worker)) for worker in workers)
+    if not keys:
+        return {}
+
+    cached = _get_cache().get_many(list(keys.values()))
+    now = time.time()
+    interval = _get_interval()
+
+    result = {}
+    for worker in workers:
+        value = cached.get(keys[worker.id])
+        if value is None or now - value >= interval:
+            # written by a hub process using another cache
+            try:
+                value = max(value or 0, os.stat(worker._state_path).st_mtime)
+            except FileNotFoundError:
+                pass
+        result[worker.id] = value and datetime.datetime.utcfromtimestamp(value) or None
+    return result
+
+
+def prefetch_last_seen(workers):
+    """
+    Look up last_seen of workers in a single batch, Worker.last_seen
+    of the given objects then doesn't look it up again.
+
+    @param workers: workers
+    @type  workers: iterable of kobo.hub.models.Worker
+    @return: the workers
+    @rtype: list
+    """
+    workers = list(workers)
+    last_seen = get_last_seen(workers)
+    for worker in workers:
+        worker._prefetched_last_seen = last_seen[worker.id]
+    return workers
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Notification of task log changes for clients following logs.
+
+Log uploads handled by this hub process wake up the followers immediately.
+Uploads handled by other processes are noticed after at most
+settings.LOG_STREAM_POLL_INTERVAL seconds (1 by default), the followers
+check the logs that often anyway.
+"""
+
+
+import threading
+
+from django.conf import settings
+
+
+__all__ = (
+    "notify_log_changed",
+    "wait_for_log_change",
+)
+
+
+_condition = threading.Condition()
+
+
+def notify_log_changed():
+    """Wake up all followers waiting in wait_for_log_change()."""
+    with _condition:
+        _condition.notify_all()
+
+
+def wait_for_log_change(timeout=None):
+    """
+    Wait until a log is uploaded to this hub process or until the poll
+    interval passes.
+
+    @param timeout: maximum time to wait, LOG_STREAM_POLL_INTERVAL by default
+    @type  timeout: float
+    @return: False if the wait timed out
+    @rtype: bool
+    """
+    if timeout is None:
+        timeout = getattr(settings, "LOG_STREAM_POLL_INTERVAL", 1)
+    with _condition:
+        return _condition.wait(timeout)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+import os
+
+from django.core.management.base import BaseCommand
+
+from kobo.client.constants import FINISHED_STATES
+from kobo.hub.models import Task
+
+
+class Command(BaseCommand):
+    help = "Compress logs of finished tasks left uncompressed (e.g. when a hub process exited before compressing them)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "task_id",
+            type=int,
+            nargs="*",
+            help="Compress logs of these tasks only (default: all finished tasks)",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=0,
+            help="Only tasks finished in the last DAYS days (default: all)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tasks loaded at once (default: %(default)s)",
+        )
+
+    def _uncompressed_logs(self, task):
+        result = []
+        for root, _, files in os.walk(task.task_dir()):
+            result.extend(os.path.join(root, i) for i in files if i.endswith(".log"))
+        return result
+
+    def handle(self, *args, **options):
+        # archived tasks have logs too
+        tasks = Task._base_manager.filter(state__in=FINISHED_STATES)
+        if options["task_id"]:
+            tasks = tasks.filter(id__in=options["task_id"])
+        if options["days"]:
+            tasks = tasks.filter(dt_finished__gte=datetime.datetime.now() - datetime.timedelta(days=options["days"]))
+
+        compressed = 0
+        last_id = 0
+        while True:
+            task_ids = list(tasks.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:options["batch_size"]])
+            if not task_ids:
+                break
+            for task_id in task_ids:
+                task = Task(id=task_id)
+                uncompressed = self._uncompressed_logs(task)
+                if uncompressed:
+                    task.logs.gzip_logs()
+                    compressed += len([i for i in uncompressed if not os.path.exists(i)])
+            last_id = task_ids[-1]
+        self.stdout.write("Compressed %s logs" % compressed)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from kobo.hub.models import Task, convert_gzip_log
+
+
+class Command(BaseCommand):
+    help = "Convert gzipped task logs to the seekable block-compressed format."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "task_id",
+            type=int,
+            nargs="*",
+            help="Convert logs of these tasks only (default: all tasks in TASK_DIR)",
+        )
+
+    def handle(self, *args, **options):
+        if options["task_id"]:
+            dirs = [Task.get_task_dir(i) for i in options["task_id"]]
+        else:
+            dirs = [settings.TASK_DIR]
+
+        converted = 0
+        for task_dir in dirs:
+            for root, _, files in os.walk(task_dir):
+                for name in files:
+                    if name.endswith(".log.gz") and convert_gzip_log(os.path.join(root, name)):
+                        converted += 1
+        self.stdout.write("Converted %s logs" % converted)
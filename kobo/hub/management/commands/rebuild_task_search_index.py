@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kobo.hub.models import Task, TaskSearchToken
+
+
+class Command(BaseCommand):
+    help = "Rebuild task search tokens (not used on PostgreSQL, which uses trigram indexes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of tasks indexed at once (default: %(default)s)",
+        )
+
+    def handle(self, *args, **options):
+        if not TaskSearchToken.objects.enabled():
+            raise CommandError("Search tokens are not used with this database.")
+
+        count = 0
+        last_id = 0
+        while True:
+            # archived tasks are indexed too, they can be unarchived
+            tasks = list(Task._base_manager.filter(id__gt=last_id).order_by("id").only("id", "method", "label")[:options["batch_size"]])
+            if not tasks:
+                break
+            TaskSearchToken.objects.index(tasks)
+            count += len(tasks)
+            last_id = tasks[-1].id
+        self.stdout.write("Indexed %s tasks" % count)
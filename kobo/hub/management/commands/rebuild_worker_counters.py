@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+
+from django.core.management.base import BaseCommand
+
+from kobo.hub.models import Worker
+
+
+class Command(BaseCommand):
+    help = "Recompute task count, current load and ready of all workers from their open tasks."
+
+    def handle(self, *args, **options):
+        changed = Worker.objects.rebuild_counters()
+        self.stdout.write("Updated counters of %s workers" % changed)
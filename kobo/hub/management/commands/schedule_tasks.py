@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from kobo.hub.scheduler import schedule_tasks
+
+
+class Command(BaseCommand):
+    help = "Assign FREE tasks to workers (used with TASK_SCHEDULER_ENABLED = True)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running and schedule tasks every INTERVAL seconds (default: run once)",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=10000,
+            help="Maximum number of FREE tasks inspected in one run (default: %(default)s)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.time()
+            result = schedule_tasks(limit=options["limit"])
+            self.stdout.write(
+                "Assigned %(assigned)s tasks, %(conflicts)s conflicts, freed %(freed)s stale tasks, "
+                "dispatch latency avg %(latency_avg).1fs, max %(latency_max).1fs" % result
+                + " (took %.3fs)" % (time.time() - start)
+            )
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
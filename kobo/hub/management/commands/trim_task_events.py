@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from kobo.hub.models import TaskEvent
+
+
+class Command(BaseCommand):
+    help = "Delete old task events (see TASK_EVENTS_RETENTION_DAYS)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "TASK_EVENTS_RETENTION_DAYS", 30),
+            help="Delete events older than DAYS days (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of events deleted in one query (default: %(default)s)",
+        )
+
+    def handle(self, *args, **options):
+        before = datetime.datetime.now() - datetime.timedelta(days=options["days"])
+        deleted = TaskEvent.objects.trim(before, batch_size=options["batch_size"])
+        self.stdout.write("Deleted %s task events" % deleted)
@@ -2,16 +2,88 @@
 
 from __future__ import absolute_import
 
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
 from .models import Worker
 
 
+class WorkerCache(object):
+    """
+    Per-process cache of workers resolved by get_worker().
+
+    Workers are kept for settings.WORKER_CACHE_TTL seconds (60 by default,
+    0 disables the cache) with arches and channels prefetched, so that
+    identifying the worker and Worker.export() need no queries.  Entries
+    are dropped when any worker is saved or deleted in this process; other
+    processes see such changes after the TTL.  Load counters change
+    without saving the worker and, with the other fields used to
+    assign tasks, are reloaded where they're needed (see
+    Worker.refresh_state).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workers = {}
+
+    @property
+    def ttl(self):
+        return getattr(settings, "WORKER_CACHE_TTL", 60)
+
+    def get(self, name):
+        """Return a copy of the cached worker or None."""
+        with self._lock:
+            expires, worker = self._workers.get(name, (0, None))
+        if worker is None or expires < time.time():
+            return None
+        return self._copy(worker)
+
+    def _copy(self, worker):
+        # each request gets its own copy, they may modify it; copy.copy()
+        # would share the model state (_state) on older Django versions
+        field_names = [i.attname for i in Worker._meta.concrete_fields]
+        result = Worker.from_db(worker._state.db, field_names, [getattr(worker, i) for i in field_names])
+        result._prefetched_objects_cache = dict(worker._prefetched_objects_cache)
+        result._static_export = worker._static_export
+        return result
+
+    def add(self, worker):
+        """Prefetch worker relations and cache it, return a copy."""
+        prefetch_related_objects([worker], "arches", "channels")
+        worker.prepare_export()
+        with self._lock:
+            self._workers[worker.name] = (time.time() + self.ttl, worker)
+        return self._copy(worker)
+
+    def clear(self, *args, **kwargs):
+        with self._lock:
+            self._workers.clear()
+
+
+worker_cache = WorkerCache()
+
+post_save.connect(worker_cache.clear, sender=Worker, dispatch_uid="kobo.hub.middleware.worker_cache")
+post_delete.connect(worker_cache.clear, sender=Worker, dispatch_uid="kobo.hub.middleware.worker_cache")
+m2m_changed.connect(worker_cache.clear, sender=Worker.arches.through, dispatch_uid="kobo.hub.middleware.worker_cache.arches")
+m2m_changed.connect(worker_cache.clear, sender=Worker.channels.through, dispatch_uid="kobo.hub.middleware.worker_cache.channels")
+
+
 def get_worker(request):
     try:
         if "/" not in request.user.username:
             return None
 
         hostname = request.user.username.split("/")[1]
-        worker = Worker.objects.get(name=hostname)
+        if not worker_cache.ttl:
+            return Worker.objects.get(name=hostname)
+
+        worker = worker_cache.get(hostname)
+        if worker is None:
+            worker = worker_cache.add(Worker.objects.get(name=hostname))
         return worker
     except:
         return None
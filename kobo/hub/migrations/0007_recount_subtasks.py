@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def recount_subtasks(apps, schema_editor):
+    # subtask_count is maintained incrementally from now on, start from
+    # exact values (deleted subtasks used to be counted until the parent
+    # was saved again)
+    Task = apps.get_model("hub", "Task")
+    subtasks = Task.objects.filter(parent__isnull=False).order_by().values("parent")
+    counts = dict(subtasks.annotate(count=models.Count("id")).values_list("parent", "count"))
+
+    # MySQL can't read hub_task in a subquery of an UPDATE of hub_task,
+    # the counts are computed first and tasks updated in batches
+    changed = {}
+    for task_id, subtask_count in Task.objects.order_by().values_list("id", "subtask_count").iterator():
+        count = counts.get(task_id, 0)
+        if count != subtask_count:
+            changed.setdefault(count, []).append(task_id)
+
+    for count, task_ids in changed.items():
+        for i in range(0, len(task_ids), BATCH_SIZE):
+            Task.objects.filter(id__in=task_ids[i:i + BATCH_SIZE]).update(subtask_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hub', '0006_alter_task_canceled_by'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_subtasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-16 19:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hub', '0007_recount_subtasks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('old_state', models.PositiveIntegerField(blank=True, choices=[(0, 'FREE'), (1, 'ASSIGNED'), (2, 'OPEN'), (3, 'CLOSED'), (4, 'CANCELED'), (5, 'FAILED'), (6, 'INTERRUPTED'), (7, 'TIMEOUT'), (8, 'CREATED')], help_text='State before the event, empty for new tasks.', null=True)),
+                ('state', models.PositiveIntegerField(choices=[(0, 'FREE'), (1, 'ASSIGNED'), (2, 'OPEN'), (3, 'CLOSED'), (4, 'CANCELED'), (5, 'FAILED'), (6, 'INTERRUPTED'), (7, 'TIMEOUT'), (8, 'CREATED')])),
+                ('waiting', models.BooleanField(default=False)),
+                ('dt_created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='hub.task')),
+                ('worker', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='hub.worker')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
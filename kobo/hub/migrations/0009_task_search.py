@@ -0,0 +1,106 @@
+# Generated by Django 4.2.30 on 2026-10-16 19:12
+
+import warnings
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# PostgreSQL looks up substrings using trigram indexes matching the
+# UPPER(column::text) LIKE expressions of icontains lookups
+TRIGRAM_INDEXES = (
+    ("hub_task_method_trgm_idx", "method"),
+    ("hub_task_label_trgm_idx", "label"),
+)
+
+
+TRIGRAM_INDEX_SQL = "CREATE INDEX %s ON hub_task USING gin (UPPER(%s::text) gin_trgm_ops)"
+
+
+def search_tokens(*values):
+    """Copy of kobo.hub.models.search_tokens() at the time of this migration."""
+    result = set()
+    for value in values:
+        value = (value or "").lower()
+        result.update(value[i:i + 3] for i in range(len(value) - 2))
+    return result
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        installed = cursor.fetchone() is not None
+    if not installed:
+        # only database superusers can create the extension
+        warnings.warn(
+            "The pg_trgm extension is not installed, task searches won't use indexes. "
+            "Run 'CREATE EXTENSION pg_trgm' as a superuser and create the indexes: %s"
+            % "; ".join(TRIGRAM_INDEX_SQL % i for i in TRIGRAM_INDEXES)
+        )
+        return
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(TRIGRAM_INDEX_SQL % (name, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+def index_tasks(apps, schema_editor):
+    # other databases look up substrings in the search token table
+    if schema_editor.connection.vendor == "postgresql":
+        return
+    Task = apps.get_model("hub", "Task")
+    TaskSearchToken = apps.get_model("hub", "TaskSearchToken")
+    last_id = 0
+    while True:
+        tasks = list(Task.objects.filter(id__gt=last_id).order_by("id").values_list("id", "method", "label")[:1000])
+        if not tasks:
+            break
+        TaskSearchToken.objects.bulk_create([
+            TaskSearchToken(task_id=task_id, token=token)
+            for task_id, method, label in tasks
+            for token in search_tokens(method, label)
+        ], batch_size=1000)
+        last_id = tasks[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hub', '0008_taskevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskSearchToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['method'], name='hub_task_method_3a04ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['dt_created'], name='hub_task_dt_crea_4f8188_idx'),
+        ),
+        migrations.AddField(
+            model_name='tasksearchtoken',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='hub.task'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tasksearchtoken',
+            unique_together={('token', 'task')},
+        ),
+        migrations.RunPython(index_tasks, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
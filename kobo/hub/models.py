@@ -2,14 +2,18 @@
 
 from __future__ import print_function
 import os
-import errno
 import sys
 import datetime
 import base64
+import bisect
 import gzip
 import shutil
 import logging
-from collections import deque
+import queue
+import struct
+import tempfile
+import threading
+from collections import OrderedDict, deque
 import io
 
 logger =  logging.getLogger("kobo")
@@ -22,20 +26,29 @@ except ImportError:
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
-from django.db import models, connection, transaction
-from django.db.models.signals import post_delete
+from django.db import models, connection, connections, transaction
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, pre_delete
 from django.http import Http404
 import six
 from textwrap import dedent
 
 import kobo.django.fields
+import kobo.hub.last_seen
+import kobo.hub.wakeup
 from kobo.client.constants import TASK_STATES, FINISHED_STATES, FAILED_STATES
-from kobo.shortcuts import random_string, read_from_file, save_to_file, run
+from kobo.shortcuts import random_string, read_from_file, save_to_file
+from kobo.xmlrpc import FILE_CHECKSUM_STATE_SUFFIX
 from kobo.django.compat import gettext_lazy as _
 
 
 LOG_BUFFER_SIZE = 2**20
 
+# compressed logs are written as a series of gzip members, one per block of
+# LOG_BUFFER_SIZE bytes, with an index of their offsets in <log>.gz.idx
+LOG_INDEX_MAGIC = b"KOBOLIX1"
+_LOG_INDEX_ENTRY = struct.Struct("<QQ")
+
 
 def dump_dict(**kwargs):
     """Serialize args dictionary to a json dump."""
@@ -93,6 +106,39 @@ def _utf8_chunk(bytestr):
 
 def _tail(fh, max_size, max_line_size):
     """See TaskLogs.tail"""
+    try:
+        size = fh.seek(0, io.SEEK_END)
+    except (OSError, ValueError):
+        # not seekable from the end, e.g. a compressed log without an index
+        fh.seek(0)
+        return _tail_lines(fh, max_size, max_line_size)
+
+    # the same result as _tail_lines(): the content starts at the first
+    # line start at or after cut, lines longer than max_line_size are split
+    # into max_line_size pieces
+    cut = max(size - max_size, 0)
+    # including the newline before a line starting max_line_size before cut
+    start = max(cut - max_line_size - 1, 0)
+    fh.seek(start)
+    data = fh.read(size - start)
+    pos = cut - start
+
+    if pos > 0 and data[pos - 1:pos] != b"\n":
+        line_start = data.rfind(b"\n", 0, pos) + 1
+        line_end = data.find(b"\n", pos) + 1 or len(data)
+        if line_start or start == 0:
+            pieces = -(-(pos - line_start) // max_line_size)
+            pos = min(line_start + pieces * max_line_size, line_end)
+        elif line_end - pos <= max_line_size:
+            # the line is longer than max_line_size, start at the next one
+            # if it is near, otherwise the line is cut anywhere
+            pos = line_end
+
+    return data[pos:], size
+
+
+def _tail_lines(fh, max_size, max_line_size):
+    """Read the whole file, see TaskLogs.tail"""
     buffer = deque()
     current_size = 0
     offset = 0
@@ -115,6 +161,192 @@ def _tail(fh, max_size, max_line_size):
     return b''.join(buffer), offset
 
 
+def _write_gzip_blocks(src, dst, mtime, block_size=LOG_BUFFER_SIZE):
+    """Compress data read from src to dst as independent gzip members.
+
+    @return: index - [(uncompressed offset, compressed offset)] of each
+             member followed by the total sizes
+    @rtype: list
+    """
+    level = getattr(settings, "TASK_LOG_COMPRESS_LEVEL", 6)
+    index = []
+    offset = 0
+    compressed_offset = 0
+    while True:
+        data = src.read(block_size)
+        if not data and index:
+            break
+        # an empty log still gets one (empty) member to be a valid gzip file
+        member = gzip.compress(data, level, mtime=mtime)
+        dst.write(member)
+        index.append((offset, compressed_offset))
+        offset += len(data)
+        compressed_offset += len(member)
+    index.append((offset, compressed_offset))
+    return index
+
+
+def _read_log_index(gz_path, compressed_size):
+    """Read index of a compressed log.
+
+    @return: index or None if it is missing or doesn't match the log
+    @rtype: list
+    """
+    try:
+        with open(gz_path + ".idx", "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if not data.startswith(LOG_INDEX_MAGIC) or (len(data) - len(LOG_INDEX_MAGIC)) % _LOG_INDEX_ENTRY.size:
+        return None
+    index = list(_LOG_INDEX_ENTRY.iter_unpack(data[len(LOG_INDEX_MAGIC):]))
+    if len(index) < 2 or index[-1][1] != compressed_size:
+        # stale index, e.g. the log has been replaced
+        return None
+    return index
+
+
+class _IndexedGzipReader(io.RawIOBase):
+    """Reader of a compressed log with an index.
+
+    Seeking to any offset decompresses at most one block.
+    """
+
+    def __init__(self, fileobj, index):
+        self._fileobj = fileobj
+        self._index = index
+        self._offsets = [i[0] for i in index]
+        self._size = index[-1][0]
+        self._pos = 0
+        self._reader = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position %s" % offset)
+        if offset != self._pos:
+            self._pos = offset
+            self._reader = None
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self._size:
+            return 0
+        if self._reader is None:
+            i = bisect.bisect_right(self._offsets, self._pos) - 1
+            start, compressed_start = self._index[i]
+            self._fileobj.seek(compressed_start)
+            # reads following members as well
+            self._reader = gzip.GzipFile(fileobj=self._fileobj, mode="rb")
+            self._reader.seek(self._pos - start)
+        length = self._reader.readinto(b)
+        self._pos += length
+        return length
+
+    def close(self):
+        if not self.closed:
+            self._fileobj.close()
+        super(_IndexedGzipReader, self).close()
+
+
+def _open_gzip_log(gz_path):
+    """Open a compressed log for reading, seekable in O(1) if it has an index."""
+    fo = open(gz_path, "rb")
+    index = _read_log_index(gz_path, os.fstat(fo.fileno()).st_size)
+    if index is None:
+        fo.close()
+        return io.BufferedReader(gzip.open(gz_path, "rb"), LOG_BUFFER_SIZE)
+    return io.BufferedReader(_IndexedGzipReader(fo, index), LOG_BUFFER_SIZE)
+
+
+def _write_compressed_log(src, gz_path, st, changed=None):
+    """Write data read from src to gz_path (block-compressed, with an index).
+
+    Both files are written to temporary files first, the index is renamed
+    to place before the log, so readers never see a log without its index.
+
+    @param src: file object to read the uncompressed log from
+    @param gz_path: path of the compressed log
+    @type  gz_path: str
+    @param st: stat of the source; mode and mtime are preserved
+    @type  st: os.stat_result
+    @param changed: function returning True if the source has changed while
+                    being compressed; the log is not written then
+    @type  changed: callable
+    @return: True if the log has been written
+    @rtype: bool
+    """
+    directory, name = os.path.split(gz_path)
+    prefix = ".%s." % name[:-3]
+    tmp_paths = []
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=prefix, suffix=".gz.tmp", dir=directory)
+        tmp_paths.append(tmp_path)
+        with os.fdopen(fd, "wb") as raw:
+            index = _write_gzip_blocks(src, raw, int(st.st_mtime))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        fd, tmp_index_path = tempfile.mkstemp(prefix=prefix, suffix=".idx.tmp", dir=directory)
+        tmp_paths.append(tmp_index_path)
+        with os.fdopen(fd, "wb") as raw:
+            raw.write(LOG_INDEX_MAGIC)
+            for entry in index:
+                raw.write(_LOG_INDEX_ENTRY.pack(*entry))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+        for path in tmp_paths:
+            os.chmod(path, st.st_mode & 0o7777)
+
+        if changed is not None and changed():
+            return False
+
+        os.rename(tmp_index_path, gz_path + ".idx")
+        os.rename(tmp_path, gz_path)
+        tmp_paths = []
+        return True
+    finally:
+        for path in tmp_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def convert_gzip_log(gz_path):
+    """Convert a log compressed by gzip to the block-compressed format.
+
+    @param gz_path: path of the compressed log
+    @type  gz_path: str
+    @return: True if the log has been converted, False if it is already
+             in the block-compressed format or doesn't exist
+    @rtype: bool
+    """
+    try:
+        raw = open(gz_path, "rb")
+    except FileNotFoundError:
+        return False
+
+    with raw:
+        st = os.fstat(raw.fileno())
+        if _read_log_index(gz_path, st.st_size) is not None:
+            return False
+        with gzip.GzipFile(fileobj=raw, mode="rb") as src:
+            return _write_compressed_log(src, gz_path, st)
+
+
 @six.python_2_unicode_compatible
 class Arch(models.Model):
     """Model for hub_arch table."""
@@ -180,6 +412,40 @@ class WorkerManager(models.Manager):
         """Return all enabled workers which are ready."""
         return self.filter(enabled=True, ready=True)
 
+    def rebuild_counters(self, worker_ids=None):
+        """Recompute task_count, current_load and ready of workers from their open tasks.
+
+        Counters are normally maintained by task state transitions, this
+        is meant for recovery.  Tasks are aggregated in a single query.
+
+        @param worker_ids: workers to update (all if None)
+        @type  worker_ids: list
+        @return: number of workers whose counters have changed
+        @rtype: int
+        """
+        tasks = Task.objects.opened().filter(worker__isnull=False)
+        workers = self.all()
+        if worker_ids is not None:
+            tasks = tasks.filter(worker__in=worker_ids)
+            workers = workers.filter(id__in=worker_ids)
+
+        usage = tasks.order_by().values("worker").annotate(
+            task_count=models.Count("id"),
+            current_load=models.Sum("weight", filter=models.Q(waiting=False)),
+        )
+        usage = dict((i["worker"], (i["task_count"], i["current_load"] or 0)) for i in usage)
+
+        changed = []
+        for worker in workers.only("id", "enabled", "max_load", "ready", "task_count", "current_load"):
+            task_count, current_load = usage.get(worker.id, (0, 0))
+            ready = worker._compute_ready(task_count, current_load)
+            if (worker.task_count, worker.current_load, worker.ready) != (task_count, current_load, ready):
+                worker.task_count, worker.current_load, worker.ready = task_count, current_load, ready
+                changed.append(worker)
+
+        self.bulk_update(changed, ["task_count", "current_load", "ready"], batch_size=1000)
+        return len(changed)
+
 
 @six.python_2_unicode_compatible
 class Worker(models.Model):
@@ -204,16 +470,21 @@ class Worker(models.Model):
     def __str__(self):
         return u"%s" % self.name
 
-    def save(self, *args, **kwargs):
-        # precompute task count, current load and ready
-        if self.id is not None:
-            tasks = Task.objects.opened().filter(worker=self)
-            self.task_count = tasks.count()
-            self.current_load = sum(( task.weight for task in tasks if not task.waiting ))
-        self.ready = self.enabled and (self.current_load < self.max_load and self.task_count < 3*self.max_load)
+    def _compute_ready(self, task_count, current_load):
+        return self.enabled and (current_load < self.max_load and task_count < 3*self.max_load)
 
-        if "update_fields" in kwargs:
-                kwargs["update_fields"] = {"task_count", "current_load", "ready"}.union(kwargs["update_fields"])
+    def save(self, *args, **kwargs):
+        # task count and current load are maintained by task state
+        # transitions; don't write them (and ready, which depends on them)
+        # back, a transition committed meanwhile would be lost
+        update_counters = self.id is None or self._state.adding
+        if update_counters:
+            self.ready = self._compute_ready(self.task_count, self.current_load)
+        else:
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [i.name for i in self._meta.concrete_fields if not i.primary_key]
+            kwargs["update_fields"] = set(update_fields) - {"task_count", "current_load", "ready"}
 
         while not self.worker_key:
             # if worker_key is empty, generate a new one
@@ -224,14 +495,26 @@ class Worker(models.Model):
                     kwargs["update_fields"] = {"worker_key"}.union(kwargs["update_fields"])
         super(self.__class__, self).save(*args, **kwargs)
 
+        if not update_counters:
+            # enabled or max_load may have changed
+            Worker.objects.filter(id=self.id).update(ready=_worker_ready())
+            self.refresh_from_db(fields=["ready", "task_count", "current_load"])
 
-    def export(self):
-        """Export data for xml-rpc."""
-        return {
+
+    def prepare_export(self):
+        """Precompute the part of export() which changes only when the worker is saved."""
+        self._static_export = {
             "id": self.id,
             "name": self.name,
             "arches": [ i.export() for i in self.arches.all() ],
             "channels": [ i.export() for i in self.channels.all() ],
+        }
+
+    def export(self):
+        """Export data for xml-rpc."""
+        if "_static_export" not in self.__dict__:
+            self.prepare_export()
+        return dict(self._static_export, **{
             "enabled": self.enabled,
             "max_load": self.max_load,
             "ready": self.ready,
@@ -242,7 +525,7 @@ class Worker(models.Model):
             # Add the hub version.
             # This can be used for taskd compatibility checking everytime a worker_info is updated.
             "version": self._get_version(),
-        }
+        })
 
 
     def _get_version(self):
@@ -264,17 +547,14 @@ class Worker(models.Model):
         """Time of this worker's last communication with hub,
         or None if unknown.
 
+        The time is recorded at most once per WORKER_LAST_SEEN_INTERVAL
+        seconds, see kobo.hub.last_seen.
+
         :rtype: datetime.datetime
         """
-
-        try:
-            stat = os.stat(self._state_path)
-        except EnvironmentError as error:
-            if error.errno == errno.ENOENT:
-                return None
-            raise
-
-        return datetime.datetime.utcfromtimestamp(stat.st_mtime)
+        if "_prefetched_last_seen" in self.__dict__:
+            return self._prefetched_last_seen
+        return kobo.hub.last_seen.get_last_seen([self])[self.id]
 
     @property
     def last_seen_iso8601(self):
@@ -291,8 +571,8 @@ class Worker(models.Model):
 
     def update_last_seen(self):
         """Mark worker as having communicated with hub at the current time."""
-        with open(self._state_path, 'w'):
-            pass
+        if kobo.hub.last_seen.update_last_seen(self):
+            self.__dict__.pop("_prefetched_last_seen", None)
 
     @property
     def _state_path(self):
@@ -302,20 +582,29 @@ class Worker(models.Model):
         safe_name = base64.urlsafe_b64encode(self.name.encode('utf-8')).decode()
         return os.path.join(settings.WORKER_DIR, safe_name)
 
+    def refresh_state(self):
+        """Reload fields which change without saving the worker (task state
+        transitions update the counters) or which may have been changed in
+        another process."""
+        self.refresh_from_db(fields=["enabled", "max_load", "max_tasks", "min_priority", "ready", "task_count", "current_load"])
+
     def update_worker(self, enabled, ready, task_count):
         """Recomputes worker state and returns current worker_info.
 
-        Compares provided actual state of the worker with the information
-        stored in the database.  If they differ, automatically recompute them using
-        self.save().
+        Reloads the worker state from the database and compares it with
+        provided actual state of the worker.  If they differ, recompute
+        the counters of this worker.
 
         Always returns the latest worker state from the database.
 
         This method is only meant to be used by the worker!  It is not a setter
         for provided arguments!
         """
+        # counters may have been updated by other requests meanwhile
+        self.refresh_state()
         if (self.enabled, self.ready, self.task_count) != (enabled, ready, task_count):
-            self.save()
+            Worker.objects.rebuild_counters(worker_ids=[self.id])
+            self.refresh_from_db(fields=["ready", "task_count", "current_load"])
 
         return self.export()
 
@@ -379,10 +668,15 @@ class TaskManager(models.Manager):
 
 
 class TaskLogs(object):
-    """Task log wrapper."""
+    """Task log wrapper.
+
+    Logs read by __getitem__ are cached up to settings.TASK_LOG_CACHE_SIZE
+    bytes (16 MiB by default), least recently read logs are dropped first.
+    Use open_stream, iter_chunks or iter_lines to read big logs.
+    """
 
     def __init__(self, task_obj):
-        self.cache = {}
+        self.cache = OrderedDict()
         self.changed = {} # changed logs, will be written on save()
         self.task = task_obj
 
@@ -406,11 +700,87 @@ class TaskLogs(object):
             return open(log_path, 'rb', LOG_BUFFER_SIZE)
         except FileNotFoundError:
             try:
-                out = gzip.open(log_path + ".gz", "rb")
-                return io.BufferedReader(out, LOG_BUFFER_SIZE)
+                return _open_gzip_log(log_path + ".gz")
             except FileNotFoundError:
                 raise Http404('Cannot find log %s' % name)
 
+    def open_stream(self, name):
+        """Open a log for reading.
+
+        Data are read from the disk in blocks, compressed logs are
+        decompressed on the fly.  Logs set but not saved yet are read from
+        memory.
+
+        @param name: log name
+        @type  name: str
+        @return: seekable binary file object
+        @raise Http404: the log doesn't exist
+        """
+        name = self._get_relative_log_path(name)
+        if self.changed.get(name):
+            value = self.cache[name]
+            if isinstance(value, six.text_type):
+                value = value.encode("utf-8")
+            return io.BytesIO(value)
+        return self._open_log(name)
+
+    def iter_chunks(self, name, offset=0, chunk_size=LOG_BUFFER_SIZE):
+        """Iterate over a log in chunks of at most chunk_size bytes.
+
+        @param name: log name
+        @type  name: str
+        @param offset: start reading at this offset
+        @type  offset: int
+        @param chunk_size: maximum chunk size
+        @type  chunk_size: int
+        @rtype: iterator of bytes
+        @raise Http404: the log doesn't exist
+        """
+        with self.open_stream(name) as log_file:
+            log_file.seek(offset)
+            while True:
+                data = log_file.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
+    def iter_lines(self, name, offset=0, max_line_size=LOG_BUFFER_SIZE):
+        """Iterate over lines of a log, including line ends.
+
+        @param name: log name
+        @type  name: str
+        @param offset: start reading at this offset
+        @type  offset: int
+        @param max_line_size: longer lines are split to pieces of this size
+        @type  max_line_size: int
+        @rtype: iterator of bytes
+        @raise Http404: the log doesn't exist
+        """
+        with self.open_stream(name) as log_file:
+            log_file.seek(offset)
+            while True:
+                line = log_file.readline(max_line_size)
+                if not line:
+                    break
+                yield line
+
+    def _cache_log(self, name, value):
+        """Cache a log read from the disk, drop least recently read logs over the size limit."""
+        self.cache[name] = value
+        self.changed[name] = False
+        self.cache.move_to_end(name)
+
+        limit = getattr(settings, "TASK_LOG_CACHE_SIZE", 16 * 1024**2)
+        size = sum(len(value) for log, value in self.cache.items() if not self.changed[log])
+        for log in list(self.cache):
+            if size <= limit:
+                break
+            if self.changed[log]:
+                # not saved yet
+                continue
+            size -= len(self.cache.pop(log))
+            del self.changed[log]
+
     def get_chunk(self, name, offset=0, length=-1):
         """Returns a sequence of bytes from the named log.
 
@@ -429,15 +799,9 @@ class TaskLogs(object):
             return self.cache[name][offset:end]
 
         # not loaded; read just this part
-        log_path = self._get_absolute_log_path(name)
-        log_file = None
-        try:
-            log_file = self._open_log(name)
+        with self.open_stream(name) as log_file:
             log_file.seek(offset)
             return _utf8_chunk(log_file.read(length))
-        finally:
-            if log_file is not None:
-                log_file.close()
 
     def tail(self, name, max_size, max_line_size=8192):
         """Return a byte string containing trailing lines from a log,
@@ -452,21 +816,16 @@ class TaskLogs(object):
         Returns (bytestring, offset) where offset is the total number
         of bytes read from the file (including discarded bytes).
         """
-        log_file = None
-        try:
-            log_file = self._open_log(name)
+        with self.open_stream(name) as log_file:
             return _tail(log_file, max_size, max_line_size)
-        finally:
-            if log_file is not None:
-                log_file.close()
 
     def __getitem__(self, name):
         """Get full content of named log, as a byte string.
 
-        This method reads (and caches) the entire uncompressed content of the
-        log file, thus may cause memory issues if log files are expected to
-        be large.  To limit the amount of memory used at once, use the
-        get_chunk method instead."""
+        This method reads the entire uncompressed content of the log file,
+        thus may cause memory issues if log files are expected to be large.
+        To limit the amount of memory used at once, use the get_chunk,
+        iter_chunks or iter_lines methods instead."""
 
         name = self._get_relative_log_path(name)
         if name not in self.cache:
@@ -475,16 +834,19 @@ class TaskLogs(object):
                 return ""
 
             log_path = self._get_absolute_log_path(name)
-            if os.path.isfile(log_path):
-                self.cache[name] = b"\n".join(read_from_file(log_path, mode='rb'))
-            elif os.path.isfile(log_path + ".gz"):
-                fo = gzip.open(log_path + ".gz", "rb")
-                self.cache[name] = fo.read()
-                fo.close()
-            else:
-                self.cache[name] = ""
-            self.changed[name] = False
-
+            # the log may get compressed any time, try the plain file first
+            try:
+                value = b"\n".join(read_from_file(log_path, mode='rb'))
+            except FileNotFoundError:
+                try:
+                    with gzip.open(log_path + ".gz", "rb") as fo:
+                        value = fo.read()
+                except FileNotFoundError:
+                    value = ""
+            self._cache_log(name, value)
+            return value
+
+        self.cache.move_to_end(name)
         return self.cache[name]
 
     def __setitem__(self, name, value):
@@ -516,6 +878,12 @@ class TaskLogs(object):
             # logs on disk
             for root, dirs, files in os.walk(task_dir):
                 for i in files:
+                    if i.endswith((".gz.tmp", ".idx.tmp", ".gz.idx")):
+                        # log being compressed or index of a compressed log
+                        continue
+                    if i.endswith(FILE_CHECKSUM_STATE_SUFFIX):
+                        # checksum state of a log being uploaded
+                        continue
                     if i.endswith(".log.gz"):
                         i = i[:-3]
                     result.append(os.path.join(root, i)[len(task_dir):])
@@ -534,13 +902,18 @@ class TaskLogs(object):
         if not name.endswith(".log"):
             return
 
-        import shlex
         path = self._get_absolute_log_path(name)
-        if not os.path.isfile(path + ".gz"):
-            run("gzip %s" % shlex.quote(path), can_fail=True, stdout=False)
+        try:
+            _gzip_file(path)
+        except Exception:
+            logger.exception("Cannot gzip log %s", path)
 
     def gzip_logs(self):
-        """gzip all task logs"""
+        """gzip all task logs
+
+        Compression of logs of finished tasks runs in background,
+        see log_compressor.
+        """
         for i in self.list:
             self._gzip_log(i)
 
@@ -590,9 +963,14 @@ class Task(models.Model):
         permissions = (
             ("can_see_traceback", _("Can see traceback")),
         )
+        indexes = (
+            # typed task search filters, see kobo.hub.task_search
+            models.Index(fields=["method"]),
+            models.Index(fields=["dt_created"]),
+        )
 
     def __init__(self, *args, **kwargs):
-        self.logs = TaskLogs(self)
+        self._logs = None
         traceback = kwargs.pop("traceback", None)
         if traceback:
             self.logs["traceback.log"] = traceback
@@ -602,20 +980,67 @@ class Task(models.Model):
             self.logs["stdout.log"] = stdout
 
         super(Task, self).__init__(*args, **kwargs)
+        # parent stored in the database, see save();
+        # don't load the parent if it's deferred
+        if "parent_id" in self.__dict__:
+            self._saved_parent_id = self.parent_id
+        if "method" in self.__dict__ and "label" in self.__dict__:
+            self._saved_search_text = (self.method, self.label)
+
+    @property
+    def logs(self):
+        """Logs of the task, created on first access."""
+        if self._logs is None:
+            self._logs = TaskLogs(self)
+        return self._logs
 
     def __str__(self):
         if self.parent:
             return u"#%s [method: %s, state: %s, worker: %s, parent: #%s]" % (self.id, self.method, self.get_state_display(), self.worker, self.parent.id)
         return u"#%s [method: %s, state: %s, worker: %s]" % (self.id, self.method, self.get_state_display(), self.worker)
 
+    def _wakeup_keys(self):
+        """Return keys of workers to wake up on a change of the task, see kobo.hub.wakeup."""
+        parent_worker_id = None
+        if self.awaited and self.parent_id is not None and self.state in FINISHED_STATES:
+            # the parent waits for this task
+            parent_worker_id = Task.objects.filter(id=self.parent_id).values_list("worker_id", flat=True).first()
+        return kobo.hub.wakeup.task_keys(self.state, self.arch_id, self.channel_id, self.awaited, self.worker_id, parent_worker_id)
+
     @transaction.atomic
     def save(self, *args, **kwargs):
-        if self.id is not None:
-            self.subtask_count = self.subtasks().count()
+        adding = self._state.adding
+        if not adding and "parent_id" in self.__dict__:
+            # parent may have been set after loading the task without it
+            self._load_saved_parent_id()
         super(self.__class__, self).save()
-        self.logs.save()
-        if self.parent:
-            self.parent.save(*args, **kwargs)
+        kobo.hub.wakeup.notify_tasks_changed(*self._wakeup_keys())
+        if self._logs is not None:
+            self._logs.save()
+
+        # search tokens of tasks loaded without method and label are up to date
+        if "method" in self.__dict__ or "label" in self.__dict__:
+            search_text = (self.method, self.label)
+            if adding or search_text != self.__dict__.get("_saved_search_text"):
+                TaskSearchToken.objects.index([self])
+                self._saved_search_text = search_text
+
+        if "parent_id" not in self.__dict__:
+            # deferred parent hasn't changed
+            return
+
+        # subtask_count is the only parent field depending on subtasks,
+        # parents are updated only when the task is added or moved
+        old_parent_id = None if adding else self._saved_parent_id
+        if old_parent_id != self.parent_id:
+            _update_subtask_count(old_parent_id, -1)
+            _update_subtask_count(self.parent_id, 1)
+        self._saved_parent_id = self.parent_id
+
+    def _load_saved_parent_id(self):
+        """Load parent stored in the database if it was deferred when loading the task."""
+        if "_saved_parent_id" not in self.__dict__:
+            self._saved_parent_id = Task._base_manager.filter(id=self.id).values_list("parent_id", flat=True).first()
 
     @classmethod
     def get_task_dir(cls, task_id, create=False):
@@ -673,7 +1098,9 @@ class Task(models.Model):
 
         # TODO: unsupported in Django 1.0
         #task.validate()
-        task.save()
+        with transaction.atomic():
+            task.save()
+            TaskEvent.objects.record(task.id, None, task.state, task.worker_id)
         return task.id
 
     @classmethod
@@ -710,41 +1137,18 @@ class Task(models.Model):
             result[key] = json.dumps(value)
         return result
 
-    def export(self, flat=True):
-        """Export data for xml-rpc."""
+    def export(self, flat=True, fields=None):
+        """Export data for xml-rpc.
 
-        result = {
-            "id": self.id,
-            "owner": self.owner.username,
-            "worker": self.worker_id,
-            "parent": self.parent_id,
-            "state": self.state,
-            "label": self.label,
-
-            "method": self.method,
-            "args": self.args,
-            "result": self.result,
-
-            "exclusive": self.exclusive,
-            "arch": self.arch_id,
-            "channel": self.channel_id,
-            "timeout": self.timeout,
-            "waiting": self.waiting,
-            "awaited": self.awaited,
-            "dt_created": datetime.datetime.strftime(self.dt_created, "%F %R:%S"),
-            "dt_started": self.dt_started and datetime.datetime.strftime(self.dt_started, "%Y-%m-%d %H:%M:%S") or None,
-            "dt_finished": self.dt_finished and datetime.datetime.strftime(self.dt_finished, "%F %R:%S") or None,
-            "priority": self.priority,
-            "weight": self.weight,
+        @param flat: export IDs of related objects instead of their exports
+        @type  flat: bool
+        @param fields: export only these keys of the flat export
+        @type  fields: list
+        """
+        if fields:
+            return dict((key, _TASK_EXPORT[key][1](self)) for key in fields)
 
-            "resubmitted_by": getattr(self.resubmitted_by, "username", None),
-            "resubmitted_from": getattr(self.resubmitted_from, "id", None),
-
-            # used by task watcher
-            "state_label": self.get_state_display(),
-            "is_finished": self.is_finished(),
-            "is_failed": self.is_failed(),
-        }
+        result = dict((key, getter(self)) for key, (_, getter) in _TASK_EXPORT.items())
 
         if not flat:
             result.update({
@@ -752,11 +1156,35 @@ class Task(models.Model):
                 "parent": self.parent and self.parent.export() or None,
                 "arch": self.arch.export(),
                 "channel": self.channel.export(),
-                "subtask_id_list": [ i.id for i in self.subtasks() ],
+                # task_set is equivalent to subtasks(), but it can be prefetched
+                "subtask_id_list": [ i.id for i in self.task_set.all() ],
             })
 
         return result
 
+    @staticmethod
+    def export_columns(fields):
+        """Return model fields needed for export(fields=fields).
+
+        @param fields: keys of the flat export
+        @type  fields: list
+        @return: (fields for QuerySet.only(), relations for QuerySet.select_related())
+        @rtype: tuple
+        @raise ValueError: unknown keys
+        """
+        unknown = sorted(set(fields) - set(_TASK_EXPORT))
+        if unknown:
+            raise ValueError("Unknown task fields: %s" % ", ".join(unknown))
+
+        columns = set(["id"])
+        related = set()
+        for key in fields:
+            for column in _TASK_EXPORT[key][0]:
+                columns.add(column)
+                if "__" in column:
+                    related.add(column.split("__")[0])
+        return sorted(columns), sorted(related)
+
     def subtasks(self):
         return Task.objects.filter(parent=self)
 
@@ -781,6 +1209,11 @@ class Task(models.Model):
         return time
     get_time_display.short_description = "Time"
 
+    def _lock_usage(self):
+        """Lock the task row, return usage of its worker (see _worker_usage)."""
+        row = Task._base_manager.select_for_update().filter(id=self.id).values("state", "worker_id", "waiting", "weight").first()
+        return row or {"state": None, "worker_id": None, "waiting": False, "weight": 0}
+
     def __lock(self, worker_id, new_state=TASK_STATES["ASSIGNED"], initial_states=None):
         """Critical section. Ensures that only one worker takes the task."""
 
@@ -828,6 +1261,7 @@ class Task(models.Model):
         waiting = False
 
         with transaction.atomic():
+            old_usage = self._lock_usage()
             cursor = connection.cursor()
             cursor.execute(query, (new_state, new_worker_id, dt_started, dt_finished, waiting, self.id, worker_id))
 
@@ -841,12 +1275,17 @@ class Task(models.Model):
             if cursor.rowcount > 1:
                 raise MultipleObjectsReturned()
 
+            new_usage = dict(old_usage, state=new_state, worker_id=new_worker_id, waiting=waiting)
+            _update_worker_counters(old_usage, new_usage)
+            TaskEvent.objects.record(self.id, old_usage["state"], new_state, new_worker_id, waiting)
+
         self.dt_started = dt_started
         self.dt_finished = dt_finished
         if new_worker_id is not None:
             self.worker = Worker.objects.get(id=new_worker_id)
         self.state = new_state
         self.waiting = waiting
+        kobo.hub.wakeup.notify_tasks_changed(*self._wakeup_keys())
 
     def free_task(self):
         """Free the task."""
@@ -886,7 +1325,66 @@ class Task(models.Model):
             self.__lock(self.worker_id, new_state=TASK_STATES["CLOSED"], initial_states=(TASK_STATES["OPEN"], ))
         except (MultipleObjectsReturned, ObjectDoesNotExist):
             raise Exception("Cannot close task %d, state is %s" % (self.id, self.get_state_display()))
-        self.logs.gzip_logs()
+        log_compressor.add([self.id])
+
+    def _subtree_ids(self):
+        """Return IDs of all descendants of the task, loaded in a single query."""
+        # it is safe to use table names directly in the query
+        query = dedent(  # nosec B608
+            """
+            WITH RECURSIVE subtree(id) AS (
+              SELECT id FROM %(table)s WHERE parent_id = %%s
+              UNION ALL
+              SELECT t.id FROM %(table)s t INNER JOIN subtree s ON t.parent_id = s.id
+            )
+            SELECT id FROM subtree
+            """) % {"table": connection.ops.quote_name(Task._meta.db_table)}
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, (self.id, ))
+            return [row[0] for row in cursor.fetchall()]
+
+    def _transition_subtree(self, new_state, initial_states, user=None):
+        """Move all descendants of the task in initial_states to new_state.
+
+        Descendants in other states are left as they are.  Tasks are
+        updated in set-based UPDATEs instead of recursing and their logs
+        are compressed in the background.
+
+        @return: IDs of the descendants
+        @rtype: list
+        """
+        subtree_ids = self._subtree_ids()
+        update = {
+            "state": new_state,
+            "dt_finished": datetime.datetime.now(),
+            "waiting": False,
+        }
+        if new_state == TASK_STATES["CANCELED"]:
+            update["canceled_by"] = user
+
+        deltas = {}
+        expected = 0
+        updated = 0
+        for start in range(0, len(subtree_ids), 500):
+            tasks = Task._base_manager.filter(id__in=subtree_ids[start:start + 500], state__in=initial_states)
+            rows = list(tasks.select_for_update().values("id", "state", "worker_id", "waiting", "weight", "owner_id"))
+            events = []
+            for row in rows:
+                if user is not None and not user.is_superuser and row.pop("owner_id") != user.id:
+                    raise Exception("You are not task owner or superuser.")
+                row.pop("owner_id", None)
+                events.append({"task_id": row.pop("id"), "old_state": row["state"], "state": new_state, "worker_id": row["worker_id"]})
+                _add_worker_usage(deltas, row, -1)
+            expected += len(rows)
+            updated += tasks.update(**update)
+            TaskEvent.objects.record_many(events)
+
+        _apply_worker_deltas(deltas)
+        if updated != expected:
+            # tasks changed meanwhile (databases without row locks)
+            Worker.objects.rebuild_counters(worker_ids=list(deltas))
+        return subtree_ids
 
     @transaction.atomic
     def cancel_task(self, user=None, recursive=True):
@@ -895,17 +1393,18 @@ class Task(models.Model):
             if self.owner.username != user.username:
                 raise Exception("You are not task owner or superuser.")
 
+        initial_states = (TASK_STATES["FREE"], TASK_STATES["ASSIGNED"], TASK_STATES["OPEN"], TASK_STATES["CREATED"])
         try:
-            self.__lock(self.worker_id, new_state=TASK_STATES["CANCELED"], initial_states=(TASK_STATES["FREE"], TASK_STATES["ASSIGNED"], TASK_STATES["OPEN"], TASK_STATES["CREATED"]))
+            self.__lock(self.worker_id, new_state=TASK_STATES["CANCELED"], initial_states=initial_states)
             self.canceled_by = user
-            self.save()
+            Task._base_manager.filter(id=self.id).update(canceled_by=user)
         except (MultipleObjectsReturned, ObjectDoesNotExist):
             raise Exception("Cannot cancel task %d, state is %s" % (self.id, self.get_state_display()))
 
+        task_ids = [self.id]
         if recursive:
-            for task in self.subtasks():
-                task.cancel_task(user=user, recursive=True)
-        self.logs.gzip_logs()
+            task_ids += self._transition_subtree(TASK_STATES["CANCELED"], initial_states, user=user)
+        log_compressor.add(task_ids)
 
     def cancel_subtasks(self):
         """Cancel all subtasks of the task."""
@@ -921,28 +1420,30 @@ class Task(models.Model):
     @transaction.atomic
     def interrupt_task(self, recursive=True):
         """Set the task state to interrupted."""
+        initial_states = (TASK_STATES["ASSIGNED"], TASK_STATES["OPEN"])
         try:
-            self.__lock(self.worker_id, new_state=TASK_STATES["INTERRUPTED"], initial_states=(TASK_STATES["ASSIGNED"], TASK_STATES["OPEN"]))
+            self.__lock(self.worker_id, new_state=TASK_STATES["INTERRUPTED"], initial_states=initial_states)
         except (MultipleObjectsReturned, ObjectDoesNotExist):
             raise Exception("Cannot interrupt task %d, state is %s" % (self.id, self.get_state_display()))
 
+        task_ids = [self.id]
         if recursive:
-            for task in self.subtasks():
-                task.interrupt_task(recursive=True)
-        self.logs.gzip_logs()
+            task_ids += self._transition_subtree(TASK_STATES["INTERRUPTED"], initial_states)
+        log_compressor.add(task_ids)
 
     @transaction.atomic
     def timeout_task(self, recursive=True):
         """Set the task state to timeout."""
+        initial_states = (TASK_STATES["OPEN"], )
         try:
-            self.__lock(self.worker_id, new_state=TASK_STATES["TIMEOUT"], initial_states=(TASK_STATES["OPEN"], ))
+            self.__lock(self.worker_id, new_state=TASK_STATES["TIMEOUT"], initial_states=initial_states)
         except (MultipleObjectsReturned, ObjectDoesNotExist):
             raise Exception("Cannot timeout task %d, state is %s" % (self.id, self.get_state_display()))
 
+        task_ids = [self.id]
         if recursive:
-            for task in self.subtasks():
-                task.timeout_task(recursive=True)
-        self.logs.gzip_logs()
+            task_ids += self._transition_subtree(TASK_STATES["TIMEOUT"], initial_states)
+        log_compressor.add(task_ids)
 
     @transaction.atomic
     def fail_task(self, task_result=""):
@@ -955,7 +1456,7 @@ class Task(models.Model):
             self.__lock(self.worker_id, new_state=TASK_STATES["FAILED"], initial_states=(TASK_STATES["OPEN"], ))
         except (MultipleObjectsReturned, ObjectDoesNotExist):
             raise Exception("Cannot fail task %i, state is %s" % (self.id, self.get_state_display()))
-        self.logs.gzip_logs()
+        log_compressor.add([self.id])
 
     def is_finished(self):
         """Is the task finished? Task state can be one of: closed, interrupted, canceled, failed."""
@@ -1043,8 +1544,12 @@ class Task(models.Model):
             task.awaited = True
             task.save()
 
-        self.waiting = True
-        self.save()
+        with transaction.atomic():
+            old_usage = self._lock_usage()
+            self.waiting = True
+            self.save()
+            _update_worker_counters(old_usage, dict(old_usage, waiting=True))
+            TaskEvent.objects.record(self.id, old_usage["state"], self.state, self.worker_id, waiting=True)
 
     def check_wait(self, child_task_list=None):
         """Determine if all subtasks have finished."""
@@ -1065,8 +1570,443 @@ class Task(models.Model):
         return [finished, unfinished]
 
     def set_weight(self, weight):
-        self.weight = weight
-        self.save()
+        with transaction.atomic():
+            old_usage = self._lock_usage()
+            self.weight = weight
+            self.save()
+            _update_worker_counters(old_usage, dict(old_usage, weight=weight))
+
+
+def _format_time(value):
+    return value and datetime.datetime.strftime(value, "%F %R:%S") or None
+
+
+# keys of flat Task.export(): (model fields they need, value getter)
+_TASK_EXPORT = OrderedDict([
+    ("id", (("id", ), lambda task: task.id)),
+    ("owner", (("owner__username", ), lambda task: task.owner.username)),
+    ("worker", (("worker", ), lambda task: task.worker_id)),
+    ("parent", (("parent", ), lambda task: task.parent_id)),
+    ("state", (("state", ), lambda task: task.state)),
+    ("label", (("label", ), lambda task: task.label)),
+
+    ("method", (("method", ), lambda task: task.method)),
+    ("args", (("args", ), lambda task: task.args)),
+    ("result", (("result", ), lambda task: task.result)),
+
+    ("exclusive", (("exclusive", ), lambda task: task.exclusive)),
+    ("arch", (("arch", ), lambda task: task.arch_id)),
+    ("channel", (("channel", ), lambda task: task.channel_id)),
+    ("timeout", (("timeout", ), lambda task: task.timeout)),
+    ("waiting", (("waiting", ), lambda task: task.waiting)),
+    ("awaited", (("awaited", ), lambda task: task.awaited)),
+    ("dt_created", (("dt_created", ), lambda task: _format_time(task.dt_created))),
+    ("dt_started", (("dt_started", ), lambda task: _format_time(task.dt_started))),
+    ("dt_finished", (("dt_finished", ), lambda task: _format_time(task.dt_finished))),
+    ("priority", (("priority", ), lambda task: task.priority)),
+    ("weight", (("weight", ), lambda task: task.weight)),
+
+    ("resubmitted_by", (("resubmitted_by__username", ), lambda task: getattr(task.resubmitted_by, "username", None))),
+    ("resubmitted_from", (("resubmitted_from", ), lambda task: task.resubmitted_from_id)),
+
+    # used by task watcher
+    ("state_label", (("state", ), lambda task: task.get_state_display())),
+    ("is_finished", (("state", ), lambda task: task.is_finished())),
+    ("is_failed", (("state", ), lambda task: task.is_failed())),
+])
+
+
+def prefetch_for_export(tasks, flat=True):
+    """Load tasks together with everything Task.export() touches.
+
+    @param tasks: tasks
+    @type  tasks: django.db.models.QuerySet
+    @param flat: prepare for export(flat=flat)
+    @type  flat: bool
+    @return: the tasks
+    @rtype: list
+    """
+    tasks = tasks.select_related("owner", "resubmitted_by")
+    if flat:
+        return list(tasks)
+
+    tasks = list(tasks.select_related(
+        "arch",
+        "channel",
+        "worker",
+        "parent__owner",
+        "parent__resubmitted_by",
+    ).prefetch_related(
+        "worker__arches",
+        "worker__channels",
+        models.Prefetch("task_set", queryset=Task.objects.only("id", "parent")),
+    ))
+    kobo.hub.last_seen.prefetch_last_seen(task.worker for task in tasks if task.worker is not None)
+    return tasks
+
+
+def export_tasks(tasks, flat=True, fields=None):
+    """Export tasks for xml-rpc in a constant number of queries.
+
+    The result is the same as calling export() of each task.
+
+    @param tasks: tasks
+    @type  tasks: django.db.models.QuerySet
+    @param flat: see Task.export()
+    @type  flat: bool
+    @param fields: see Task.export(), only for flat exports
+    @type  fields: list
+    @rtype: list
+    """
+    if fields:
+        columns, related = Task.export_columns(fields)
+        tasks = tasks.select_related(*related).only(*columns)
+        return [task.export(fields=fields) for task in tasks.iterator()]
+    if flat:
+        tasks = tasks.select_related("owner", "resubmitted_by")
+        return [task.export() for task in tasks.iterator()]
+    return [task.export(flat=False) for task in prefetch_for_export(tasks, flat=False)]
+
+
+class TaskEventManager(models.Manager):
+    """Custom query manager for TaskEvent model."""
+
+    def record(self, task_id, old_state, state, worker_id=None, waiting=False):
+        """Append an event of a single task."""
+        kobo.hub.wakeup.notify_tasks_changed(*[kobo.hub.wakeup.worker_key(i) for i in (worker_id, ) if i is not None])
+        return self.create(task_id=task_id, old_state=old_state, state=state, worker_id=worker_id, waiting=waiting)
+
+    def record_many(self, events):
+        """Append events given as dicts of TaskEvent fields in a single query."""
+        kobo.hub.wakeup.notify_tasks_changed(*[kobo.hub.wakeup.worker_key(i["worker_id"]) for i in events if i.get("worker_id") is not None])
+        return self.bulk_create([TaskEvent(**i) for i in events], batch_size=1000)
+
+    def after(self, seq, limit=1000, gap_timeout=None, until=None):
+        """Return up to limit events following the event with given sequence number.
+
+        Sequence numbers are assigned when events are recorded, an event
+        may be committed after events with higher numbers.  With gap_timeout,
+        events are returned only up to the first missing number, unless
+        the following event is older than gap_timeout seconds (the missing
+        number belongs to a rolled back or deleted event then).  An event
+        committed even later is not returned when continuing past its number,
+        it can be found by looking at the skipped numbers (see gaps()) again.
+
+        @param seq: sequence number of the last known event, 0 to start from the beginning
+        @type  seq: int
+        @param limit: maximum number of returned events
+        @type  limit: int
+        @param gap_timeout: how long to wait for missing events, in seconds
+        @type  gap_timeout: int
+        @param until: return only events up to this sequence number
+        @type  until: int
+        @rtype: list
+        """
+        events = self.filter(id__gt=seq)
+        if until is not None:
+            events = events.filter(id__lte=until)
+        events = list(events.order_by("id")[:limit])
+        if gap_timeout is None:
+            return events
+
+        recent = datetime.datetime.now() - datetime.timedelta(seconds=gap_timeout)
+        expected = seq + 1 if seq > 0 else None
+        for i, event in enumerate(events):
+            if expected is not None and event.id != expected and event.dt_created > recent:
+                return events[:i]
+            expected = event.id + 1
+        return events
+
+    @staticmethod
+    def gaps(seq, events):
+        """Return missing sequence numbers between seq and events returned by after().
+
+        @param seq: sequence number passed to after(), numbers before the first event are not missing if 0
+        @type  seq: int
+        @param events: events returned by after()
+        @type  events: list
+        @return: [(first, last)] ranges of missing sequence numbers
+        @rtype: list
+        """
+        result = []
+        for event in events:
+            if seq > 0 and event.id > seq + 1:
+                result.append((seq + 1, event.id - 1))
+            seq = event.id
+        return result
+
+    def trim(self, before, batch_size=1000):
+        """Delete events older than given time in batches.
+
+        @param before: delete events created before this time
+        @type  before: datetime.datetime
+        @param batch_size: number of events deleted in one query
+        @type  batch_size: int
+        @return: number of deleted events
+        @rtype: int
+        """
+        deleted = 0
+        while True:
+            # events are created in sequence order, the oldest have lowest IDs
+            ids = list(self.filter(dt_created__lt=before).order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += self.filter(id__in=ids).delete()[0]
+
+
+class TaskEvent(models.Model):
+    """Model for hub_taskevent table.
+
+    Task state transitions in the order they have been made; id is
+    a monotonically increasing sequence number.  Events of concurrent
+    transactions get their numbers when they are recorded, not when the
+    transactions commit, see TaskEventManager.after().
+    """
+    id                  = models.BigAutoField(primary_key=True)
+    task                = models.ForeignKey(Task, on_delete=models.CASCADE)
+    old_state           = models.PositiveIntegerField(null=True, blank=True, choices=TASK_STATES.get_mapping(), help_text=_("State before the event, empty for new tasks."))
+    state               = models.PositiveIntegerField(choices=TASK_STATES.get_mapping())
+    worker              = models.ForeignKey(Worker, null=True, blank=True, on_delete=models.SET_NULL)
+    waiting             = models.BooleanField(default=False)
+    dt_created          = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = TaskEventManager()
+
+    class Meta:
+        ordering = ("id", )
+
+    def export(self):
+        """Export data for xml-rpc."""
+        return {
+            # XML-RPC integers are 32-bit
+            "seq": str(self.id),
+            "task_id": self.task_id,
+            "old_state": self.old_state,
+            "state": self.state,
+            "worker": self.worker_id,
+            "waiting": self.waiting,
+            "dt_created": datetime.datetime.strftime(self.dt_created, "%F %R:%S"),
+        }
+
+
+def search_tokens(*values):
+    """Return set of lowercase trigrams of given strings."""
+    result = set()
+    for value in values:
+        value = (value or "").lower()
+        result.update(value[i:i + 3] for i in range(len(value) - 2))
+    return result
+
+
+class TaskSearchTokenManager(models.Manager):
+    """Custom query manager for TaskSearchToken model."""
+
+    def enabled(self):
+        """Are search tokens maintained?  PostgreSQL uses trigram indexes instead."""
+        return connections[self.db].vendor != "postgresql"
+
+    def index(self, tasks):
+        """Replace search tokens of given tasks.
+
+        @param tasks: tasks with loaded method and label
+        @type  tasks: list
+        """
+        if not tasks or not self.enabled():
+            return
+        self.filter(task__in=[i.id for i in tasks]).delete()
+        self.bulk_create([
+            TaskSearchToken(task_id=task.id, token=token)
+            for task in tasks
+            for token in search_tokens(task.method, task.label)
+        ], batch_size=1000)
+
+
+class TaskSearchToken(models.Model):
+    """Model for hub_tasksearchtoken table.
+
+    Trigrams of task method and label used to look up tasks by substrings,
+    see kobo.hub.task_search.
+    """
+    id                  = models.BigAutoField(primary_key=True)
+    task                = models.ForeignKey(Task, on_delete=models.CASCADE)
+    token               = models.CharField(max_length=3)
+
+    objects = TaskSearchTokenManager()
+
+    class Meta:
+        unique_together = (
+            ("token", "task"),
+        )
+
+
+def _worker_usage(state, worker_id, waiting, weight):
+    """Return (worker_id, task count, load) a task in given state adds to its worker."""
+    if state != TASK_STATES["OPEN"] or worker_id is None:
+        return None, 0, 0
+    return worker_id, 1, 0 if waiting else weight
+
+
+def _add_worker_usage(deltas, usage, sign):
+    """Add (sign=1) or subtract (sign=-1) task usage from {worker_id: (task_count, load)} deltas."""
+    worker_id, task_count, load = _worker_usage(**usage)
+    if worker_id is not None:
+        old_task_count, old_load = deltas.get(worker_id, (0, 0))
+        deltas[worker_id] = (old_task_count + sign * task_count, old_load + sign * load)
+
+
+def _update_worker_counters(old_usage, new_usage):
+    """Move worker task_count and current_load from old to new task usage."""
+    deltas = {}
+    _add_worker_usage(deltas, old_usage, -1)
+    _add_worker_usage(deltas, new_usage, 1)
+    _apply_worker_deltas(deltas)
+
+
+def _worker_ready(task_count=0, load=0):
+    """Return SQL expression of Worker.ready after adding task_count and load
+    to the counters; the same as Worker._compute_ready().
+    """
+    return models.Case(
+        models.When(
+            models.Q(enabled=True) & models.Q(current_load__lt=models.F("max_load") - load) & models.Q(task_count__lt=models.F("max_load") * 3 - task_count),
+            then=models.Value(True),
+        ),
+        default=models.Value(False),
+        output_field=models.BooleanField(),
+    )
+
+
+def _apply_worker_deltas(deltas):
+    """Apply {worker_id: (task_count, load)} deltas to worker counters.
+
+    Counters are updated with F() expressions, concurrent transitions
+    of other tasks of the same worker don't overwrite each other.
+    """
+    for worker_id, (task_count, load) in deltas.items():
+        if not task_count and not load:
+            continue
+        new_task_count = models.F("task_count") + task_count
+        new_load = models.F("current_load") + load
+        Worker.objects.filter(id=worker_id).update(
+            # keep ready first, MySQL evaluates assignments in order
+            # and would see the new counters
+            ready=_worker_ready(task_count, load),
+            task_count=Greatest(new_task_count, 0),
+            current_load=Greatest(new_load, 0),
+        )
+
+
+class _LogCompressor(object):
+    """Gzip logs of finished tasks in background threads.
+
+    Compressing logs takes long, it shouldn't be done in the request (or
+    transaction) which finished the tasks.  Logs are compressed by up to
+    settings.TASK_LOG_COMPRESS_THREADS (2 by default) threads per hub
+    process.  Logs which are not compressed before the process exits stay
+    uncompressed until the compress_task_logs command is run.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def add(self, task_ids):
+        """Queue logs of given tasks for compression once the current transaction commits."""
+        task_ids = list(task_ids)
+        transaction.on_commit(lambda: self._put(task_ids))
+
+    def _put(self, task_ids):
+        with self._lock:
+            self._threads = [i for i in self._threads if i.is_alive()]
+            max_threads = max(getattr(settings, "TASK_LOG_COMPRESS_THREADS", 2), 1)
+            while len(self._threads) < min(max_threads, self._queue.qsize() + len(task_ids)):
+                thread = threading.Thread(target=self._run, name="kobo-log-compressor-%s" % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        for task_id in task_ids:
+            self._queue.put(task_id)
+
+    def _run(self):
+        while True:
+            task_id = self._queue.get()
+            try:
+                Task(id=task_id).logs.gzip_logs()
+            except Exception:
+                logger.exception("Cannot gzip logs of task %s", task_id)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until all queued logs are compressed."""
+        self._queue.join()
+
+
+log_compressor = _LogCompressor()
+
+
+def _gzip_file(path):
+    """Replace a file with its compressed copy (path + ".gz").
+
+    The copy is written to a temporary file which is renamed to path + ".gz"
+    before the original file is removed.  Readers open the plain file first
+    and the compressed one if the plain file doesn't exist, so they always
+    find a complete log.  A file which changes while being compressed is
+    left alone.
+
+    @param path: file path
+    @type  path: str
+    @return: True if the file has been compressed
+    @rtype: bool
+    """
+    gz_path = path + ".gz"
+    if os.path.exists(gz_path):
+        return False
+
+    try:
+        src = open(path, "rb")
+    except FileNotFoundError:
+        return False
+
+    with src:
+        st = os.fstat(src.fileno())
+
+        def changed():
+            new_st = os.stat(path)
+            if (new_st.st_size, new_st.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                logger.warning("Log %s changed while being compressed, leaving it uncompressed", path)
+                return True
+            return False
+
+        if not _write_compressed_log(src, gz_path, st, changed):
+            return False
+
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        # compressed by another process at the same time
+        pass
+    return True
+
+
+def _update_subtask_count(task_id, delta):
+    if task_id is not None:
+        Task._base_manager.filter(id=task_id).update(subtask_count=Greatest(models.F("subtask_count") + delta, 0))
+
+
+def _task_load_parent(sender, instance, **kwargs):
+    """Make sure the parent of a task is known before deleting it."""
+    instance._load_saved_parent_id()
+
+pre_delete.connect(_task_load_parent, sender=Task)
+
+
+def _task_subtask_delete(sender, instance, **kwargs):
+    """Decrease subtask_count of the parent of a deleted task."""
+    _update_subtask_count(instance._saved_parent_id, -1)
+
+post_delete.connect(_task_subtask_delete, sender=Task)
 
 
 def _task_delete(sender, instance, **kwargs):
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Hub-side task scheduler.
+
+By default workers pull FREE tasks from the hub (get_tasks_to_assign) and race
+each other when opening them.  When settings.TASK_SCHEDULER_ENABLED is set,
+get_tasks_to_assign returns only tasks ASSIGNED to the calling worker and
+schedule_tasks() (usually run by the 'schedule_tasks' management command)
+distributes FREE tasks among workers instead.
+
+Only ready workers seen within settings.TASK_SCHEDULER_WORKER_TIMEOUT
+seconds (300 by default) get tasks.  ASSIGNED tasks of workers which are
+disabled or haven't been seen for that long are freed again.
+"""
+
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+
+import kobo.hub.last_seen
+from kobo.client.constants import TASK_STATES
+from kobo.hub.models import Task, TaskEvent, Worker
+
+
+__all__ = (
+    "free_stale_tasks",
+    "scheduler_enabled",
+    "schedule_tasks",
+)
+
+
+logger = logging.getLogger("kobo")
+
+
+def scheduler_enabled():
+    """Is the hub-side scheduler responsible for assigning FREE tasks?"""
+    return getattr(settings, "TASK_SCHEDULER_ENABLED", False)
+
+
+def _alive_workers(workers):
+    """Return workers seen within TASK_SCHEDULER_WORKER_TIMEOUT seconds."""
+    timeout = getattr(settings, "TASK_SCHEDULER_WORKER_TIMEOUT", 300)
+    now = datetime.datetime.utcnow()
+    return [
+        worker for worker in kobo.hub.last_seen.prefetch_last_seen(workers)
+        if worker.last_seen is not None and (now - worker.last_seen).total_seconds() < timeout
+    ]
+
+
+class _WorkerSlot(object):
+    """Scheduling state of a single worker."""
+
+    def __init__(self, worker, load, task_count):
+        self.worker = worker
+        self.arches = set(i.id for i in worker.arches.all())
+        self.channels = set(i.id for i in worker.channels.all())
+        self.load = load
+        self.task_count = task_count
+        self.task_ids = []
+
+    def is_full(self):
+        if self.worker.max_tasks and self.task_count >= self.worker.max_tasks:
+            return True
+        return self.load >= self.worker.max_load
+
+    def accepts(self, task):
+        if self.is_full() or task.arch_id not in self.arches:
+            return False
+        if task.awaited:
+            # awaited tasks are preferred regardless channel and priority,
+            # the same as in get_tasks_to_assign()
+            return True
+        return task.channel_id in self.channels and task.priority >= self.worker.min_priority
+
+    def add(self, task):
+        self.task_ids.append(task.id)
+        self.load += task.weight
+        self.task_count += 1
+
+
+def _get_slots():
+    """Return _WorkerSlot for each ready and alive worker with its current load."""
+    # ASSIGNED tasks count too, workers haven't opened them yet
+    usage = Task.objects.running().order_by().values("worker").annotate(
+        load=Sum("weight", filter=Q(waiting=False)),
+        task_count=Count("id"),
+    )
+    usage = dict((i["worker"], (i["load"] or 0, i["task_count"])) for i in usage)
+
+    slots = []
+    for worker in _alive_workers(Worker.objects.ready().prefetch_related("arches", "channels").order_by("id")):
+        load, task_count = usage.get(worker.id, (0, 0))
+        slots.append(_WorkerSlot(worker, load, task_count))
+    return slots
+
+
+def free_stale_tasks():
+    """Free ASSIGNED tasks of workers which are disabled or haven't been seen
+    within TASK_SCHEDULER_WORKER_TIMEOUT seconds.
+
+    Only tasks moved from FREE to the worker (by the scheduler or by the
+    worker itself) are freed.  Exclusive tasks (ShutdownWorker) and tasks
+    created for the worker (e.g. subtasks inheriting it) stay, no other
+    worker may run them.
+
+    @return: number of freed tasks
+    @rtype: int
+    """
+    worker_ids = set(Task.objects.assigned().order_by().values_list("worker", flat=True).distinct())
+    if not worker_ids:
+        return 0
+
+    workers = Worker.objects.filter(id__in=worker_ids)
+    alive = set(i.id for i in _alive_workers(workers) if i.enabled)
+    stale = worker_ids - alive
+    if not stale:
+        return 0
+
+    taken_from_free = TaskEvent.objects.filter(
+        task=OuterRef("pk"),
+        worker=OuterRef("worker"),
+        old_state=TASK_STATES["FREE"],
+        state=TASK_STATES["ASSIGNED"],
+    )
+    tasks = Task.objects.assigned().filter(worker__in=stale, exclusive=False).filter(Exists(taken_from_free))
+
+    freed = 0
+    for task in tasks:
+        try:
+            task.free_task()
+        except Exception:
+            # the worker has opened the task meanwhile
+            logger.debug("Cannot free stale task %s", task.id)
+            continue
+        freed += 1
+    logger.info("Freed %s tasks of stale workers %s", freed, sorted(stale))
+    return freed
+
+
+def schedule_tasks(limit=10000):
+    """Assign FREE tasks to ready workers which have free capacity.
+
+    ASSIGNED tasks of stale workers are freed first, see free_stale_tasks().
+
+    Tasks are processed in the same order workers would pick them up
+    (awaited tasks first, then by priority and age).  Each task goes to the
+    least loaded worker which supports its arch and channel.  Tasks of each
+    worker are moved to ASSIGNED in a single UPDATE.
+
+    @param limit: maximum number of FREE tasks to inspect in one run
+    @type  limit: int
+    @return: statistics: assigned, conflicts, freed, latency_avg, latency_max
+             (dispatch latency is the time between creating and assigning
+             a task, in seconds)
+    @rtype: dict
+    """
+    freed = free_stale_tasks()
+    all_slots = _get_slots()
+    slots = [i for i in all_slots if not i.is_full()]
+    arches = set()
+    channels = set()
+    for slot in slots:
+        arches.update(slot.arches)
+        channels.update(slot.channels)
+
+    latencies = {}
+    now = datetime.datetime.now()
+
+    # exclusive tasks are meant for a particular worker
+    tasks = Task.objects.free().filter(exclusive=False, arch__in=arches).filter(Q(awaited=True) | Q(channel__in=channels))
+    tasks = tasks.order_by("-awaited", "-priority", "id").only("id", "arch", "channel", "priority", "weight", "awaited", "dt_created")
+
+    for task in tasks[:limit].iterator():
+        slots = [i for i in slots if not i.is_full()]
+        if not slots:
+            break
+
+        candidates = [i for i in slots if i.accepts(task)]
+        if not candidates:
+            continue
+
+        slot = min(candidates, key=lambda i: (float(i.load) / max(i.worker.max_load, 1), i.task_count))
+        slot.add(task)
+        latencies[task.id] = (now - task.dt_created).total_seconds()
+
+    assigned = 0
+    conflicts = 0
+    with transaction.atomic():
+        for slot in all_slots:
+            if not slot.task_ids:
+                continue
+            # workers may still open FREE tasks on their own, don't steal those
+            task_ids = list(Task.objects.select_for_update().filter(id__in=slot.task_ids, state=TASK_STATES["FREE"]).values_list("id", flat=True))
+            updated = Task.objects.filter(id__in=task_ids, state=TASK_STATES["FREE"]).update(
+                state=TASK_STATES["ASSIGNED"],
+                worker=slot.worker,
+            )
+            TaskEvent.objects.record_many([
+                {"task_id": i, "old_state": TASK_STATES["FREE"], "state": TASK_STATES["ASSIGNED"], "worker_id": slot.worker.id}
+                for i in task_ids
+            ])
+            assigned += updated
+            conflicts += len(slot.task_ids) - updated
+
+    result = {
+        "assigned": assigned,
+        "conflicts": conflicts,
+        "freed": freed,
+        "latency_avg": latencies and sum(latencies.values()) / len(latencies) or 0,
+        "latency_max": latencies and max(latencies.values()) or 0,
+    }
+    logger.debug("Scheduled tasks: %s", result)
+    return result
@@ -1,6 +1,8 @@
 // to start a log watcher, include this script and use following code:
-// document.log_watcher = new LogWatcher(json_url, offset, task_finished);
+// document.log_watcher = new LogWatcher(json_url, offset, task_finished, next_poll, stream_url);
 // document.log_watcher.watch();
+// the log is followed over a single server-sent events connection to stream_url
+// if the browser supports it, otherwise json_url is polled
 
 function getAjax() {
 	try { return new XMLHttpRequest(); } catch (e) {}
@@ -39,15 +41,44 @@ function doWatch() {
 	setTimeout(doWatch, document.log_watcher.next_poll || 5000);
 }
 
-function LogWatcher(json_url, offset, task_finished, next_poll) {
+function scrollToEnd() {
+	if ((window.pageYOffset + window.innerHeight) >= document.log_watcher.page_height) {
+		window.scroll(window.pageXOffset, document.body.clientHeight);
+		document.log_watcher.page_height = document.body.clientHeight;
+	}
+}
+
+function doStream() {
+	// EventSource reconnects with Last-Event-ID (the offset) when the stream is closed
+	var source = new EventSource(document.log_watcher.stream_url + '?offset=' + document.log_watcher.offset);
+	source.onmessage = function(event) {
+		var result = JSON.parse(event.data);
+		getElementById('log').appendChild(document.createTextNode(result.content));
+		document.log_watcher.offset = result.new_offset;
+		scrollToEnd();
+	};
+	source.addEventListener('finished', function() {
+		document.log_watcher.task_finished = 1;
+		source.close();
+	});
+}
+
+function LogWatcher(json_url, offset, task_finished, next_poll, stream_url) {
 	this.json_url = json_url;
 	this.offset = offset;
 	this.task_finished = task_finished;
 	this.next_poll = next_poll;
+	this.stream_url = stream_url;
 	this.page_height = 0;
 	return this;
 }
 
 LogWatcher.prototype.watch = function() {
+	if (this.stream_url && window.EventSource) {
+		if (!this.task_finished) {
+			doStream();
+		}
+		return;
+	}
 	doWatch();
 }
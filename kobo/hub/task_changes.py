@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+State changes of task trees, used by task watchers.
+
+Clients pass the token returned by the previous call and get only tasks
+which have been added to the trees or have changed state since then.
+The token encodes the states the client has already seen (compressed
+task ID deltas and states), so the hub keeps no per-client data and any
+hub process can answer the next call.
+"""
+
+
+import base64
+import zlib
+from textwrap import dedent
+
+from django.db import connection
+
+from kobo.client.constants import FINISHED_STATES
+from kobo.hub.models import Task
+
+
+__all__ = (
+    "get_task_changes",
+)
+
+
+TOKEN_VERSION = "1"
+BATCH_SIZE = 500
+
+
+def _load_trees(root_ids):
+    """Return {task id: state} of given tasks and all their descendants, loaded in a single query."""
+    if not root_ids:
+        return {}
+
+    # it is safe to use table names directly in the query
+    query = dedent(  # nosec B608
+        """
+        WITH RECURSIVE tree(id, state) AS (
+          SELECT id, state FROM %(table)s WHERE id IN (%(roots)s)
+          UNION ALL
+          SELECT t.id, t.state FROM %(table)s t INNER JOIN tree s ON t.parent_id = s.id
+        )
+        SELECT id, state FROM tree
+        """) % {
+            "table": connection.ops.quote_name(Task._meta.db_table),
+            "roots": ", ".join(["%s"] * len(root_ids)),
+        }
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, list(root_ids))
+        return dict(cursor.fetchall())
+
+
+def _encode_token(states):
+    parts = []
+    last_id = 0
+    for task_id in sorted(states):
+        parts.append("%x:%x" % (task_id - last_id, states[task_id]))
+        last_id = task_id
+    data = zlib.compress(",".join(parts).encode("ascii"))
+    return "%s.%s" % (TOKEN_VERSION, base64.urlsafe_b64encode(data).decode("ascii"))
+
+
+def _decode_token(token):
+    """Return states encoded in token, {} for an empty or invalid token."""
+    if not token:
+        return {}
+    try:
+        version, data = token.split(".", 1)
+        if version != TOKEN_VERSION:
+            return {}
+        data = zlib.decompress(base64.urlsafe_b64decode(data.encode("ascii"))).decode("ascii")
+        states = {}
+        task_id = 0
+        for part in data.split(",") if data else []:
+            delta, state = part.split(":")
+            task_id += int(delta, 16)
+            states[task_id] = int(state, 16)
+        return states
+    except (ValueError, zlib.error):
+        return {}
+
+
+def _export_change(task):
+    return {
+        "id": task.id,
+        "parent": task.parent_id,
+        "method": task.method,
+        "state": task.state,
+        "state_label": task.get_state_display(),
+        "worker": task.worker_id and {"id": task.worker_id, "name": task.worker.name} or None,
+        "is_finished": task.is_finished(),
+        "is_failed": task.is_failed(),
+    }
+
+
+def get_task_changes(root_ids, since_token=None):
+    """
+    Get tasks of given task trees which have been added or changed state
+    since the call which returned since_token.
+
+    @param root_ids: IDs of the tree roots
+    @type  root_ids: [int]
+    @param since_token: token returned by the previous call, all tasks
+                        are returned if empty
+    @type  since_token: str
+    @return: {"token": token for the next call,
+              "tasks": [changed tasks sorted by ID, each a dict with id,
+                        parent, method, state, state_label, worker (dict
+                        with id and name or None), is_finished, is_failed],
+              "missing": [root IDs which don't exist],
+              "finished": True if all tasks of the trees are finished}
+    @rtype: dict
+    """
+    root_ids = [int(i) for i in root_ids]
+    states = _load_trees(root_ids)
+    known = _decode_token(since_token)
+    changed = sorted(task_id for task_id, state in states.items() if known.get(task_id) != state)
+
+    tasks = []
+    for i in range(0, len(changed), BATCH_SIZE):
+        batch = Task.objects.filter(id__in=changed[i:i + BATCH_SIZE]).select_related("worker")
+        batch = batch.only("id", "parent", "method", "state", "worker__name")
+        tasks.extend(_export_change(task) for task in batch.order_by("id"))
+
+    return {
+        "token": _encode_token(states),
+        "tasks": tasks,
+        "missing": [i for i in root_ids if i not in states],
+        "finished": bool(states) and all(state in FINISHED_STATES for state in states.values()),
+    }
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Task search used by the task list.
+
+A search is a list of whitespace separated words, quotes group words with
+spaces.  Typed filters restrict tasks by their fields:
+
+  - method:NAME - task method
+  - owner:NAME - owner username
+  - state:NAME[,NAME...] - task state, e.g. state:failed,canceled
+  - created:FROM..TO, finished:FROM..TO - creation or finish date range,
+    dates are YYYY-MM-DD, both ends are inclusive and optional,
+    created:DATE matches a single day
+
+Other words must all be contained in task method, label or owner username
+(case-insensitive).  The substring lookups use trigram indexes on
+PostgreSQL (see migration 0009, they need the pg_trgm extension) and the
+TaskSearchToken table on other databases.  Words shorter than three
+characters can't use any of them.
+"""
+
+
+import datetime
+import shlex
+
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Q
+
+from kobo.client.constants import TASK_STATES
+from kobo.hub.models import TaskSearchToken, search_tokens
+
+
+__all__ = (
+    "parse_search",
+    "search_query",
+    "validate_search",
+)
+
+
+DATE_FORMAT = "%Y-%m-%d"
+# maximum number of tasks a word is looked up in by their IDs,
+# more common words are looked up by scanning tasks
+CANDIDATE_LIMIT = 1000
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ValueError("Invalid date, use YYYY-MM-DD: %s" % value)
+
+
+def _date_range_query(field, value):
+    start, sep, end = value.partition("..")
+    if not sep:
+        end = start
+    query = Q()
+    if start:
+        query &= Q(**{"%s__gte" % field: _parse_date(start)})
+    if end:
+        query &= Q(**{"%s__lt" % field: _parse_date(end) + datetime.timedelta(days=1)})
+    return query
+
+
+def _state_query(value):
+    states = []
+    for name in value.upper().split(","):
+        state = TASK_STATES.get_num(name)
+        if state is None:
+            raise ValueError("Unknown task state: %s" % name)
+        states.append(state)
+    return Q(state__in=states)
+
+
+FILTERS = {
+    "method": lambda value: Q(method=value),
+    "owner": lambda value: Q(owner__username=value),
+    "state": _state_query,
+    "created": lambda value: _date_range_query("dt_created", value),
+    "finished": lambda value: _date_range_query("dt_finished", value),
+}
+
+
+def parse_search(text):
+    """Split search text into words and typed filters.
+
+    @param text: search text
+    @type  text: str
+    @return: (words, [(filter name, value)])
+    @rtype: tuple
+    """
+    try:
+        parts = shlex.split(text)
+    except ValueError:
+        # unbalanced quotes
+        parts = text.split()
+
+    words = []
+    filters = []
+    for part in parts:
+        name, sep, value = part.partition(":")
+        if sep and value and name.lower() in FILTERS:
+            filters.append((name.lower(), value))
+        else:
+            words.append(part)
+    return words, filters
+
+
+def validate_search(text):
+    """Check filter values of a search without running any queries.
+
+    @param text: search text, see module documentation
+    @type  text: str
+    @raise ValueError: invalid filter value
+    """
+    for name, value in parse_search(text)[1]:
+        FILTERS[name](value)
+
+
+def _find_candidates(tokens):
+    """Return IDs of tasks having all given tokens, None if there are too many."""
+    # start from the rarest token, counting is cheap up to the limit
+    counts = [(TaskSearchToken.objects.filter(token=token)[:CANDIDATE_LIMIT + 1].count(), token) for token in tokens]
+    count, rarest = min(counts)
+    if count > CANDIDATE_LIMIT:
+        return None
+
+    candidates = TaskSearchToken.objects.filter(token=rarest)
+    for token in tokens - set([rarest]):
+        candidates = candidates.filter(Exists(TaskSearchToken.objects.filter(token=token, task=OuterRef("task"))))
+    return list(candidates.values_list("task", flat=True))
+
+
+def _word_query(word):
+    text_query = Q(method__icontains=word) | Q(label__icontains=word)
+
+    tokens = search_tokens(word)
+    if tokens and TaskSearchToken.objects.enabled():
+        # tasks having all trigrams of the word are candidates,
+        # icontains removes those having them in different places;
+        # words contained in many tasks are found faster by scanning
+        # tasks from the newest ones, the first page is filled quickly
+        candidates = _find_candidates(tokens)
+        if candidates is not None:
+            text_query = Q(id__in=candidates) & text_query
+
+    # there are few users, look them up first
+    owners = list(get_user_model().objects.filter(username__icontains=word).values_list("id", flat=True))
+    return text_query | Q(owner__in=owners)
+
+
+def search_query(text):
+    """Return query matching tasks found by a search.
+
+    @param text: search text, see module documentation
+    @type  text: str
+    @rtype: django.db.models.Q
+    @raise ValueError: invalid filter value
+    """
+    words, filters = parse_search(text)
+    query = Q()
+    for name, value in filters:
+        query &= FILTERS[name](value)
+    for word in words:
+        query &= _word_query(word)
+    return query
@@ -21,4 +21,6 @@ urlpatterns = [
     url(r"^finished/$", TaskListView.as_view(state=(TASK_STATES["CLOSED"], TASK_STATES["INTERRUPTED"], TASK_STATES["CANCELED"], TASK_STATES["FAILED"]), title=_("Finished tasks"), order_by=["-dt_created", "id"]), name="task/finished"),
     url(r"^(?P<id>\d+)/log/(?P<log_name>.+)$", kobo.hub.views.task_log, name="task/log"),
     url(r"^(?P<id>\d+)/log-json/(?P<log_name>.+)$", kobo.hub.views.task_log_json, name="task/log-json"),
+    url(r"^(?P<id>\d+)/log-stream/(?P<log_name>.+)$", kobo.hub.views.task_log_stream, name="task/log-stream"),
+    url(r"^(?P<id>\d+)/log-upload/(?P<log_name>.+)$", kobo.hub.views.task_log_upload, name="task/log-upload"),
 ]
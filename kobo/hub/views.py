@@ -1,14 +1,16 @@
 import json
 import mimetypes
 import os
+import time
 
 import django.contrib.auth.views
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME, get_user_model
 from django.core.exceptions import ImproperlyConfigured
-from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse, HttpResponseForbidden
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseNotFound, StreamingHttpResponse, HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import RedirectView
 
 from kobo.django.django_version import django_version_ge
@@ -17,10 +19,16 @@ if django_version_ge('3.2.0'):
 else:
     from django.utils.http import is_safe_url as url_has_allowed_host_and_scheme
 
-from kobo.hub.models import Arch, Channel, Task
+from kobo.client.constants import TASK_STATES, FINISHED_STATES
+from kobo.hub.last_seen import prefetch_last_seen
+from kobo.hub.log_stream import notify_log_changed, wait_for_log_change
+from kobo.hub.models import Arch, Channel, Task, Worker
+from kobo.hub.wakeup import get_tasks_version
 from kobo.hub.forms import TaskSearchForm
-from kobo.django.views.generic import ExtraDetailView, SearchView, UsersAclMixin
+from kobo.django.views.generic import ExtraDetailView, ExtraListView, SearchView, UsersAclMixin
 from kobo.django.compat import gettext_lazy as _
+from kobo.django.helpers import call_if_callable
+from kobo.xmlrpc import write_chunk
 
 
 # max log size returned in HTML-embedded view
@@ -32,6 +40,12 @@ JSON_LOG_MAX_SIZE = getattr(settings, "JSON_LOG_MAX_SIZE", (1024 ** 2) * 8)
 # default LogWatcher JS poll interval
 LOG_WATCHER_INTERVAL = getattr(settings, "LOG_WATCHER_INTERVAL", 5000)
 
+# close log streams after this many seconds, clients reconnect
+LOG_STREAM_TIMEOUT = getattr(settings, "LOG_STREAM_TIMEOUT", 600)
+
+# send a comment to idle log streams this often (seconds)
+LOG_STREAM_KEEPALIVE = getattr(settings, "LOG_STREAM_KEEPALIVE", 15)
+
 
 class UserDetailView(UsersAclMixin, ExtraDetailView):
     model = get_user_model()
@@ -52,7 +66,7 @@ class DetailViewWithWorkers(ExtraDetailView):
 
     def get_context_data(self, **kwargs):
         context = super(DetailViewWithWorkers, self).get_context_data(**kwargs)
-        context["worker_list"] = kwargs["object"].worker_set.order_by("name")
+        context["worker_list"] = prefetch_last_seen(kwargs["object"].worker_set.order_by("name").prefetch_related("arches"))
         return context
 
 class ArchDetailView(ExtraDetailView):
@@ -63,7 +77,19 @@ class ArchDetailView(ExtraDetailView):
 
     def get_context_data(self, **kwargs):
         context = super(ArchDetailView, self).get_context_data(**kwargs)
-        context["worker_list"] = kwargs["object"].worker_set.order_by("name")
+        context["worker_list"] = prefetch_last_seen(kwargs["object"].worker_set.order_by("name").prefetch_related("arches"))
+        return context
+
+class WorkerListView(ExtraListView):
+    queryset = Worker.objects.order_by("name").prefetch_related("arches")
+    template_name = "worker/list.html"
+    context_object_name = "worker_list"
+    title = _("Workers")
+
+    def get_context_data(self, **kwargs):
+        context = super(WorkerListView, self).get_context_data(**kwargs)
+        # look up last_seen of the whole page at once
+        context["worker_list"] = prefetch_last_seen(context["worker_list"])
         return context
 
 class TaskListView(SearchView):
@@ -127,21 +153,32 @@ def _trim_log(text):
 
 def _streamed_log_response(task, log_name, offset, as_attachment):
     file_path = task.logs._get_absolute_log_path(log_name)
-    if not os.path.isfile(file_path) and not file_path.endswith(".gz"):
-        file_path = task.logs._get_absolute_log_path(log_name + ".gz")
-
-    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-
-    try:
-        content_len = os.path.getsize(file_path) - offset
-    except OSError:
-        content_len = 0
-
+    # the log may get compressed any time, try the plain file first
     try:
         f = open(file_path, "rb")
     except FileNotFoundError:
+        f = None
+        if not file_path.endswith(".gz"):
+            file_path = task.logs._get_absolute_log_path(log_name + ".gz")
+            try:
+                f = open(file_path, "rb")
+            except FileNotFoundError:
+                pass
+    if f is None:
         return HttpResponseNotFound('Cannot find file ' + log_name)
 
+    if offset and file_path.endswith(".gz") and not log_name.endswith(".gz"):
+        # offset is in the uncompressed log, serve its rest uncompressed
+        f.close()
+        f = task.logs.open_stream(log_name)
+        file_path = file_path[:-3]
+        size = f.seek(0, os.SEEK_END)
+    else:
+        size = os.fstat(f.fileno()).st_size
+
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    content_len = max(size - offset, 0)
+
     # use _stream_file() instead of passing file object in order to improve performance
     response = StreamingHttpResponse(_stream_file(f, offset), content_type=mimetype)
     response["Content-Length"] = content_len
@@ -179,6 +216,7 @@ def _rendered_log_response(request, task, log_name):
         "log_name": log_name,
         "task": task,
         "json_url": reverse("task/log-json", args=[task.id, log_name]),
+        "stream_url": reverse("task/log-stream", args=[task.id, log_name]),
     }
 
     return render(request, "task/log.html", context)
@@ -246,6 +284,154 @@ def task_log_json(request, id, log_name):
                         content_type="application/json")
 
 
+def _log_event(content, offset):
+    data = json.dumps({"content": str(content, encoding="utf-8", errors="replace"), "new_offset": offset})
+    return ("id: %s\ndata: %s\n\n" % (offset, data)).encode()
+
+
+def _log_stream_events(task, log_name, offset):
+    """Generator of server-sent events with log content as it grows."""
+    start = last_event = time.time()
+    finished = False
+    tasks_version = None
+    last_check = 0
+    while True:
+        try:
+            content = task.logs.get_chunk(log_name, offset, JSON_LOG_MAX_SIZE)
+        except Http404:
+            # not uploaded yet
+            content = b""
+
+        if content:
+            offset += len(content)
+            last_event = time.time()
+            yield _log_event(content, offset)
+            continue
+
+        if finished:
+            yield b"event: finished\ndata: {}\n\n"
+            return
+
+        # the task state is checked only when tasks have changed (see
+        # kobo.hub.wakeup) or once per LOG_STREAM_KEEPALIVE in case the
+        # change counter is not shared by hub processes
+        now = time.time()
+        version = get_tasks_version()
+        if version != tasks_version or now - last_check >= LOG_STREAM_KEEPALIVE:
+            tasks_version = version
+            last_check = now
+            # read the log once more after the task finishes, nothing is missed
+            finished = Task.objects.filter(id=task.id, state__in=FINISHED_STATES).exists()
+            if finished:
+                continue
+
+        if now - start >= LOG_STREAM_TIMEOUT:
+            return
+        if now - last_event >= LOG_STREAM_KEEPALIVE:
+            last_event = now
+            yield b": keepalive\n\n"
+        wait_for_log_change()
+
+
+def task_log_stream(request, id, log_name):
+    """
+    Follow a task log as it grows, as server-sent events (text/event-stream).
+
+    Each event has the new offset as its id and carries a JSON object with
+    the content and the new_offset.  A 'finished' event is sent once the task
+    is finished and the whole log is sent.  The stream is closed after
+    LOG_STREAM_TIMEOUT seconds, clients reconnect with the offset in
+    the offset query argument or the Last-Event-ID header.
+    """
+    if os.path.basename(log_name).startswith("traceback") and not request.user.is_superuser:
+        return HttpResponseForbidden()
+
+    task = get_object_or_404(Task, id=id)
+    try:
+        offset = int(request.META.get("HTTP_LAST_EVENT_ID") or request.GET.get("offset", 0))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid offset.")
+
+    response = StreamingHttpResponse(_log_stream_events(task, log_name, offset), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # don't let proxies (nginx) buffer the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _read_request_body(request, block_size=1024 ** 2):
+    """Generator that returns request body in blocks without loading it to memory."""
+    while 1:
+        data = request.read(block_size)
+        if not data:
+            break
+        yield data
+
+
+@csrf_exempt
+def task_log_upload(request, id, log_name):
+    """
+    Upload a chunk of a task log in the PUT request body.
+
+    Binary alternative to worker.upload_task_log() XML-RPC call.
+    Query arguments:
+      - offset: chunk start position in the file (the file is truncated
+        there, 416 is returned if it's beyond the end of the file), the
+        chunk is appended if omitted
+      - mode: file perms (octal string, example: 644)
+    The X-Kobo-Checksum header must contain sha256 checksum of the chunk.
+    """
+    if request.method != "PUT":
+        return HttpResponseNotAllowed(["PUT"])
+
+    if not call_if_callable(request.user.is_authenticated) or getattr(request, "worker", None) is None:
+        return HttpResponseForbidden("Login required.")
+    request.worker.update_last_seen()
+
+    log_name = os.path.normpath(log_name)
+    if log_name.startswith("..") or os.path.isabs(log_name):
+        return HttpResponseBadRequest("Invalid upload path: %s" % log_name)
+
+    task = get_object_or_404(Task, id=id)
+    if task.state != TASK_STATES["OPEN"]:
+        return HttpResponseBadRequest("Can't upload file for a task which is not OPEN: %s" % task.id)
+
+    chunk_checksum = request.META.get("HTTP_X_KOBO_CHECKSUM")
+    if not chunk_checksum:
+        return HttpResponseBadRequest("Missing X-Kobo-Checksum header.")
+
+    try:
+        chunk_start = int(request.GET.get("offset", -1))
+        mode = int(request.GET.get("mode", "644"), 8)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid offset or mode.")
+
+    log_path = os.path.join(task.task_dir(), log_name)
+    if chunk_start > 0:
+        # writing there would fill the gap with zeros
+        try:
+            size = os.path.getsize(log_path)
+        except FileNotFoundError:
+            size = 0
+        if chunk_start > size:
+            return HttpResponse("Offset %s is beyond the end of the log (%s bytes)." % (chunk_start, size), status=416)
+
+    try:
+        chunk_len, chunk_checksum = write_chunk(
+            log_path,
+            _read_request_body(request),
+            chunk_start,
+            chunk_checksum.lower(),
+            mode=mode,
+        )
+    except ValueError as ex:
+        return HttpResponseBadRequest(str(ex))
+
+    notify_log_changed()
+    return HttpResponse(json.dumps({"size": chunk_len, "checksum": chunk_checksum}).encode(),
+                        content_type="application/json")
+
+
 class LoginView(django.contrib.auth.views.LoginView):
     extra_context = {'title': _('Login')}
     template_name = 'auth/login.html'
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Notification of task changes for workers waiting in wait_for_tasks().
+
+Every task change increments counters in the cache backend named by
+settings.TASK_WAKEUP_CACHE ("default"): a hub-wide one and one per key
+the change concerns (see task_keys()).  Waiting workers read only the
+counters of their keys and look up their tasks when those change.  The
+cache must be shared by all hub processes (e.g. memcached), changes made by
+processes using another cache are noticed after
+settings.WORKER_LONG_POLL_RECHECK seconds.
+"""
+
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from kobo.client.constants import TASK_STATES
+
+
+__all__ = (
+    "arch_key",
+    "channel_key",
+    "get_tasks_version",
+    "notify_tasks_changed",
+    "task_keys",
+    "worker_key",
+)
+
+
+CACHE_KEY = "kobo.hub.wakeup.tasks_version"
+
+
+def worker_key(worker_id):
+    """Key of tasks assigned to the worker and subtasks its tasks wait for."""
+    return "worker:%s" % worker_id
+
+
+def arch_key(arch_id):
+    """Key of FREE awaited tasks of the arch (taken regardless of channel)."""
+    return "arch:%s" % arch_id
+
+
+def channel_key(arch_id, channel_id):
+    """Key of FREE tasks of the arch and channel."""
+    return "arch:%s:channel:%s" % (arch_id, channel_id)
+
+
+def task_keys(state, arch_id, channel_id, awaited, worker_id=None, parent_worker_id=None):
+    """
+    Return keys of workers which may be interested in a task change.
+
+    @param parent_worker_id: worker of the parent task, if the task is awaited and finished
+    @type  parent_worker_id: int
+    @rtype: list
+    """
+    result = []
+    if worker_id is not None:
+        result.append(worker_key(worker_id))
+    if parent_worker_id is not None:
+        result.append(worker_key(parent_worker_id))
+    if state == TASK_STATES["FREE"]:
+        result.append(awaited and arch_key(arch_id) or channel_key(arch_id, channel_id))
+    return result
+
+
+def _get_cache():
+    return caches[getattr(settings, "TASK_WAKEUP_CACHE", "default")]
+
+
+def _increment(keys):
+    cache = _get_cache()
+    for key in keys:
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted meanwhile
+            cache.set(key, 1, None)
+
+
+def notify_tasks_changed(*keys):
+    """
+    Wake up workers waiting for tasks once the current transaction commits.
+
+    @param keys: keys the change concerns (see task_keys()), the hub-wide counter is always incremented
+    @type  keys: str
+    """
+    keys = [CACHE_KEY] + ["%s.%s" % (CACHE_KEY, i) for i in sorted(set(keys))]
+    transaction.on_commit(lambda: _increment(keys))
+
+
+def get_tasks_version(*keys):
+    """
+    Return a value which changes whenever tasks with given keys change.
+
+    @param keys: keys of tasks (see task_keys()), any task if not set
+    @type  keys: str
+    @rtype: int
+    """
+    if not keys:
+        return _get_cache().get(CACHE_KEY, 0)
+    # counters only grow, so does their sum
+    return sum(_get_cache().get_many(["%s.%s" % (CACHE_KEY, i) for i in keys]).values())
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
 
+import datetime
+
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 
 from kobo.hub import models
+from kobo.hub.task_changes import get_task_changes as _get_task_changes
 from kobo.django.xmlrpc.decorators import admin_required, login_required
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -15,6 +19,8 @@ __all__ = (
     "shutdown_worker",
     "task_info",
     "get_tasks",
+    "get_task_changes",
+    "get_task_events",
     "cancel_task",
     "resubmit_task",
     "list_workers",
@@ -70,18 +76,50 @@ def task_info(request, task_id, flat=False):
     return task.export(flat=flat)
 
 
-def get_tasks(request, task_id_list, state_list=None):
-    """get_tasks(task_id_list): list
+# maximum number of tasks returned by get_tasks() without task IDs
+GET_TASKS_MAX_LIMIT = 10000
+_GET_TASKS_OPTIONS = ("limit", "after_id", "fields", "method", "owner", "created_after", "created_before")
+
+
+def _parse_time(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    value = str(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Invalid time, use 'YYYY-MM-DD[ HH:MM:SS]': %s" % value)
+
 
-    @param task_id_list: list of task ids, can be empty, then all tasks are
-    retrieved
+def get_tasks(request, task_id_list, state_list=None, options=None):
+    """get_tasks(task_id_list, state_list=None, options=None): list
+
+    @param task_id_list: list of task ids, can be empty, then tasks are
+    retrieved by pages of at most 10000 tasks ordered by id, use limit and
+    after_id to get the next ones
     @type task_id_list: [int]
     @param state_list: task state ids by which task_id_list should be
     filtered
     @type: [int]
+    @param options: optional dict with:
+      - limit: return at most limit tasks; tasks are ordered by id then
+      - after_id: return tasks with higher ids only; pass the last id of
+        the previous page to get the next one
+      - fields: task_info keys to return (all by default)
+      - method: task method name
+      - owner: owner username
+      - created_after, created_before: creation time range,
+        'YYYY-MM-DD[ HH:MM:SS]', created_before is exclusive
+    @type options: dict
     @return: list of task_info dicts
     @rtype: list
     """
+    options = options or {}
+    unknown = sorted(set(options) - set(_GET_TASKS_OPTIONS))
+    if unknown:
+        raise ValueError("Unknown options: %s" % ", ".join(unknown))
 
     if task_id_list:
         tasks = models.Task.objects.filter(id__in=task_id_list)
@@ -89,7 +127,90 @@ def get_tasks(request, task_id_list, state_list=None):
         tasks = models.Task.objects.all()
     if state_list:
         tasks = tasks.filter(state__in=state_list)
-    return [i.export(flat=True) for i in tasks]
+    if options.get("method"):
+        tasks = tasks.filter(method=options["method"])
+    if options.get("owner"):
+        tasks = tasks.filter(owner__username=options["owner"])
+    if options.get("created_after"):
+        tasks = tasks.filter(dt_created__gte=_parse_time(options["created_after"]))
+    if options.get("created_before"):
+        tasks = tasks.filter(dt_created__lt=_parse_time(options["created_before"]))
+
+    limit = options.get("limit")
+    if not task_id_list:
+        # don't export the whole table into a single response
+        limit = min(int(limit), GET_TASKS_MAX_LIMIT) if limit is not None else GET_TASKS_MAX_LIMIT
+    after_id = options.get("after_id")
+    if after_id is not None:
+        tasks = tasks.filter(id__gt=int(after_id))
+    if limit is not None or after_id is not None:
+        # keyset pagination needs a stable order
+        tasks = tasks.order_by("id")
+
+    if limit is not None:
+        tasks = tasks[:max(int(limit), 0)]
+    return models.export_tasks(tasks, flat=True, fields=options.get("fields"))
+
+
+def get_task_changes(request, root_ids, since_token=None):
+    """get_task_changes(root_ids, since_token=None): dict
+
+    Get tasks of given task trees which have been added or changed state
+    since the call which returned since_token.
+
+    @param root_ids: IDs of the tree roots
+    @type root_ids: [int]
+    @param since_token: token returned by the previous call, all tasks are
+    returned if empty
+    @type since_token: str
+    @return: token for the next call, changed tasks (id, parent, method,
+    state, state_label, worker, is_finished, is_failed), missing root IDs
+    and whether all tasks are finished
+    @rtype: dict
+    """
+    return _get_task_changes(root_ids, since_token)
+
+
+def get_task_events(request, after_seq="0", limit=1000, until_seq=None):
+    """get_task_events(after_seq="0", limit=1000, until_seq=None): dict
+
+    Get task state transitions in the order they have been made.
+
+    Events committed late are not skipped: the result ends before a missing
+    sequence number until the event shows up or TASK_EVENTS_GAP_TIMEOUT
+    seconds pass.  An event committed even later is not returned by calls
+    continuing past its number; such numbers are reported in skipped and can
+    be looked at again with until_seq.
+
+    @param after_seq: return events following the event with this sequence
+    number, pass last_seq of the previous call to follow the events
+    @type after_seq: str
+    @param limit: maximum number of events returned (at most 10000)
+    @type limit: int
+    @param until_seq: return only events up to this sequence number and
+    don't wait for missing ones; pass the bounds of a skipped range (the
+    first number minus one as after_seq) to look for events committed late
+    @type until_seq: str
+    @return: events (seq, task_id, old_state, state, worker, waiting,
+    dt_created), last_seq, the sequence number of the last returned event
+    (after_seq if there are no new events), and skipped, [first, last]
+    ranges of sequence numbers missing among the returned events; sequence
+    numbers are strings, they don't fit in XML-RPC integers
+    @rtype: dict
+    """
+    after_seq = int(after_seq)
+    gap_timeout = getattr(settings, "TASK_EVENTS_GAP_TIMEOUT", 60)
+    if until_seq is not None:
+        until_seq = int(until_seq)
+        gap_timeout = None
+    events = models.TaskEvent.objects.after(after_seq, min(int(limit), 10000), gap_timeout, until_seq)
+    skipped = models.TaskEvent.objects.gaps(after_seq, events)
+    events = [i.export() for i in events]
+    return {
+        "events": events,
+        "last_seq": events and events[-1]["seq"] or str(after_seq),
+        "skipped": [[str(first), str(last)] for first, last in skipped],
+    }
 
 
 @login_required
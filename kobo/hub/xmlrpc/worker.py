@@ -2,12 +2,21 @@
 
 import os
 import random
+import time
 
 from operator import itemgetter
 
-from kobo.client.constants import TASK_STATES
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max, Q
+from django.urls import NoReverseMatch, reverse
+
+from kobo.client.constants import TASK_STATES, FINISHED_STATES
 from kobo.hub.decorators import validate_worker
-from kobo.hub.models import Task
+from kobo.hub.log_stream import notify_log_changed
+from kobo.hub.models import Task, export_tasks, prefetch_for_export
+from kobo.hub.scheduler import scheduler_enabled
+from kobo.hub.wakeup import arch_key, channel_key, get_tasks_version, worker_key
 from kobo.xmlrpc import decode_xmlrpc_chunk
 
 
@@ -21,6 +30,8 @@ __all__ = (
     "timeout_tasks",
 
     "get_tasks_to_assign",
+    "wait_for_tasks",
+    "heartbeat",
     "get_awaited_tasks",
     "get_worker_info",
     "get_worker_id",
@@ -34,6 +45,7 @@ __all__ = (
     "wait",
     "check_wait",
     "upload_task_log",
+    "get_hub_features",
 )
 
 
@@ -44,6 +56,7 @@ def get_worker_info(request):
 
     @rtype: dict
     """
+    request.worker.refresh_state()
     return request.worker.export()
 
 
@@ -64,6 +77,10 @@ def get_worker_tasks(request, also_assigned=False):
     @type  also_assigned: bool
     @rtype: list
     """
+    return _worker_tasks(request.worker, also_assigned)
+
+
+def _worker_tasks(worker, also_assigned=False):
     task_list = []
 
     # Worker.running_tasks returns both OPEN and ASSIGNED tasks but all calls
@@ -71,10 +88,10 @@ def get_worker_tasks(request, also_assigned=False):
     # See: https://github.com/release-engineering/kobo/pull/251#issue-2183712995
     # Old behavior can be toggled with also_assigned parameter
     if also_assigned:
-        tasks = request.worker.running_tasks().order_by("-exclusive", "-awaited", "id")
+        tasks = worker.running_tasks().order_by("-exclusive", "-awaited", "id")
     else:
-        tasks = request.worker.running_tasks().filter(state=TASK_STATES['OPEN']).order_by("-exclusive", "-awaited", "id")
-    for task in tasks:
+        tasks = worker.running_tasks().filter(state=TASK_STATES['OPEN']).order_by("-exclusive", "-awaited", "id")
+    for task in prefetch_for_export(tasks):
         task_info = task.export()
 
         # set wakeup alert
@@ -185,8 +202,15 @@ def update_worker(request, enabled, ready, task_count):
 
 @validate_worker
 def get_tasks_to_assign(request):
+    # the worker may come from the worker cache, reload its limits
+    request.worker.refresh_state()
+    return _tasks_to_assign(request.worker)
+
+
+def _tasks_to_assign(worker):
     task_list = []
-    max_tasks = max(request.worker.max_tasks, 10) # return info about at least 10 tasks
+    max_tasks = max(worker.max_tasks, 10) # return info about at least 10 tasks
+    arches = worker.arches.all()
 
     # Limit each query by max_tasks.
     # Worker sometimes doesn't succeed in taking all tasks from task_list,
@@ -195,35 +219,57 @@ def get_tasks_to_assign(request):
     # If task_list is longer than max_tasks, return it not to perform another queries.
 
     # exclusive tasks
-    for task in request.worker.assigned_tasks().filter(exclusive=True).order_by("-priority", "id")[:max_tasks]:
-        task_info = task.export(flat=False)
-        task_list.append(task_info)
+    tasks = worker.assigned_tasks().filter(exclusive=True).order_by("-priority", "id")[:max_tasks]
+    task_list.extend(export_tasks(tasks, flat=False))
 
     if len(task_list) >= max_tasks:
         return task_list
 
+    # FREE tasks are assigned to workers by the hub-side scheduler
+    push_mode = scheduler_enabled()
+
     # awaited tasks
-    for task in Task.objects.free().filter(awaited=True, arch__in=request.worker.arches.all()).order_by("-priority", "id")[:max_tasks]:
-        task_info = task.export(flat=False)
-        task_list.append(task_info)
+    if not push_mode:
+        tasks = Task.objects.free().filter(awaited=True, arch__in=arches).order_by("-priority", "id")[:max_tasks]
+        task_list.extend(export_tasks(tasks, flat=False))
 
-    if len(task_list) >= max_tasks:
-        return task_list
+        if len(task_list) >= max_tasks:
+            return task_list
 
     # tasks assigned to this worker
-    for task in request.worker.assigned_tasks().filter(exclusive=False).order_by("-priority", "id")[:max_tasks]:
-        task_info = task.export(flat=False)
-        task_list.append(task_info)
+    tasks = worker.assigned_tasks().filter(exclusive=False).order_by("-priority", "id")[:max_tasks]
+    task_list.extend(export_tasks(tasks, flat=False))
 
     if len(task_list) >= max_tasks:
         return task_list
 
+    if push_mode:
+        return task_list
+
     # free tasks for each channel relevant to the worker
-    tasks = []
-    for channel in request.worker.channels.all():
-        for task in Task.objects.free().filter(awaited=False, channel=channel, arch__in=request.worker.arches.all(), priority__gte=request.worker.min_priority).order_by("-priority", "id")[:max_tasks]:
-            task_info = task.export(flat=False)
-            tasks.append(task_info)
+    channel_ids = list(worker.channels.values_list("id", flat=True))
+    if not channel_ids:
+        return task_list
+
+    # Fetch IDs of the first max_tasks free tasks of every channel, each
+    # lookup can use the channel index.  MySQL doesn't support LIMIT in IN
+    # subqueries, the IDs are fetched first: in a single UNION query where
+    # LIMIT is allowed in compound statements, one query per channel
+    # otherwise (SQLite).
+    free_tasks = Task.objects.free().filter(
+        awaited=False,
+        arch__in=arches,
+        priority__gte=worker.min_priority,
+    )
+    candidates = [
+        free_tasks.filter(channel=channel_id).order_by("-priority", "id").values_list("id", flat=True)[:max_tasks]
+        for channel_id in channel_ids
+    ]
+    if len(candidates) > 1 and connection.features.supports_slicing_ordering_in_compound:
+        task_ids = list(candidates[0].union(*candidates[1:], all=True))
+    else:
+        task_ids = [task_id for i in candidates for task_id in i]
+    tasks = export_tasks(Task.objects.filter(id__in=task_ids), flat=False)
 
     # Shuffle the list to prevent task starvation in some channels.
     # It could also help to lower task assignment conflicts.
@@ -235,13 +281,120 @@ def get_tasks_to_assign(request):
     return task_list
 
 
+def _wakeup_keys(worker):
+    """Return keys of tasks the worker may be woken up by, see kobo.hub.wakeup."""
+    result = [worker_key(worker.id)]
+    if not scheduler_enabled():
+        arch_ids = list(worker.arches.values_list("id", flat=True))
+        channel_ids = list(worker.channels.values_list("id", flat=True))
+        result.extend(arch_key(i) for i in arch_ids)
+        result.extend(channel_key(i, j) for i in arch_ids for j in channel_ids)
+    return result
+
+
+def _wakeup_token(worker, version):
+    """Return a string which changes whenever there is new work for the worker:
+    tasks it could take changed or a subtask of its waiting task finished.
+
+    The version of the worker's keys makes the token change on every
+    notified change, count and max. ID catch changes made by processes
+    which don't share the cache.
+    """
+    tasks = Q(state=TASK_STATES["ASSIGNED"], worker=worker)
+    if not scheduler_enabled():
+        arches = worker.arches.all()
+        tasks |= Q(state=TASK_STATES["FREE"], awaited=True, arch__in=arches)
+        tasks |= Q(state=TASK_STATES["FREE"], awaited=False, arch__in=arches, channel__in=worker.channels.all(), priority__gte=worker.min_priority)
+    # see get_worker_tasks(), it sets an alert in such case
+    tasks |= Q(awaited=True, state__in=FINISHED_STATES, parent__worker=worker, parent__state=TASK_STATES["OPEN"], parent__waiting=True)
+
+    result = Task.objects.filter(tasks).aggregate(count=Count("id"), max_id=Max("id"))
+    return "%s:%s:%s" % (result["count"], result["max_id"] or 0, version)
+
+
+@validate_worker
+def wait_for_tasks(request, timeout, last_token=None):
+    """
+    Long poll: block until there is new work for the worker or timeout passes.
+
+    Tasks are looked up only when tasks the worker may take have changed
+    (see kobo.hub.wakeup) or every WORKER_LONG_POLL_RECHECK seconds.
+
+    @param timeout: max. time to wait (seconds), limited by WORKER_LONG_POLL_TIMEOUT hub setting
+    @type  timeout: int
+    @param last_token: token returned by the previous call
+    @type  last_token: str
+    @return: token to be passed to the next call
+    @rtype: str
+    """
+    timeout = min(timeout, getattr(settings, "WORKER_LONG_POLL_TIMEOUT", 60))
+    interval = getattr(settings, "WORKER_LONG_POLL_INTERVAL", 1)
+    recheck = getattr(settings, "WORKER_LONG_POLL_RECHECK", 10)
+    deadline = time.time() + timeout
+    recheck_at = time.time() + recheck
+
+    keys = _wakeup_keys(request.worker)
+    # read the version first, changes made meanwhile aren't missed
+    version = get_tasks_version(*keys)
+    token = _wakeup_token(request.worker, version)
+    while token == last_token:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval, remaining))
+
+        current = get_tasks_version(*keys)
+        if current != version or time.time() >= recheck_at:
+            version = current
+            recheck_at = time.time() + recheck
+            token = _wakeup_token(request.worker, version)
+    return token
+
+
+@validate_worker
+def heartbeat(request, enabled, ready, task_id_list, finished_task_id_list, include_tasks=True):
+    """
+    Exchange worker state with the hub in a single call.
+
+    Combines update_worker, get_worker_tasks, get_task_no_verify/get_task
+    for the given tasks and get_tasks_to_assign.
+
+    @param enabled: worker's idea of its enabled flag
+    @type  enabled: bool
+    @param ready: worker's idea of its ready flag
+    @type  ready: bool
+    @param task_id_list: IDs of tasks running on the worker
+    @type  task_id_list: [int]
+    @param finished_task_id_list: IDs of tasks which have just finished on the worker
+    @type  finished_task_id_list: [int]
+    @param include_tasks: whether to return tasks to assign
+    @type  include_tasks: bool
+    @return: {"worker_info": dict, "tasks": [task_info] (see get_worker_tasks),
+              "task_info_list": [task_info] (tasks from task_id_list and
+              finished_task_id_list), "tasks_to_assign": [task_info]}
+    @rtype: dict
+    """
+    worker_info = request.worker.update_worker(enabled, ready, len(task_id_list))
+
+    # finished tasks are verified the same way as in get_task()
+    tasks = Task.objects.filter(Q(id__in=task_id_list) | Q(id__in=finished_task_id_list, worker=request.worker))
+
+    tasks_to_assign = []
+    if include_tasks and worker_info["enabled"] and worker_info["ready"]:
+        tasks_to_assign = _tasks_to_assign(request.worker)
+
+    return {
+        "worker_info": worker_info,
+        "tasks": _worker_tasks(request.worker),
+        "task_info_list": export_tasks(tasks),
+        "tasks_to_assign": tasks_to_assign,
+    }
+
+
 @validate_worker
 def get_awaited_tasks(request, awaited_task_list):
-    task_list = []
-    for task in Task.objects.filter(awaited=True, parent__in=[i["id"] for i in awaited_task_list]):#.order_by("-exclusive", "-awaited", "id")[:50]:
-        task_info = task.export(False)
-        task_list.append(task_info)
-    return task_list
+    tasks = Task.objects.filter(awaited=True, parent__in=[i["id"] for i in awaited_task_list])
+    return export_tasks(tasks, flat=False)
 
 
 @validate_worker
@@ -319,4 +472,29 @@ def upload_task_log(request, task_id, relative_path, mode,
     except ValueError:
         return False
 
+    notify_log_changed()
     return True
+
+
+@validate_worker
+def get_hub_features(request):
+    """
+    Get optional hub features the worker may use.
+
+    Keys present only if the feature is available:
+      - upload_task_log_url: path of task log upload PUT endpoint,
+        with %(task_id)s and %(path)s placeholders
+
+    @rtype: dict
+    """
+    result = {}
+
+    try:
+        url = reverse("task/log-upload", args=[1, "log"])
+    except NoReverseMatch:
+        pass
+    else:
+        # placeholders would be quoted by reverse()
+        result["upload_task_log_url"] = url[:-len("1/log-upload/log")] + "%(task_id)s/log-upload/%(path)s"
+
+    return result
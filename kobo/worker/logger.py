@@ -1,7 +1,6 @@
 import threading
 import time
 import os
-import queue
 from io import BytesIO
 
 import kobo.tback
@@ -14,63 +13,103 @@ __all__ = (
 
 
 class LoggingThread(threading.Thread):
-    """Send stdout data to hub in a background thread."""
+    """
+    Send stdout data to hub in a background thread.
+
+    Written data is coalesced in a buffer and uploaded when it reaches
+    flush_size bytes or flush_lines lines (0 disables the check) or when
+    flush_interval seconds have passed since the last upload.  write()
+    doesn't wait for uploads; it blocks only when more than max_pending
+    bytes are waiting for the hub (backpressure on chatty tasks).  Failed
+    uploads are retried every retry_interval seconds.
+    """
 
     def __init__(self, hub, task_id, *args, **kwargs):
         self._logger = kwargs.pop('logger', None)
+        self._flush_size = kwargs.pop('flush_size', 1200)
+        self._flush_interval = kwargs.pop('flush_interval', 5)
+        self._flush_lines = kwargs.pop('flush_lines', 0)
+        self._max_pending = kwargs.pop('max_pending', 16 * 1024**2)
+        self._retry_interval = kwargs.pop('retry_interval', 5)
         threading.Thread.__init__(self, *args, **kwargs)
         self._hub = hub
         self._task_id = task_id
-        self._buffer_size = kwargs.pop('buffer_size', 256)
-        self._queue = queue.Queue(maxsize=self._buffer_size)
         self._event = threading.Event()
+        # guards _pending* and the counters below
+        self._cond = threading.Condition()
+        self._pending = bytearray()
+        self._pending_lines = 0
         self._in_logger_call = False
         self._running = True
         self._send_time = 0
-        self._send_data = b""
+        self._send_data = bytearray()
+        self._send_lines = 0
         self._timeout = int(os.environ.get("KOBO_LOGGING_THREAD_TIMEOUT", 600))
-
-    def read_queue(self):
-        out = self._queue.get_nowait()
-
-        # We do not know whether we're being sent bytes or text.
-        # The hub API always wants bytes.
-        # Ensure we safely convert everything to bytes as we go.
-        if isinstance(out, str):
-            out = out.encode('utf-8', errors='replace')
-
-        return out
+        self._start_time = time.time()
+        self._bytes_sent = 0
+        self._uploads = 0
+        self._backpressure_waits = 0
+
+    def _flush_due(self, size, lines, now):
+        if size >= self._flush_size:
+            return True
+        if self._flush_lines and lines >= self._flush_lines:
+            return True
+        return now - self._send_time >= self._flush_interval
+
+    def stats(self):
+        """
+        Return upload statistics.
+
+        @return: bytes_sent, uploads, bytes_per_second, uploads_per_second,
+                 queue_depth (bytes waiting to be uploaded) and
+                 backpressure_waits (how many times write() had to wait)
+        @rtype: dict
+        """
+        elapsed = max(time.time() - self._start_time, 0.001)
+        with self._cond:
+            return {
+                "bytes_sent": self._bytes_sent,
+                "uploads": self._uploads,
+                "bytes_per_second": self._bytes_sent / elapsed,
+                "uploads_per_second": self._uploads / elapsed,
+                "queue_depth": len(self._pending) + len(self._send_data),
+                "backpressure_waits": self._backpressure_waits,
+            }
 
     def run(self):
-        """Send queue content to hub."""
-        while self._running or not self._queue.empty() or self._send_data:
-            if self._queue.empty():
-                self._event.wait(5)
-
-            self._event.clear()
-            for _ in range(self._buffer_size):
-                try:
-                    self._send_data += self.read_queue()
-                except queue.Empty:
-                    break
-
-            if not self._send_data:
-                continue
-
-            now = int(time.time())
-            if self._running and len(self._send_data) < 1200 and now - self._send_time < 5:
+        """Send buffered data to hub."""
+        while True:
+            # read before taking the data, everything written before stop()
+            # is in the buffer then
+            running = self._running
+            with self._cond:
+                self._send_data += self._pending
+                self._send_lines += self._pending_lines
+                self._pending = bytearray()
+                self._pending_lines = 0
+                self._cond.notify_all()
+
+            if not self._send_data and not running:
+                break
+
+            now = time.time()
+            if running and not (self._send_data and self._flush_due(len(self._send_data), self._send_lines, now)):
+                self._event.wait(max(self._send_time + self._flush_interval - now, 0.1))
+                self._event.clear()
                 continue
 
             try:
-                self._hub.upload_task_log(BytesIO(self._send_data), self._task_id, "stdout.log", append=True)
-                self._send_time = now
-                self._send_data = b""
+                self._hub.upload_task_log(BytesIO(bytes(self._send_data)), self._task_id, "stdout.log", append=True)
             except Exception:
                 # Any exception other than an XML-RPC fault may be fatal. It is
                 # possible that we've encountered a retryable error, such as a
                 # temporary network disruption between worker and hub. Attempt
                 # to retry for a bit.
                 if now - self._send_time <= self._timeout:
+                    # neither writes nor stop() may shorten the delay,
+                    # the hub would be flooded with retries
+                    time.sleep(self._retry_interval)
                     continue
 
                 # If the timemout has been exceeded, we can assume we've
@@ -87,20 +126,39 @@ class LoggingThread(threading.Thread):
                     self._logger.log_critical(msg)
                 raise
 
+            with self._cond:
+                self._bytes_sent += len(self._send_data)
+                self._uploads += 1
+                self._send_data = bytearray()
+                self._send_lines = 0
+            self._send_time = now
+
     def write(self, data):
-        """Add data to the queue and set the event for sending queue content."""
+        """Add data to the buffer and wake up the thread if it should be sent."""
         # Discard the data if the thread is not running to prevent deadlock
-        # when the queue is full.
+        # when the buffer is full.
         if not self.is_alive():
             return
 
         if threading.get_ident() != self.ident:
-            self._queue.put(data)
-            self._event.set()
-
-        # If self._hub.upload_task_log() called self._queue.put(), it would
-        # cause deadlock because self._queue uses locks that are not reentrant
-        # and queue may already be full.
+            # We do not know whether we're being sent bytes or text.
+            # The hub API always wants bytes.
+            # Ensure we safely convert everything to bytes as we go.
+            if isinstance(data, str):
+                data = data.encode('utf-8', errors='replace')
+
+            with self._cond:
+                while len(self._pending) >= self._max_pending and self.is_alive():
+                    self._backpressure_waits += 1
+                    self._cond.wait(1)
+                self._pending += data
+                self._pending_lines += data.count(b"\n")
+                flush = self._flush_due(len(self._pending), self._pending_lines, time.time())
+            if flush:
+                self._event.set()
+
+        # If self._hub.upload_task_log() called self.write(), it could block
+        # the thread on its own buffer or never stop producing data.
         #
         # Log only data with printable characters.
         elif self._logger and data.strip():
@@ -118,6 +176,14 @@ class LoggingThread(threading.Thread):
         self._running = False
         self._event.set()
         self.join()
+        if self._logger:
+            stats = self.stats()
+            stats["task_id"] = self._task_id
+            self._logger.log_debug(
+                "Task %(task_id)s log upload: %(bytes_sent)s bytes in %(uploads)s uploads, "
+                "%(bytes_per_second).1f B/s, %(uploads_per_second).2f uploads/s, "
+                "%(backpressure_waits)s backpressure waits" % stats
+            )
 
 
 class LoggingIO():
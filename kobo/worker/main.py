@@ -63,9 +63,11 @@ def main_loop(conf, foreground=False, task_manager_class=None):
             tm.log_debug(80 * '-')
             # poll hub for new tasks
             tm.hub._login()
-            tm.update_worker_info()
-            tm.update_tasks()
-            tm.get_next_task()
+            heartbeat = getattr(tm, "heartbeat", None)
+            if heartbeat is None or not heartbeat():
+                tm.update_worker_info()
+                tm.update_tasks()
+                tm.get_next_task()
 
             # write to stdout / stderr
             sys.stdout.flush()
@@ -51,6 +51,7 @@ import datetime
 import errno
 import os
 import signal
+import socket
 import sys
 import time
 
@@ -137,6 +138,15 @@ class TaskManager(TaskManagerBase):
 
         self.task_container = TaskContainer()
 
+        # long poll support; disabled when the hub doesn't provide it
+        self.long_poll = self.conf.get("LONG_POLL", False)
+        self._wakeup_token = None
+
+        # batched heartbeat support; disabled when the hub doesn't provide it
+        self.use_heartbeat = self.conf.get("HEARTBEAT", True)
+        # IDs of finished tasks not reported by a heartbeat yet
+        self._finished_tasks = set()
+
         # self.hub (xml-rpc hub client) is created here
         self.hub = HubProxy(conf, client_type="worker", logger=self._logger, **kwargs)
         # worker information obtained from hub
@@ -148,8 +158,31 @@ class TaskManager(TaskManagerBase):
         return "#%s [%s]" % (task_info["id"], task_info["method"])
 
     def sleep(self):
-        """Sleep between polls."""
-        time.sleep(self.conf.get("SLEEP_TIME", 20))
+        """Sleep between polls.
+
+        With LONG_POLL enabled, wait on the hub instead and return as soon as
+        there is new work for the worker.
+        """
+        sleep_time = self.conf.get("SLEEP_TIME", 20)
+
+        if self.long_poll and self.worker_info["enabled"] and self.worker_info["ready"] and not self.locked:
+            try:
+                self._wakeup_token = self.hub.worker.wait_for_tasks(sleep_time, self._wakeup_token)
+                return
+            except (ShutdownException, KeyboardInterrupt):
+                raise
+            except Fault as ex:
+                if "is not supported" not in ex.faultString:
+                    # e.g. a database error, long poll may work next time
+                    self.log_error("Long poll failed: %s" % ex)
+                else:
+                    # an old hub without wait_for_tasks()
+                    self.log_warning("Long poll is not available, disabling it: %s" % ex)
+                    self.long_poll = False
+            except Exception as ex:
+                self.log_error("Long poll failed: %s" % ex)
+
+        time.sleep(sleep_time)
 
     def update_worker_info(self):
         """Update worker_info dictionary."""
@@ -175,6 +208,59 @@ class TaskManager(TaskManagerBase):
             else:
                 self.log_info("Waking up task %s." % self._task_str(task_info))
 
+    def heartbeat(self):
+        """Update worker info, process tasks and take new ones in a single hub call.
+
+        This replaces update_worker_info(), update_tasks() and get_next_task().
+        Return False if the hub doesn't support it, the caller is expected
+        to fall back to the separate calls then.  If the call fails, finished
+        tasks are reported by the next heartbeat.
+        """
+        if not self.use_heartbeat:
+            return False
+
+        # reap finished tasks first, so the hub returns their final state;
+        # they are kept until a heartbeat succeeds
+        for task_id in list(self.pid_dict.keys()):
+            if self.is_finished_task(task_id):
+                self.log_info("Task has finished: %s" % task_id)
+                self._finished_tasks.add(task_id)
+                if self.cleanup_task(task_id):
+                    del self.pid_dict[task_id]
+        finished_tasks = set(self._finished_tasks)
+
+        self.log_debug("Sending heartbeat.")
+        try:
+            result = self.hub.worker.heartbeat(
+                self.worker_info["enabled"],
+                self.worker_info["ready"],
+                list(self.pid_dict.keys()),
+                sorted(finished_tasks),
+                not self.locked,
+            )
+        except Fault as ex:
+            if "is not supported" not in ex.faultString:
+                # the hub failed this time, try again with the next heartbeat
+                self.log_error("Heartbeat failed: %s" % ex)
+                return True
+            # an old hub without heartbeat()
+            self.log_warning("Heartbeat is not available, disabling it: %s" % ex)
+            self.use_heartbeat = False
+            for task_id in sorted(finished_tasks):
+                self.finish_task(self.hub.worker.get_task(task_id))
+                self._finished_tasks.discard(task_id)
+            return False
+        except (ProtocolError, socket.error) as ex:
+            self.log_error("Heartbeat failed: %s" % ex)
+            return True
+
+        self._finished_tasks.difference_update(finished_tasks)
+        self.worker_info = result["worker_info"]
+        task_infos = dict((i["id"], i) for i in result["task_info_list"])
+        self._update_tasks(result["tasks"], task_infos, finished_tasks)
+        self.get_next_task(result["tasks_to_assign"])
+        return True
+
     def update_tasks(self):
         """Read and process task statuses from hub.
 
@@ -182,13 +268,25 @@ class TaskManager(TaskManagerBase):
           1. clean up after tasks that are not longer active
           2. wake waiting tasks if appropriate
         """
+        self._update_tasks(self.hub.worker.get_worker_tasks(), {}, set())
+        self.update_worker_info()
+
+    def _update_tasks(self, worker_tasks, task_infos, finished_tasks):
+        """Process task statuses obtained from hub.
+
+        @param worker_tasks: result of hub.worker.get_worker_tasks()
+        @type  worker_tasks: [dict]
+        @param task_infos: up-to-date task information already known, {task_id: task_info}
+        @type  task_infos: dict
+        @param finished_tasks: IDs of tasks already known to be finished
+        @type  finished_tasks: set
+        """
 
         task_list = {}
         interrupted_list = []
         timeout_list = []
-        finished_tasks = set()
 
-        for task_info in self.hub.worker.get_worker_tasks():
+        for task_info in worker_tasks:
             self.log_debug("Checking task: %s." % self._task_str(task_info))
 
             if task_info["state"] == TASK_STATES["OPEN"] and task_info["id"] not in self.pid_dict:
@@ -209,9 +307,16 @@ class TaskManager(TaskManagerBase):
             task_list[task_info["id"]] = task_info
             self.wakeup_task(task_info)
 
+        for task_id in finished_tasks:
+            task_list.pop(task_id, None)
+
         self.task_dict = task_list
         self.log_debug("Current tasks: %r" % list(self.task_dict.keys()))
 
+        # states of these tasks are about to change
+        for task_id in interrupted_list + timeout_list:
+            task_infos.pop(task_id, None)
+
         if interrupted_list:
             self.log_warning("Closing interrupted tasks: %r" % sorted(interrupted_list))
             try:
@@ -236,6 +341,8 @@ class TaskManager(TaskManagerBase):
             if self.is_finished_task(task_id):
                 self.log_info("Task has finished: %s" % task_id)
                 finished_tasks.add(task_id)
+                # the task may have closed itself after task_infos were obtained
+                task_infos.pop(task_id, None)
                 # the subprocess handles most everything, we just need to clear things out
                 if self.cleanup_task(task_id):
                     del self.pid_dict[task_id]
@@ -251,7 +358,7 @@ class TaskManager(TaskManagerBase):
                 #  - task is forcibly reassigned/unassigned
 
                 try:
-                    task = self.hub.worker.get_task_no_verify(task_id)
+                    task = task_infos.get(task_id) or self.hub.worker.get_task_no_verify(task_id)
                     if task["state"] == TASK_STATES["CANCELED"]:
                         self.log_info("Killing canceled task %r (pid %r)" % (task_id, pid))
                         if self.cleanup_task(task_id):
@@ -277,13 +384,15 @@ class TaskManager(TaskManagerBase):
                     raise
 
         for task_id in sorted(finished_tasks):
-            task_info = self.hub.worker.get_task(task_id)
+            task_info = task_infos.get(task_id) or self.hub.worker.get_task(task_id)
             self.finish_task(task_info)
 
-        self.update_worker_info()
+    def get_next_task(self, tasks_to_open=None):
+        """Takes new task.
 
-    def get_next_task(self):
-        """Takes new task."""
+        @param tasks_to_open: result of hub.worker.get_tasks_to_assign() if already known
+        @type  tasks_to_open: [dict]
+        """
         if not self.worker_info["enabled"]:
             self.log_info("Worker is disabled.")
             return
@@ -308,7 +417,8 @@ class TaskManager(TaskManagerBase):
 
             return
 
-        tasks_to_open = self.hub.worker.get_tasks_to_assign()
+        if tasks_to_open is None:
+            tasks_to_open = self.hub.worker.get_tasks_to_assign()
         self.log_debug("Current tasks to open: %r" % [ti["id"] for ti in tasks_to_open])
 
         # process tasks that could be transitioned to the OPEN state
@@ -419,7 +529,12 @@ class TaskManager(TaskManagerBase):
         task = TaskClass(hub, self.conf, task_info["id"], task_info["args"])
 
         # redirect stdout and stderr
-        thread = kobo.worker.logger.LoggingThread(hub, task_info["id"], logger=self)
+        thread = kobo.worker.logger.LoggingThread(
+            hub, task_info["id"], logger=self,
+            flush_size=self.conf.get("LOG_FLUSH_SIZE", 1200),
+            flush_interval=self.conf.get("LOG_FLUSH_INTERVAL", 5),
+            flush_lines=self.conf.get("LOG_FLUSH_LINES", 0),
+        )
         sys.stdout = kobo.worker.logger.LoggingIO(open(os.devnull, "w"), thread)
         sys.stderr = sys.stdout
         thread.start()
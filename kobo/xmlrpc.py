@@ -7,6 +7,7 @@ import six.moves.http_cookiejar as cookielib
 import fcntl
 import hashlib
 import http.client as httplib
+import json
 import os
 import socket
 import ssl
@@ -27,16 +28,26 @@ except ImportError:
 
 
 __all__ = (
+    "ConnectionPool",
     "CookieTransport",
     "SafeCookieTransport",
     "retry_request_decorator",
     "encode_xmlrpc_chunks_iterator",
     "decode_xmlrpc_chunk",
+    "write_chunk",
 )
 
 
 CONNECTION_LOCK = threading.Lock()
 
+# max number of in-progress uploads whose checksum state is kept, see write_chunk()
+FILE_CHECKSUM_STATES_MAX = 1024
+# number of bytes at the end of a file hashed to check that a checksum
+# state still matches the file, see _FileChecksumStates
+FILE_CHECKSUM_TAIL_SIZE = 64 * 1024
+# suffix of files next to uploaded files in which checksum states are stored
+FILE_CHECKSUM_STATE_SUFFIX = ".kobo-sha256"
+
 
 class HTTPProxyConnection(httplib.HTTPConnection):
     def __init__(self, host, proxy, port=None, proxy_user=None, proxy_password=None, **kwargs):
@@ -65,6 +76,119 @@ class HTTPSProxyConnection(httplib.HTTPSConnection):
         self.set_tunnel(host, port, headers=proxy_header)
 
 
+class ConnectionPool(object):
+    """
+    Pool of idle keep-alive HTTP(S) connections.
+
+    A pool can be shared by several transports (XML-RPC calls and file
+    uploads of a HubProxy, for instance).  Connections are keyed by
+    (scheme, host[:port]).  A connection is held exclusively by its user
+    between acquire() and release(), the pool itself is thread safe.
+
+    @param max_size: maximum number of idle connections kept (0 disables pooling)
+    @type  max_size: int
+    @param max_idle: close connections idle for more than max_idle seconds
+    @type  max_idle: int
+    """
+
+    def __init__(self, max_size=4, max_idle=60):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = []  # [(key, connection, last_used)], most recently used last
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        """Close connections idle for too long. Call with the lock held."""
+        expired = [i for i in self._idle if now - i[2] > self.max_idle]
+        if expired:
+            self._idle = [i for i in self._idle if now - i[2] <= self.max_idle]
+        return [i[1] for i in expired]
+
+    def acquire(self, key, factory):
+        """
+        Return an idle connection for key or create a new one.
+
+        @param key: (scheme, host[:port])
+        @type  key: tuple
+        @param factory: called without arguments to create a new connection
+        @type  factory: callable
+        @return: (connection, reused)
+        @rtype:  (http.client.HTTPConnection, bool)
+        """
+        conn = None
+        with self._lock:
+            to_close = self._evict(time.time())
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][0] == key:
+                    conn = self._idle.pop(i)[1]
+                    self.reused += 1
+                    break
+            else:
+                self.created += 1
+
+        for i in to_close:
+            i.close()
+
+        if conn is not None:
+            return conn, True
+        return factory(), False
+
+    def release(self, key, conn, response=None):
+        """
+        Return a connection to the pool.
+
+        The response must be fully read.  Connections the server is going
+        to close are closed instead of being pooled.
+
+        @param key: (scheme, host[:port])
+        @type  key: tuple
+        @param conn: connection obtained from acquire()
+        @type  conn: http.client.HTTPConnection
+        @param response: last response read from the connection
+        @type  response: http.client.HTTPResponse
+        """
+        if response is not None and (response.will_close or not response.isclosed()):
+            conn.close()
+            return
+
+        with self._lock:
+            to_close = self._evict(time.time())
+            if self.max_size > 0 and getattr(conn, "sock", None) is not None:
+                self._idle.append((key, conn, time.time()))
+                if len(self._idle) > self.max_size:
+                    to_close.append(self._idle.pop(0)[1])
+            else:
+                to_close.append(conn)
+
+        for i in to_close:
+            i.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            to_close = [i[1] for i in self._idle]
+            self._idle = []
+
+        for i in to_close:
+            i.close()
+
+    def stats(self):
+        """
+        Return pool statistics.
+
+        @return: {"created": int, "reused": int, "idle": int}
+        @rtype: dict
+        """
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": len(self._idle),
+            }
+
+
 class CookieResponse(object):
     """Fake response class for cookie extraction."""
 
@@ -93,6 +217,8 @@ class CookieTransport(xmlrpclib.Transport):
     def __init__(self, *args, **kwargs):
         cookiejar = kwargs.pop("cookiejar", None)
         self.timeout = kwargs.pop("timeout", None)
+        self.connection_pool = kwargs.pop("connection_pool", None) or getattr(self, "connection_pool", None) or ConnectionPool()
+        self._local = threading.local()
         self.proxy_config = self._get_proxy(**kwargs)
         self.no_proxy = os.environ.get("no_proxy", "").lower().split(',')
         self.context = kwargs.pop('context', None)
@@ -164,6 +290,30 @@ class CookieTransport(xmlrpclib.Transport):
         return proxy_settings
 
     def make_connection(self, host):
+        """Return a pooled keep-alive connection to host."""
+        key = (self.scheme, host.lower())
+        conn, _ = self.connection_pool.acquire(key, lambda: self._new_connection(host))
+        # connections are tracked per thread, see the comment in _new_connection()
+        self._connection = (None, None)
+        self._local.connection = (key, conn)
+        return conn
+
+    def release_connection(self, response=None):
+        """Return the connection of the current thread to the pool."""
+        key, conn = getattr(self._local, "connection", (None, None))
+        if conn is not None:
+            self._local.connection = (None, None)
+            self.connection_pool.release(key, conn, response)
+
+    def close(self):
+        """Close the connection of the current thread."""
+        key, conn = getattr(self._local, "connection", (None, None))
+        if conn is not None:
+            self._local.connection = (None, None)
+            conn.close()
+        xmlrpclib.Transport.close(self)
+
+    def _new_connection(self, host):
         host.lower()
         host_ = host  # Host with(out) port
         if ':' in host:
@@ -376,6 +526,8 @@ class CookieTransport(xmlrpclib.Transport):
                 # discard any response data
                 if (response.getheader("content-length", 0)):
                     response.read()
+                # GSSAPI context is often bound to the connection, retry on the same one
+                self.release_connection(response)
 
                 # retry the original request & add the Authorization header:
                 self._krb_headers = [("Authorization", "Negotiate %s" % challenge)]
@@ -388,8 +540,12 @@ class CookieTransport(xmlrpclib.Transport):
             if response.status == 200:
                 self.verbose = verbose
                 self._save_cookies(response.msg, cookie_request)
-                return self.parse_response(response)
+                result = self.parse_response(response)
+                self.release_connection(response)
+                return result
         except xmlrpclib.Fault:
+            # the response has been read completely
+            self.release_connection(response)
             raise
         except Exception:
             # All unexpected errors leave connection in
@@ -400,6 +556,7 @@ class CookieTransport(xmlrpclib.Transport):
         # discard any response data and raise exception
         if (response.getheader("content-length", 0)):
             response.read()
+        self.release_connection(response)
         raise xmlrpclib.ProtocolError(host + handler, response.status, response.reason, response.msg)
 
     # override the appropriate request method
@@ -429,7 +586,7 @@ class SafeCookieTransport(CookieTransport, xmlrpclib.SafeTransport):
     """
     scheme = "https"
 
-    def make_connection(self, host):
+    def _new_connection(self, host):
         host.lower()
         host_ = host  # Host with(out) port
         if ':' in host:
@@ -455,6 +612,7 @@ class SafeCookieTransport(CookieTransport, xmlrpclib.SafeTransport):
 
     def __init__(self, *args, **kwargs):
         self.context = kwargs.pop('context', None)
+        self.connection_pool = kwargs.pop("connection_pool", None)
         xmlrpclib.SafeTransport.__init__(self, *args, **kwargs)
         CookieTransport.__init__(self, *args, **kwargs)
 
@@ -564,8 +722,37 @@ def decode_xmlrpc_chunk(chunk_start, chunk_len, chunk_checksum, encoded_chunk, w
     if not write_to:
         return chunk
 
-    # code below handles writing to a file
+    write_chunk(write_to, [chunk], chunk_start, mode=mode)
 
+    if chunk_start != -1 and chunk_len == -1:
+        # final chunk, verify checksum of whole file
+        file_checksum = get_file_checksum(write_to)
+        if file_checksum != chunk_checksum:
+            raise ValueError("File checksum does not match.")
+
+    return chunk
+
+
+def write_chunk(write_to, data, chunk_start=-1, chunk_checksum=None, mode=0o644):
+    """
+    Write a data chunk to a file, hash it while it's being written.
+
+    If chunk_checksum doesn't match, the file is truncated back to its
+    original size and ValueError is raised.
+
+    @param write_to: path to a file in which the data will be written
+    @type  write_to: str
+    @param data: data blocks (bytes), read and written one by one
+    @type  data: iterable
+    @param chunk_start: chunk start position in the file (-1 for append)
+    @type  chunk_start: int
+    @param chunk_checksum: expected sha256 checksum (lower case) of the chunk
+    @type  chunk_checksum: str
+    @param mode: file permissions (example: 0644)
+    @type  mode: int
+    @return: (chunk length, sha256 checksum of the chunk)
+    @rtype:  (int, str)
+    """
     target_dir = os.path.dirname(write_to)
     if not os.path.isdir(target_dir):
         try:
@@ -574,21 +761,167 @@ def decode_xmlrpc_chunk(chunk_start, chunk_len, chunk_checksum, encoded_chunk, w
             if ex.errno != 17:
                 raise
 
+    checksum = hashlib.sha256()
+    chunk_len = 0
+    file_checksum = None
+
     fd = os.open(write_to, os.O_RDWR | os.O_CREAT, mode)
     fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
     try:
-        if chunk_start != -1:
+        stat_before = os.fstat(fd)
+        if chunk_start not in (-1, stat_before.st_size):
+            # truncating to the same size would change mtime too
             os.ftruncate(fd, chunk_start)
-        os.lseek(fd, 0, 2) # 2=os.SEEK_END
-        os.write(fd, chunk)
+        start = os.lseek(fd, 0, 2) # 2=os.SEEK_END
+
+        # continue whole file checksum if the chunk follows previously written data;
+        # appended chunks (logs) are never verified as a whole
+        if chunk_start == 0:
+            file_checksum = hashlib.sha256()
+        elif chunk_start != -1:
+            file_checksum = _file_checksum_states.get(write_to, fd, stat_before, start)
+
+        for block in data:
+            if not block:
+                continue
+            checksum.update(block)
+            if file_checksum is not None:
+                file_checksum.update(block)
+            chunk_len += len(block)
+            while block:
+                block = block[os.write(fd, block):]
+
+        if chunk_checksum is not None and chunk_checksum != checksum.hexdigest().lower():
+            os.ftruncate(fd, start)
+            raise ValueError("Chunk checksum doesn't match.")
+    except:
+        file_checksum = None
+        raise
     finally:
+        _file_checksum_states.set(write_to, fd, file_checksum)
         fcntl.lockf(fd, fcntl.LOCK_UN)
         os.close(fd)
 
-    if chunk_start != -1 and chunk_len == -1:
-        # final chunk, compute checksum of whole file
-        file_checksum = kobo.shortcuts.compute_file_checksums(write_to, ["sha256"])["sha256"]
-        if file_checksum != chunk_checksum:
-            raise ValueError("File checksum does not match.")
+    return chunk_len, checksum.hexdigest().lower()
 
-    return chunk
+
+def get_file_checksum(file_path):
+    """
+    Return sha256 checksum (lower case) of a file written by write_chunk().
+
+    The checksum is computed while writing the chunks.  The file is read
+    only if it has been modified by other means or its chunks have been
+    written by several processes.
+
+    @param file_path: path to the file
+    @type  file_path: str
+    @rtype: str
+    """
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        file_checksum = _file_checksum_states.pop(file_path, fd)
+    finally:
+        os.close(fd)
+    if file_checksum is not None:
+        return file_checksum
+    return kobo.shortcuts.compute_file_checksums(file_path, ["sha256"])["sha256"]
+
+
+class _FileChecksumStates(object):
+    """
+    Rolling sha256 state of files being uploaded, keyed by path.
+
+    A state is valid only if the file still has the inode, size and mtime
+    recorded after the last chunk has been written and its last
+    FILE_CHECKSUM_TAIL_SIZE bytes still have the same hash.  Anything else
+    (data written out of order, truncated or modified file) invalidates it
+    and the checksum is computed from the file again.
+
+    The sha256 state can't be serialized, it's kept in memory of the process
+    which wrote the chunks.  The checksum of the data written so far is also
+    stored in a file next to the uploaded file (see state_path()), so any
+    process can finish the upload without reading the file.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._states = {}  # {path: ([st_ino, st_size, st_mtime_ns, tail sha256], sha256)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def state_path(file_path):
+        """Return path to the file storing checksum state of file_path."""
+        head, tail = os.path.split(file_path)
+        return os.path.join(head, ".%s%s" % (tail, FILE_CHECKSUM_STATE_SUFFIX))
+
+    @staticmethod
+    def _key(fd, stat=None):
+        stat = stat or os.fstat(fd)
+        tail = os.pread(fd, FILE_CHECKSUM_TAIL_SIZE, max(0, stat.st_size - FILE_CHECKSUM_TAIL_SIZE))
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns, hashlib.sha256(tail).hexdigest()]
+
+    def _load(self, file_path):
+        try:
+            with open(self.state_path(file_path), "r") as f:
+                data = json.load(f)
+            return data["key"], data["sha256"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def _store(self, file_path, key, checksum):
+        with open(self.state_path(file_path), "w") as f:
+            json.dump({"key": key, "sha256": checksum}, f)
+
+    def _remove(self, file_path):
+        try:
+            os.unlink(self.state_path(file_path))
+        except OSError:
+            pass
+
+    def get(self, file_path, fd, stat, size):
+        """Return a copy of the state if it's valid for a file with given stat and size."""
+        with self._lock:
+            key, checksum = self._states.get(file_path, (None, None))
+        if checksum is None or stat.st_size != size or key != self._key(fd, stat):
+            return None
+        return checksum.copy()
+
+    def pop(self, file_path, fd):
+        """Remove the state and return the checksum (lower case) if it's valid for the file."""
+        with self._lock:
+            key, checksum = self._states.pop(file_path, (None, None))
+        if checksum is not None:
+            checksum = checksum.hexdigest().lower()
+        else:
+            # stored by another process
+            key, checksum = self._load(file_path)
+        self._remove(file_path)
+        if checksum is None or key != self._key(fd):
+            return None
+        return checksum
+
+    def set(self, file_path, fd, checksum):
+        """Store the state (remove it if checksum is None)."""
+        key = checksum is not None and self._key(fd) or None
+        with self._lock:
+            self._states.pop(file_path, None)
+            if checksum is not None:
+                self._states[file_path] = (key, checksum)
+                while len(self._states) > self.max_size:
+                    # drop the least recently written file
+                    del self._states[next(iter(self._states))]
+        if checksum is None:
+            # the file may be unchanged (e.g. final empty chunk) and the stored
+            # state still usable by pop()
+            stored_key = self._load(file_path)[0]
+            if stored_key is not None and stored_key != self._key(fd):
+                self._remove(file_path)
+            return
+        try:
+            self._store(file_path, key, checksum.hexdigest().lower())
+        except (IOError, OSError):
+            # the state in memory is still usable
+            self._remove(file_path)
+
+
+_file_checksum_states = _FileChecksumStates(FILE_CHECKSUM_STATES_MAX)
@@ -22,4 +22,5 @@ urlpatterns = [
     url(r"^info/channel/", include("kobo.hub.urls.channel")),
     url(r"^info/user/", include("kobo.hub.urls.user")),
     url(r"^info/worker/", include("kobo.hub.urls.worker")),
+    url(r"^upload/", include("kobo.django.upload.urls")),
 ]
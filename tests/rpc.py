@@ -67,6 +67,13 @@ class RpcServiceMock(object):
     def get_tasks_to_assign(self):
         return worker.get_tasks_to_assign(self._request, )
 
+    def wait_for_tasks(self, timeout, last_token=None):
+        return worker.wait_for_tasks(self._request, timeout, last_token)
+
+    def heartbeat(self, enabled, ready, task_id_list, finished_task_id_list, include_tasks=True):
+        return worker.heartbeat(self._request, enabled, ready, task_id_list, finished_task_id_list,
+                                include_tasks)
+
     def get_awaited_tasks(self, awaited_task_list):
         return worker.get_awaited_tasks(self._request, awaited_task_list)
 
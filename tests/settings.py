@@ -50,6 +50,7 @@ INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.sessions',
     'kobo.django',
+    'kobo.django.upload',
     'kobo.hub',
 )
 
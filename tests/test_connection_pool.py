@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import tempfile
+import threading
+import unittest
+
+import six.moves.xmlrpc_client as xmlrpclib
+from six.moves import BaseHTTPServer
+from six.moves.xmlrpc_server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from mock import Mock, patch
+
+from kobo.http import POSTTransport
+from kobo.xmlrpc import ConnectionPool, CookieTransport
+
+
+class _KeepAliveXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        SimpleXMLRPCRequestHandler.do_POST(self)
+        # close the connection without telling the client
+        self.close_connection = self.server.drop_connections
+
+    def log_message(self, *args):
+        pass
+
+
+class _UploadRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["content-length"]))
+        self.server.bodies.append(body)
+        self.send_response(200)
+        self.send_header("content-length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+        # close the connection without telling the client
+        self.close_connection = self.server.drop_connections
+
+    def log_message(self, *args):
+        pass
+
+
+class _ServerMixin(object):
+
+    def _start(self, server):
+        self.server = server
+        self.thread = threading.Thread(target=server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.addCleanup(self._stop)
+        return "127.0.0.1:%s" % server.server_address[1]
+
+    def _stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_acquire_creates_connection(self):
+        pool = ConnectionPool()
+        conn = Mock()
+        self.assertEqual(pool.acquire(("http", "host"), lambda: conn), (conn, False))
+        self.assertEqual(pool.stats(), {"created": 1, "reused": 0, "idle": 0})
+
+    def test_release_and_reuse(self):
+        pool = ConnectionPool()
+        conn = Mock()
+        pool.release(("http", "host"), conn)
+
+        self.assertEqual(pool.acquire(("http", "host"), Mock()), (conn, True))
+        self.assertEqual(pool.stats(), {"created": 0, "reused": 1, "idle": 0})
+
+    def test_connections_are_keyed_by_host(self):
+        pool = ConnectionPool()
+        pool.release(("http", "host"), Mock())
+
+        other, reused = pool.acquire(("https", "host"), Mock)
+        self.assertFalse(reused)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_release_closes_connection_if_server_closes_it(self):
+        pool = ConnectionPool()
+        conn = Mock()
+        pool.release(("http", "host"), conn, Mock(will_close=True))
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats()["idle"], 0)
+
+    def test_release_closes_connection_with_unread_response(self):
+        pool = ConnectionPool()
+        conn = Mock()
+        pool.release(("http", "host"), conn, Mock(will_close=False, isclosed=Mock(return_value=False)))
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats()["idle"], 0)
+
+    def test_max_size(self):
+        pool = ConnectionPool(max_size=2)
+        conns = [Mock() for _ in range(3)]
+        for conn in conns:
+            pool.release(("http", "host"), conn)
+
+        # the least recently used connection is closed
+        conns[0].close.assert_called_once_with()
+        self.assertEqual(pool.stats()["idle"], 2)
+
+    def test_max_size_zero_disables_pooling(self):
+        pool = ConnectionPool(max_size=0)
+        conn = Mock()
+        pool.release(("http", "host"), conn)
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats()["idle"], 0)
+
+    def test_evict_idle_connections(self):
+        pool = ConnectionPool(max_idle=10)
+        conn = Mock()
+        with patch("kobo.xmlrpc.time.time", return_value=100):
+            pool.release(("http", "host"), conn)
+        with patch("kobo.xmlrpc.time.time", return_value=111):
+            new_conn = Mock()
+            self.assertEqual(pool.acquire(("http", "host"), lambda: new_conn), (new_conn, False))
+
+        conn.close.assert_called_once_with()
+
+    def test_clear(self):
+        pool = ConnectionPool()
+        conn = Mock()
+        pool.release(("http", "host"), conn)
+        pool.clear()
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats()["idle"], 0)
+
+
+class TestCookieTransportKeepAlive(_ServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        server = SimpleXMLRPCServer(("127.0.0.1", 0), requestHandler=_KeepAliveXMLRPCRequestHandler, logRequests=False)
+        server.register_function(lambda x: x * 2, "double")
+        server.register_function(lambda: 1 // 0, "fail")
+        server.drop_connections = False
+        self.host = self._start(server)
+
+    def test_reuse_connection(self):
+        transport = CookieTransport()
+        proxy = xmlrpclib.ServerProxy("http://%s/" % self.host, transport=transport)
+
+        for i in range(5):
+            self.assertEqual(proxy.double(i), i * 2)
+
+        self.assertEqual(transport.connection_pool.stats(), {"created": 1, "reused": 4, "idle": 1})
+
+    def test_reuse_connection_after_fault(self):
+        transport = CookieTransport()
+        proxy = xmlrpclib.ServerProxy("http://%s/" % self.host, transport=transport)
+
+        self.assertRaises(xmlrpclib.Fault, proxy.fail)
+        self.assertEqual(proxy.double(1), 2)
+
+        self.assertEqual(transport.connection_pool.stats(), {"created": 1, "reused": 1, "idle": 1})
+
+    def test_reconnect_if_server_closed_connection(self):
+        transport = CookieTransport()
+        proxy = xmlrpclib.ServerProxy("http://%s/" % self.host, transport=transport)
+        self.server.drop_connections = True
+        self.assertEqual(proxy.double(1), 2)
+        self.assertEqual(proxy.double(2), 4)
+
+        self.assertEqual(transport.connection_pool.stats()["created"], 2)
+
+    def test_shared_pool(self):
+        pool = ConnectionPool()
+        proxy1 = xmlrpclib.ServerProxy("http://%s/" % self.host, transport=CookieTransport(connection_pool=pool))
+        proxy2 = xmlrpclib.ServerProxy("http://%s/" % self.host, transport=CookieTransport(connection_pool=pool))
+
+        self.assertEqual(proxy1.double(1), 2)
+        self.assertEqual(proxy2.double(2), 4)
+
+        self.assertEqual(pool.stats(), {"created": 1, "reused": 1, "idle": 1})
+
+
+class TestPOSTTransportKeepAlive(_ServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), _UploadRequestHandler)
+        server.bodies = []
+        server.drop_connections = False
+        self.host = self._start(server)
+
+        fd, self.file_name = tempfile.mkstemp()
+        os.write(fd, b"file content")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.file_name)
+
+    def _upload(self, pool):
+        host, port = self.host.split(":")
+        transport = POSTTransport(connection_pool=pool)
+        transport.add_variable("upload_id", "1")
+        transport.add_file("file", self.file_name)
+        return transport.send_to_host(host, "/upload/", int(port))
+
+    def test_send_without_pool(self):
+        self.assertEqual(self._upload(None), (200, b"OK"))
+        self.assertIn(b"file content", self.server.bodies[0])
+
+    def test_reuse_connection(self):
+        pool = ConnectionPool()
+        for _ in range(3):
+            self.assertEqual(self._upload(pool), (200, b"OK"))
+
+        self.assertEqual(len(self.server.bodies), 3)
+        self.assertEqual(pool.stats(), {"created": 1, "reused": 2, "idle": 1})
+
+    def test_shared_with_xmlrpc_transport(self):
+        pool = ConnectionPool()
+        self.assertEqual(self._upload(pool), (200, b"OK"))
+
+        transport = CookieTransport(connection_pool=pool)
+        transport.make_connection(self.host)
+        self.assertEqual(pool.stats(), {"created": 1, "reused": 1, "idle": 0})
+
+    def test_reconnect_if_server_closed_connection(self):
+        pool = ConnectionPool()
+        self.server.drop_connections = True
+        self.assertEqual(self._upload(pool), (200, b"OK"))
+        self.assertEqual(self._upload(pool), (200, b"OK"))
+
+        self.assertEqual(len(self.server.bodies), 2)
+        self.assertEqual(pool.stats()["created"], 2)
@@ -9,7 +9,7 @@ if 'setup' in dir(django):
     django.setup()
 
 from django.contrib.auth.models import User
-from mock import Mock, PropertyMock
+from mock import Mock, PropertyMock, patch
 
 from kobo.client.constants import TASK_STATES
 from kobo.hub.models import Arch, Channel, Task, Worker
@@ -303,3 +303,90 @@ class TestTaskSearchForm(django.test.TransactionTestCase):
         self.assertEqual(tasks[0].id, task3.id)
         self.assertEqual(tasks[1].id, task2.id)
         self.assertEqual(tasks[2].id, task1.id)
+
+    def _create_search_tasks(self):
+        t1 = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='BuildTask',
+            label='release 1.0 candidate',
+            state=TASK_STATES['CLOSED'],
+        )
+        t2 = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user2,
+            method='CheckTask',
+            label='nightly build',
+            state=TASK_STATES['FAILED'],
+        )
+        t3 = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user2,
+            method='DummyTask',
+            label='release 2.0',
+            state=TASK_STATES['OPEN'],
+        )
+        Task.objects.filter(id=t1.id).update(dt_created='2024-01-10 12:00:00', dt_finished='2024-01-11 08:00:00')
+        Task.objects.filter(id=t2.id).update(dt_created='2024-02-01 00:00:00')
+        Task.objects.filter(id=t3.id).update(dt_created='2024-03-01 10:00:00')
+        return t1, t2, t3
+
+    def _search(self, search):
+        form = TaskSearchForm({'search': search})
+        self.assertTrue(form.is_valid(), form.errors)
+        req = PropertyMock(spec=['user'], user=Mock(is_authenticated=Mock(return_value=False)))
+        return [task.id for task in form.get_query(req)]
+
+    def test_search_words(self):
+        t1, t2, t3 = self._create_search_tasks()
+
+        # any of method, label and owner, case-insensitive
+        self.assertEqual(self._search('build'), [t2.id, t1.id])
+        self.assertEqual(self._search('RELEASE'), [t3.id, t1.id])
+        self.assertEqual(self._search('another'), [t3.id, t2.id])
+        self.assertEqual(self._search('ta'), [t3.id, t2.id, t1.id])
+        # all words have to match
+        self.assertEqual(self._search('release dummy'), [t3.id])
+        self.assertEqual(self._search('"release 1.0"'), [t1.id])
+        # trigrams of the word in different places don't match
+        self.assertEqual(self._search('buildrelease'), [])
+
+    def test_search_common_words(self):
+        t1, t2, t3 = self._create_search_tasks()
+
+        # words contained in too many tasks are not looked up by tokens
+        with patch('kobo.hub.task_search.CANDIDATE_LIMIT', 1):
+            self.assertEqual(self._search('release'), [t3.id, t1.id])
+            self.assertEqual(self._search('build'), [t2.id, t1.id])
+            self.assertEqual(self._search('"release 1.0"'), [t1.id])
+
+    def test_search_typed_filters(self):
+        t1, t2, t3 = self._create_search_tasks()
+
+        self.assertEqual(self._search('method:CheckTask'), [t2.id])
+        self.assertEqual(self._search('owner:anothertestuser'), [t3.id, t2.id])
+        self.assertEqual(self._search('state:closed,failed'), [t2.id, t1.id])
+        self.assertEqual(self._search('owner:anothertestuser release'), [t3.id])
+        self.assertEqual(self._search('created:2024-01-10'), [t1.id])
+        self.assertEqual(self._search('created:2024-01-10..2024-02-01'), [t2.id, t1.id])
+        self.assertEqual(self._search('created:2024-02-01..'), [t3.id, t2.id])
+        self.assertEqual(self._search('created:..2024-01-31'), [t1.id])
+        self.assertEqual(self._search('finished:2024-01-11'), [t1.id])
+        # unknown filters are plain words
+        self.assertEqual(self._search('label:nightly'), [])
+
+    def test_search_invalid_filters(self):
+        for search in ('state:nonsense', 'created:yesterday', 'finished:2024-01-01..soon'):
+            form = TaskSearchForm({'search': search})
+            self.assertFalse(form.is_valid())
+            self.assertIn('search', form.errors)
+
+    def test_search_validation_runs_no_queries(self):
+        self._create_search_tasks()
+        form = TaskSearchForm({'search': 'release owner:testuser state:closed'})
+
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
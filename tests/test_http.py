@@ -6,6 +6,12 @@ import unittest
 
 import tempfile
 import os
+import socket
+import ssl
+import threading
+
+import mock
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
 from kobo.http import POSTTransport
 
@@ -34,3 +40,72 @@ class TestPOSTTransport(unittest.TestCase):
         self.assertRaises(OSError, self.postt.add_file, "file", tf1)
         self.assertEqual(self.postt.add_file("file", tf2), None)
         self.assertRaises(TypeError, self.postt.add_file, "file", tf3)
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.server.bodies.append(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPOSTTransportSend(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), _UploadHandler)
+        self.server.bodies = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        fd, self.file_name = tempfile.mkstemp()
+        self.addCleanup(os.unlink, self.file_name)
+        self.data = os.urandom(3 * 1024**2 + 123)
+        os.write(fd, self.data)
+        os.close(fd)
+
+    def _send(self, **kwargs):
+        postt = POSTTransport(**kwargs)
+        postt.SEND_BLOCK_SIZE = 1024**2
+        postt.add_variable("foo", "bar")
+        postt.add_file("file", self.file_name)
+        return postt.send_to_host("127.0.0.1", "/upload/", port=self.server.server_port)
+
+    def _assert_body(self, body):
+        self.assertIn(b'name="foo"\r\n\r\nbar\r\n', body)
+        header_end = body.index(b"\r\n\r\n", body.index(b'name="file"')) + 4
+        self.assertEqual(body[header_end:header_end + len(self.data)], self.data)
+        self.assertTrue(body.endswith(b"\r\n--%s--\r\n" % body[2:34]))
+
+    def test_send_zero_copy(self):
+        with mock.patch("socket.socket.sendfile", autospec=True, side_effect=socket.socket.sendfile) as sendfile:
+            self.assertEqual(self._send(), (200, b"OK"))
+        self.assertEqual(sendfile.call_count, 1)
+        self._assert_body(self.server.bodies[0])
+
+    def test_send_copy(self):
+        with mock.patch("socket.socket.sendfile") as sendfile:
+            self.assertEqual(self._send(zero_copy=False), (200, b"OK"))
+        self.assertFalse(sendfile.called)
+        self._assert_body(self.server.bodies[0])
+
+    def test_send_file_tls(self):
+        postt = POSTTransport()
+        postt.SEND_BLOCK_SIZE = 1024**2
+        sock = mock.Mock(spec=ssl.SSLSocket)
+        sent = []
+        sock.sendall.side_effect = lambda data: sent.append(bytes(data))
+
+        with open(self.file_name, "rb") as file_obj:
+            postt._send_file(mock.Mock(sock=sock), file_obj)
+
+        self.assertEqual(len(sent), 4)
+        self.assertEqual(b"".join(sent), self.data)
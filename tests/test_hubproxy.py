@@ -1,3 +1,5 @@
+import hashlib
+import io
 import socket
 import http.client as httplib
 import xmlrpc.client
@@ -340,3 +342,49 @@ def test_proxy_xmlrpc_fault(requests_session, capsys, exception_string, retried)
         captured = capsys.readouterr()
         assert captured.err.count(
             "XML-RPC connection to example.com failed") == 0
+
+
+def test_upload_task_log_put(requests_session):
+    """upload_task_log uses PUT requests if the hub supports them"""
+    conf = PyConfigParser()
+    conf.load_from_dict({"HUB_URL": 'https://example.com/hub'})
+    transport = FakeTransport()
+    proxy = HubProxy(conf, transport=transport)
+    proxy._hub_features = {"upload_task_log_url": "/task/%(task_id)s/log-upload/%(path)s"}
+
+    with mock.patch("kobo.http.send_pooled", return_value=(200, b"{}")) as send_pooled:
+        proxy.upload_task_log(io.BytesIO(b"log data"), 123, "logs/stdout.log", append=False)
+
+    assert send_pooled.call_count == 1
+    args = send_pooled.call_args[0]
+    assert args[1:4] == ("example.com", None, True)
+
+    request = mock.Mock()
+    args[4](request)
+    request.request.assert_called_once_with(
+        "PUT",
+        "/task/123/log-upload/logs/stdout.log?mode=644&offset=0",
+        b"log data",
+        {
+            "Content-Type": "application/octet-stream",
+            "X-Kobo-Checksum": hashlib.sha256(b"log data").hexdigest(),
+        },
+    )
+
+    # no XML-RPC upload
+    assert not [call for call in transport.fake_transport_calls if b"upload_task_log" in call[1]]
+
+
+def test_upload_task_log_put_fallback(requests_session):
+    """upload_task_log falls back to XML-RPC if PUT request fails"""
+    conf = PyConfigParser()
+    conf.load_from_dict({"HUB_URL": 'https://example.com/hub'})
+    transport = FakeTransport()
+    proxy = HubProxy(conf, transport=transport)
+    proxy._hub_features = {"upload_task_log_url": "/task/%(task_id)s/log-upload/%(path)s"}
+
+    with mock.patch("kobo.http.send_pooled", return_value=(403, b"Login required.")):
+        proxy.upload_task_log(io.BytesIO(b"log data"), 123, "stdout.log")
+
+    calls = [call for call in transport.fake_transport_calls if b"worker.upload_task_log" in call[1]]
+    assert len(calls) == 1
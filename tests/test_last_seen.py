@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime, timedelta
+
+import django
+
+from django.core.cache import cache
+from django.test import override_settings
+from mock import patch
+
+from kobo.hub import last_seen
+from kobo.hub.models import Worker
+
+from .utils import DjangoRunner
+
+runner = DjangoRunner()
+setup_module = runner.start
+teardown_module = runner.stop
+
+
+class TestLastSeen(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        cache.clear()
+        last_seen._written.clear()
+        self.worker = Worker.objects.create(worker_key='worker', name='last-seen-worker')
+        self.addCleanup(self._remove_state_file, self.worker)
+
+    def _remove_state_file(self, worker):
+        if os.path.exists(worker._state_path):
+            os.unlink(worker._state_path)
+
+    def test_update_coalesced(self):
+        with patch('kobo.hub.last_seen.open', create=True, side_effect=open) as mock_open:
+            self.assertTrue(last_seen.update_last_seen(self.worker))
+            for _ in range(10):
+                self.assertFalse(last_seen.update_last_seen(self.worker))
+
+        self.assertEqual(mock_open.call_count, 1)
+        self.assertTrue(os.path.exists(self.worker._state_path))
+
+    def test_update_coalesced_with_other_processes(self):
+        last_seen.update_last_seen(self.worker)
+        # another hub process has only the shared cache
+        last_seen._written.clear()
+
+        self.assertFalse(last_seen.update_last_seen(self.worker))
+
+    @override_settings(WORKER_LAST_SEEN_INTERVAL=0)
+    def test_update_interval(self):
+        self.assertTrue(last_seen.update_last_seen(self.worker))
+        self.assertTrue(last_seen.update_last_seen(self.worker))
+
+    def test_update_force(self):
+        self.assertTrue(last_seen.update_last_seen(self.worker))
+        self.assertTrue(last_seen.update_last_seen(self.worker, force=True))
+
+    def test_get_last_seen_batched(self):
+        other = Worker.objects.create(worker_key='other', name='last-seen-other')
+        self.addCleanup(self._remove_state_file, other)
+        unknown = Worker.objects.create(worker_key='unknown', name='last-seen-unknown')
+        last_seen.update_last_seen(self.worker)
+        last_seen.update_last_seen(other)
+
+        with patch('os.stat', side_effect=os.stat) as mock_stat:
+            result = last_seen.get_last_seen([self.worker, other, unknown])
+
+        # only the worker missing in the cache is looked up on disk
+        self.assertEqual(mock_stat.call_count, 1)
+        self.assertIsNone(result[unknown.id])
+        for worker in (self.worker, other):
+            self.assertTrue(abs(datetime.utcnow() - result[worker.id]) < timedelta(seconds=5))
+
+    def test_get_last_seen_from_state_file(self):
+        with open(self.worker._state_path, 'w'):
+            pass
+        os.utime(self.worker._state_path, (1625695768, 1625695768))
+
+        result = last_seen.get_last_seen([self.worker])
+
+        self.assertEqual(result[self.worker.id], datetime(2021, 7, 7, 22, 9, 28))
+
+    def test_get_last_seen_outdated_cache(self):
+        # another hub process with its own cache has written the state file
+        cache.set(last_seen._cache_key(self.worker), 1625695768)
+        with open(self.worker._state_path, 'w'):
+            pass
+        os.utime(self.worker._state_path, (1625695800, 1625695800))
+
+        result = last_seen.get_last_seen([self.worker])
+
+        self.assertEqual(result[self.worker.id], datetime(2021, 7, 7, 22, 10))
+
+    def test_get_last_seen_outdated_cache_without_state_file(self):
+        cache.set(last_seen._cache_key(self.worker), 1625695768)
+
+        result = last_seen.get_last_seen([self.worker])
+
+        self.assertEqual(result[self.worker.id], datetime(2021, 7, 7, 22, 9, 28))
+
+    def test_prefetch_last_seen(self):
+        last_seen.update_last_seen(self.worker)
+        workers = last_seen.prefetch_last_seen(Worker.objects.filter(id=self.worker.id))
+
+        with patch('kobo.hub.last_seen.get_last_seen') as mock_get:
+            self.assertIsNotNone(workers[0].last_seen)
+        mock_get.assert_not_called()
@@ -132,6 +132,23 @@ class TestLoggingThread(unittest.TestCase):
             b"Another post-outage log message..."
         )
 
+    def test_retry_delay_after_stop(self):
+        mock_hub = Mock()
+        mock_hub.upload_task_log.side_effect = [RuntimeError("Simulated error")] * 2 + [None]
+
+        thread = LoggingThread(mock_hub, 9999, retry_interval=0.2)
+        thread.daemon = True
+        # a previous upload succeeded, failures are retried
+        thread._send_time = time.time()
+        thread.start()
+
+        thread.write('This is a log message!')
+        start = time.time()
+        thread.stop()
+
+        self.assertEqual(mock_hub.upload_task_log.call_count, 3)
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
     def test_mixed_writes(self):
         uploaded = []
 
@@ -164,6 +181,73 @@ class TestLoggingThread(unittest.TestCase):
             b'Some \xe6\x96\x87!Some \xe2 wacky bytes!'
         )
 
+    def test_flush_lines(self):
+        uploaded = []
+        mock_hub = Mock()
+        mock_hub.upload_task_log.side_effect = lambda io, *args, **kwargs: uploaded.append(io.read())
+
+        thread = LoggingThread(mock_hub, 9999, flush_size=1024**2, flush_interval=60, flush_lines=3)
+        thread._send_time = time.time()
+        thread.daemon = True
+        thread.start()
+
+        thread.write('line 1\nline 2\n')
+        time.sleep(.1)
+        mock_hub.upload_task_log.assert_not_called()
+
+        thread.write('line 3\nline 4')
+        for _ in range(100):
+            if uploaded:
+                break
+            time.sleep(.01)
+        self.assertEqual(uploaded, [b'line 1\nline 2\nline 3\nline 4'])
+
+        thread.stop()
+        self.assertEqual(thread.stats()['uploads'], 1)
+
+    def test_coalesce_writes(self):
+        uploaded = []
+        mock_hub = Mock()
+        mock_hub.upload_task_log.side_effect = lambda io, *args, **kwargs: uploaded.append(io.read())
+
+        thread = LoggingThread(mock_hub, 9999, flush_size=1024**2, flush_interval=60)
+        thread._send_time = time.time()
+        thread.daemon = True
+        thread.start()
+
+        # many more writes than the old 256-entry queue could hold
+        for i in range(10000):
+            thread.write('%d\n' % i)
+        thread.stop()
+
+        self.assertEqual(uploaded, [b''.join(b'%d\n' % i for i in range(10000))])
+        stats = thread.stats()
+        self.assertEqual(stats['uploads'], 1)
+        self.assertEqual(stats['bytes_sent'], len(uploaded[0]))
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['backpressure_waits'], 0)
+
+    def test_backpressure(self):
+        uploaded = []
+        mock_hub = Mock()
+
+        def mock_upload(io, *args, **kwargs):
+            time.sleep(.05)
+            uploaded.append(io.read())
+
+        mock_hub.upload_task_log.side_effect = mock_upload
+
+        thread = LoggingThread(mock_hub, 9999, flush_size=10, max_pending=10)
+        thread.daemon = True
+        thread.start()
+
+        for i in range(10):
+            thread.write('%010d' % i)
+        thread.stop()
+
+        self.assertEqual(b''.join(uploaded), b''.join(b'%010d' % i for i in range(10)))
+        self.assertGreater(thread.stats()['backpressure_waits'], 0)
+
 
 class TestLoggingIO(unittest.TestCase):
 
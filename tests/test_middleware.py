@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import time
 import unittest
 
+import django
+
+from django.test import override_settings
 from mock import Mock, PropertyMock, patch
 
 from kobo.hub import middleware
+from kobo.hub.models import Arch, Channel, Worker
+
+from .utils import DjangoRunner
+
+runner = DjangoRunner()
+setup_module = runner.start
+teardown_module = runner.stop
 
 
 class DummyRequest(object):
@@ -19,6 +30,7 @@ class DummyWorker(object):
 
 class TestGetWorker(unittest.TestCase):
 
+    @override_settings(WORKER_CACHE_TTL=0)
     def test_get_worker(self):
         with patch('kobo.hub.middleware.Worker') as worker_mock:
             worker_mock.objects.get.return_value = DummyWorker()
@@ -38,6 +50,90 @@ class TestGetWorker(unittest.TestCase):
         self.assertIsNone(worker)
 
 
+class TestWorkerCache(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        middleware.worker_cache.clear()
+        self.addCleanup(middleware.worker_cache.clear)
+        self.arch = Arch.objects.create(name='testarch', pretty_name='testarch')
+        self.channel = Channel.objects.create(name='testchannel')
+        self.worker = Worker.objects.create(worker_key='worker', name='worker-host')
+        self.worker.arches.add(self.arch)
+        self.worker.channels.add(self.channel)
+        self.request = PropertyMock(user=PropertyMock(username='host/worker-host'))
+
+    def test_cached(self):
+        expected = Worker.objects.get(id=self.worker.id).export()
+        middleware.get_worker(self.request)
+
+        with self.assertNumQueries(0):
+            worker = middleware.get_worker(self.request)
+            data = worker.export()
+
+        self.assertEqual(worker.id, self.worker.id)
+        self.assertEqual(data, expected)
+
+    def test_copy_per_request(self):
+        worker1 = middleware.get_worker(self.request)
+        worker1.max_load = 100
+
+        worker2 = middleware.get_worker(self.request)
+        self.assertIsNot(worker1, worker2)
+        self.assertEqual(worker2.max_load, 1)
+
+    def test_copy_has_own_state(self):
+        worker1 = middleware.get_worker(self.request)
+        worker2 = middleware.get_worker(self.request)
+
+        self.assertIsNot(worker1._state, worker2._state)
+        self.assertFalse(worker1._state.adding)
+        self.assertEqual(worker1._state.db, 'default')
+
+    def test_refresh_state(self):
+        middleware.get_worker(self.request)
+        # changed by another hub process, the cache is not invalidated there
+        Worker.objects.filter(id=self.worker.id).update(max_tasks=5, min_priority=10, enabled=False)
+
+        worker = middleware.get_worker(self.request)
+        self.assertEqual((worker.max_tasks, worker.min_priority, worker.enabled), (0, 0, True))
+        worker.refresh_state()
+        self.assertEqual((worker.max_tasks, worker.min_priority, worker.enabled), (5, 10, False))
+
+    def test_expired(self):
+        middleware.get_worker(self.request)
+
+        with patch('kobo.hub.middleware.time.time', return_value=time.time() + 61):
+            with self.assertNumQueries(3):
+                middleware.get_worker(self.request)
+
+    def test_invalidate_on_save(self):
+        middleware.get_worker(self.request)
+        self.worker.max_load = 5
+        self.worker.save()
+
+        self.assertEqual(middleware.get_worker(self.request).max_load, 5)
+
+    def test_invalidate_on_m2m_change(self):
+        middleware.get_worker(self.request)
+        self.worker.arches.remove(self.arch)
+
+        self.assertEqual(middleware.get_worker(self.request).export()['arches'], [])
+
+    def test_invalidate_on_delete(self):
+        middleware.get_worker(self.request)
+        self.worker.delete()
+
+        self.assertIsNone(middleware.get_worker(self.request))
+
+    def test_unknown_worker_not_cached(self):
+        request = PropertyMock(user=PropertyMock(username='host/unknown'))
+        self.assertIsNone(middleware.get_worker(request))
+
+        Worker.objects.create(worker_key='unknown', name='unknown')
+        self.assertIsNotNone(middleware.get_worker(request))
+
+
 class TestLazyWorker(unittest.TestCase):
 
     def test_lazy_worker_set_cache_variable_if_not_set(self):
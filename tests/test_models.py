@@ -1,25 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import gzip
+import importlib
+import io
 import os
+import shutil
 import tempfile
+import threading
 
 import django
+import django.apps
 import pytest
 import six
 
 from datetime import datetime, timedelta
 from mock import patch, Mock, PropertyMock
+from six import StringIO
 
+from django.core.cache import cache
+from django.core.management import call_command
 from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import pre_save
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from kobo.client.constants import TASK_STATES
-from kobo.hub import models
+from kobo.hub import last_seen, models
 from kobo.hub.models import (
     Arch,
     Channel,
     Task,
+    TaskEvent,
+    TaskSearchToken,
     Worker,
     TaskLogs,
 )
@@ -83,6 +96,8 @@ class TestWorker(django.test.TransactionTestCase):
 
     def setUp(self):
         self._fixture_teardown()
+        cache.clear()
+        last_seen._written.clear()
         self._arch = Arch.objects.create(name='i386', pretty_name='32 bit')
         self._channel = Channel.objects.create(name='test')
         self._user = User.objects.create(username='testuser')
@@ -100,15 +115,16 @@ class TestWorker(django.test.TransactionTestCase):
         self.assertEqual(worker.current_load, 0)
         self.assertEqual(worker.ready, True)
 
-        Task.objects.create(
+        task = Task.objects.create(
             worker=worker,
             arch=self._arch,
             channel=self._channel,
             owner=self._user,
             method='DummyTask',
-            state=TASK_STATES['OPEN'],
+            state=TASK_STATES['ASSIGNED'],
             weight=100,
         )
+        task.open_task()
 
         worker.save()
         worker = Worker.objects.get(id=worker.id)
@@ -277,6 +293,103 @@ class TestWorker(django.test.TransactionTestCase):
         self.assertFalse(data['ready'])
         self.assertEqual(data['task_count'], 1)
 
+    def _create_task(self, worker, **kwargs):
+        kwargs.setdefault('state', TASK_STATES['ASSIGNED'])
+        return Task.objects.create(
+            worker=worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyTask',
+            **kwargs
+        )
+
+    def _counters(self, worker):
+        worker = Worker.objects.get(id=worker.id)
+        return worker.task_count, worker.current_load, worker.ready
+
+    def test_counters_follow_task_transitions(self):
+        worker = Worker.objects.create(worker_key='worker', name='Worker', max_load=10)
+        task1 = self._create_task(worker, weight=3)
+        task2 = self._create_task(worker, weight=4)
+        self.assertEqual(self._counters(worker), (0, 0, True))
+
+        task1.open_task()
+        task2.open_task()
+        self.assertEqual(self._counters(worker), (2, 7, True))
+
+        task1.set_weight(6)
+        self.assertEqual(self._counters(worker), (2, 10, False))
+
+        task1.wait()
+        self.assertEqual(self._counters(worker), (2, 4, True))
+
+        task2.close_task()
+        self.assertEqual(self._counters(worker), (1, 0, True))
+
+        # waiting tasks have no load, only the task count is released
+        task1.interrupt_task()
+        self.assertEqual(self._counters(worker), (0, 0, True))
+
+    def test_counters_not_changed_by_assigned_tasks(self):
+        worker = Worker.objects.create(worker_key='worker', name='Worker')
+        task = self._create_task(worker, state=TASK_STATES['FREE'])
+
+        task.assign_task(worker.id)
+        task.set_weight(5)
+        task.free_task()
+
+        self.assertEqual(self._counters(worker), (0, 0, True))
+
+    def test_save_keeps_counters(self):
+        worker = Worker.objects.create(worker_key='worker', name='Worker', max_load=10)
+        stale_worker = Worker.objects.get(id=worker.id)
+        self._create_task(worker, weight=3).open_task()
+
+        stale_worker.max_load = 2
+        stale_worker.save()
+
+        self.assertEqual(self._counters(worker), (1, 3, False))
+
+    def test_save_keeps_concurrent_counter_changes(self):
+        worker = Worker.objects.create(worker_key='worker', name='Worker', max_load=10)
+
+        def open_task(sender, instance, **kwargs):
+            # a task of the worker is opened by another request while saving
+            models._apply_worker_deltas({instance.id: (1, 3)})
+
+        pre_save.connect(open_task, sender=Worker)
+        self.addCleanup(pre_save.disconnect, open_task, sender=Worker)
+        worker.max_load = 2
+        worker.save()
+
+        self.assertEqual(self._counters(worker), (1, 3, False))
+        self.assertEqual((worker.task_count, worker.current_load, worker.ready), (1, 3, False))
+
+    def test_rebuild_counters(self):
+        worker1 = Worker.objects.create(worker_key='worker-1', name='Worker 1', max_load=10)
+        worker2 = Worker.objects.create(worker_key='worker-2', name='Worker 2', max_load=10)
+        self._create_task(worker1, state=TASK_STATES['OPEN'], weight=2)
+        self._create_task(worker1, state=TASK_STATES['OPEN'], weight=3, waiting=True)
+        self._create_task(worker1, state=TASK_STATES['ASSIGNED'], weight=5)
+        Worker.objects.filter(id=worker2.id).update(task_count=5, current_load=20, ready=False)
+
+        self.assertEqual(Worker.objects.rebuild_counters(), 2)
+
+        self.assertEqual(self._counters(worker1), (2, 2, True))
+        self.assertEqual(self._counters(worker2), (0, 0, True))
+        self.assertEqual(Worker.objects.rebuild_counters(), 0)
+
+    def test_rebuild_counters_command(self):
+        worker = Worker.objects.create(worker_key='worker', name='Worker')
+        self._create_task(worker, state=TASK_STATES['OPEN'], weight=2)
+
+        out = StringIO()
+        call_command('rebuild_worker_counters', stdout=out)
+
+        self.assertIn('Updated counters of 1 workers', out.getvalue())
+        self.assertEqual(self._counters(worker), (1, 2, False))
+
 
 class TestWorkerManager(django.test.TransactionTestCase):
 
@@ -297,17 +410,16 @@ class TestWorkerManager(django.test.TransactionTestCase):
     def test_ready(self):
         worker1 = Worker.objects.create(worker_key='worker-1', name='Worker 1', enabled=True)
 
-        Task.objects.create(
+        task = Task.objects.create(
             worker=worker1,
             arch=self._arch,
             channel=self._channel,
             owner=self._user,
             method='DummyTask',
-            state=TASK_STATES['OPEN'],
+            state=TASK_STATES['ASSIGNED'],
             weight=100
         )
-
-        worker1.save()
+        task.open_task()
 
         worker2 = Worker.objects.create(worker_key='worker-2', name='Worker 2', enabled=True)
 
@@ -572,6 +684,60 @@ class TestTaskLog(django.test.TransactionTestCase):
 
         self.assertEqual(s, content)
 
+    def test_get_chunk_block_compressed_file(self):
+        task_dir = tempfile.mkdtemp(prefix='kobo-test-')
+        self.addCleanup(shutil.rmtree, task_dir)
+        task = PropertyMock(
+            id=None,
+            task_dir=Mock(return_value=task_dir),
+            spec=['id', 'task_dir'],
+        )
+        content = b''.join(b'line %08d\n' % i for i in range(300000))
+
+        task_log = TaskLogs(task)
+        task_log['test.log'] = content
+        task_log.save()
+        task_log.gzip_logs()
+
+        self.assertEqual(sorted(os.listdir(task_dir)), ['test.log.gz', 'test.log.gz.idx'])
+        self.assertEqual(task_log.list, ['test.log'])
+        # still a regular gzip file
+        with gzip.open(os.path.join(task_dir, 'test.log.gz'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+        task_log = TaskLogs(task)
+        for offset in (0, 10, models.LOG_BUFFER_SIZE - 5, 2 * models.LOG_BUFFER_SIZE + 3, len(content) - 4):
+            self.assertEqual(task_log.get_chunk('test.log', offset, 20), content[offset:offset + 20])
+        self.assertEqual(task_log.get_chunk('test.log', len(content), 20), b'')
+
+        with patch.object(gzip.GzipFile, 'seek', autospec=True, side_effect=gzip.GzipFile.seek) as mock_seek:
+            task_log.get_chunk('test.log', len(content) - 20, 20)
+        # seeks within the last block only
+        mock_seek.assert_called_once()
+        self.assertLess(mock_seek.call_args[0][1], models.LOG_BUFFER_SIZE)
+
+    def test_convert_gzip_log(self):
+        task_dir = tempfile.mkdtemp(prefix='kobo-test-')
+        self.addCleanup(shutil.rmtree, task_dir)
+        content = b''.join(b'line %08d\n' % i for i in range(300000))
+        path = os.path.join(task_dir, 'test.log.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(content)
+
+        out = StringIO()
+        with override_settings(TASK_DIR=task_dir):
+            call_command('convert_task_logs', stdout=out)
+        self.assertIn('Converted 1 logs', out.getvalue())
+        self.assertFalse(models.convert_gzip_log(path))
+
+        self.assertEqual(sorted(os.listdir(task_dir)), ['test.log.gz', 'test.log.gz.idx'])
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        with models._open_gzip_log(path) as f:
+            self.assertIsInstance(f.raw, models._IndexedGzipReader)
+            f.seek(2 * models.LOG_BUFFER_SIZE + 3)
+            self.assertEqual(f.read(20), content[2 * models.LOG_BUFFER_SIZE + 3:][:20])
+
     def test_get_chunk_small_file(self):
         _, filepath = tempfile.mkstemp(prefix='kobo-test-', suffix='.log', text=True)
         filename = os.path.basename(filepath)
@@ -711,6 +877,56 @@ class TestTaskLog(django.test.TransactionTestCase):
         with self.assertRaises(Exception):
             task_log.tail('invalid.log', 1024, 1024)
 
+    def test_tail_reads_from_end(self):
+        content = b''.join(b'line %d %s\n' % (i, b'x' * (i % 300)) for i in range(20000))
+
+        class File(io.BytesIO):
+            def readline(self, *args):
+                raise AssertionError('the log should not be read line by line')
+
+        result = models._tail(File(content), 5000, 1000)
+
+        self.assertEqual(result, models._tail_lines(io.BytesIO(content), 5000, 1000))
+        self.assertTrue(result[0].startswith(b'line '))
+        self.assertEqual(result[1], len(content))
+
+    def test_tail_long_lines(self):
+        content = b'a' * 100 + b'\n' + b'b' * 2500 + b'\n' + b'c' * 10
+
+        for max_size in (0, 5, 11, 500, 1500, 2600, 5000):
+            result, offset = models._tail(io.BytesIO(content), max_size, 1000)
+            self.assertEqual(offset, len(content))
+            self.assertLessEqual(len(result), max_size)
+            self.assertTrue(content.endswith(result))
+
+        # the long line is skipped when the next line is near
+        self.assertEqual(models._tail(io.BytesIO(content), 11, 1000), (b'c' * 10, len(content)))
+        self.assertEqual(models._tail(io.BytesIO(content), 5000, 1000), (content, len(content)))
+
+    def test_tail_block_compressed_file(self):
+        task_dir = tempfile.mkdtemp(prefix='kobo-test-')
+        self.addCleanup(shutil.rmtree, task_dir)
+        task = PropertyMock(
+            id=None,
+            task_dir=Mock(return_value=task_dir),
+            spec=['id', 'task_dir'],
+        )
+        content = b''.join(b'line %08d\n' % i for i in range(300000))
+
+        task_log = TaskLogs(task)
+        task_log['test.log'] = content
+        task_log.save()
+        task_log.gzip_logs()
+
+        task_log = TaskLogs(task)
+        with patch.object(gzip.GzipFile, 'seek', autospec=True, side_effect=gzip.GzipFile.seek) as mock_seek:
+            result = task_log.tail('test.log', 1024, 100)
+
+        # seeks within the last block only
+        mock_seek.assert_called_once()
+        self.assertLess(mock_seek.call_args[0][1], models.LOG_BUFFER_SIZE)
+        self.assertEqual(result, models._tail_lines(io.BytesIO(content), 1024, 100))
+
     def test_list_walks_task_dir(self):
         task = PropertyMock(
             id=100,
@@ -757,18 +973,19 @@ class TestTaskLog(django.test.TransactionTestCase):
 
         task_log = TaskLogs(task)
 
-        with tempfile.NamedTemporaryFile(suffix='.log', dir=tempfile.tempdir, delete=True) as tf:
-            filename = os.path.basename(tf.name)
-            task_log[filename] = 'This is a log message.'
+        with tempfile.NamedTemporaryFile(suffix='.log', dir=tempfile.tempdir, delete=False) as tf:
+            path = tf.name
+        for i in (path + '.gz', path + '.gz.idx'):
+            self.addCleanup(lambda i=i: os.path.exists(i) and os.unlink(i))
+        task_log[os.path.basename(path)] = b'This is a log message.'
+        task_log.save()
 
-            with patch('kobo.hub.models.run') as mock_run:
-                task_log.gzip_logs()
+        task_log.gzip_logs()
 
-                mock_run.assert_called_once_with(
-                    'gzip %s' % os.path.join(tempfile.tempdir, filename),
-                    can_fail=True,
-                    stdout=False
-                )
+        self.assertFalse(os.path.exists(path))
+        with gzip.open(path + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), b'This is a log message.')
+        self.assertEqual([i for i in os.listdir(tempfile.tempdir) if i.endswith('.gz.tmp')], [])
 
     def test_gzip_logs_gzips_only_log(self):
         task = PropertyMock(
@@ -783,9 +1000,40 @@ class TestTaskLog(django.test.TransactionTestCase):
             filename = os.path.basename(tf.name)
             task_log[filename] = 'This is a log message.'
 
-            with patch('kobo.hub.models.run') as mock_run:
+            task_log.gzip_logs()
+
+            self.assertTrue(os.path.exists(tf.name))
+            self.assertFalse(os.path.exists(tf.name + '.gz'))
+
+    def test_gzip_logs_skips_changed_log(self):
+        task = PropertyMock(
+            id=None,
+            task_dir=Mock(return_value=tempfile.tempdir),
+            spec=['id', 'task_dir'],
+        )
+
+        task_log = TaskLogs(task)
+
+        with tempfile.NamedTemporaryFile(suffix='.log', dir=tempfile.tempdir, delete=True) as tf:
+            task_log[os.path.basename(tf.name)] = b'This is a log message.'
+            task_log.save()
+
+            write_gzip_blocks = models._write_gzip_blocks
+
+            def write(*args):
+                result = write_gzip_blocks(*args)
+                # appended by a late upload
+                tf.seek(0, os.SEEK_END)
+                tf.write(b'Another message.')
+                tf.flush()
+                return result
+
+            with patch('kobo.hub.models._write_gzip_blocks', side_effect=write):
                 task_log.gzip_logs()
-                mock_run.assert_not_called()
+
+            self.assertTrue(os.path.exists(tf.name))
+            self.assertFalse(os.path.exists(tf.name + '.gz'))
+            self.assertEqual([i for i in os.listdir(tempfile.tempdir) if i.endswith('.gz.tmp')], [])
 
     def test_save(self):
         task = PropertyMock(
@@ -1003,6 +1251,70 @@ class TestTask(django.test.TransactionTestCase):
         self.assertEqual(data['state'], t.state)
         self.assertEqual(data['subtask_id_list'], [])
 
+    def _create_export_tasks(self, count):
+        parent = Task.objects.create(
+            worker=self._worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyTask',
+            state=TASK_STATES['OPEN'],
+        )
+        for _ in range(count):
+            task = Task.objects.create(
+                worker=self._worker,
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                method='DummyTask',
+                state=TASK_STATES['FREE'],
+                parent=parent,
+                resubmitted_by=self._user,
+                resubmitted_from=parent,
+            )
+            Task.objects.create(
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                method='DummyTask',
+                parent=task,
+            )
+
+    def test_export_tasks(self):
+        self._worker.arches.add(self._arch)
+        self._worker.channels.add(self._channel)
+        self._create_export_tasks(2)
+
+        for flat in (True, False):
+            expected = [task.export(flat=flat) for task in Task.objects.all()]
+            self.assertEqual(models.export_tasks(Task.objects.all(), flat=flat), expected)
+
+    def test_export_tasks_fields(self):
+        self._create_export_tasks(1)
+        fields = ['id', 'parent', 'resubmitted_by', 'dt_created', 'is_finished']
+
+        expected = [dict((key, task.export()[key]) for key in fields) for task in Task.objects.all()]
+
+        self.assertEqual(models.export_tasks(Task.objects.all(), fields=fields), expected)
+
+    def test_export_tasks_num_queries(self):
+        self._worker.arches.add(self._arch)
+        self._worker.channels.add(self._channel)
+        self._create_export_tasks(1)
+
+        queries = {}
+        for flat in (True, False):
+            with CaptureQueriesContext(connection) as ctx:
+                models.export_tasks(Task.objects.all(), flat=flat)
+            queries[flat] = len(ctx.captured_queries)
+
+        # number of queries doesn't depend on number of tasks
+        self._create_export_tasks(10)
+        self.assertEqual(queries[True], 1)
+        for flat in (True, False):
+            with self.assertNumQueries(queries[flat]):
+                self.assertEqual(len(models.export_tasks(Task.objects.all(), flat=flat)), 24)
+
     def test_subtasks(self):
         t_parent = Task.objects.create(
             worker=self._worker,
@@ -1220,6 +1532,71 @@ class TestTask(django.test.TransactionTestCase):
         task = Task.objects.get(id=task.id)
         self.assertEqual(task.state, TASK_STATES['CLOSED'])
 
+    def test_close_task_gzips_logs_later(self):
+        task = Task.objects.create(
+            worker=self._worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyTask',
+            state=TASK_STATES['OPEN'],
+        )
+        release = threading.Event()
+        gzipped = []
+
+        def gzip_logs(logs):
+            release.wait(10)
+            gzipped.append(logs.task.id)
+
+        with patch.object(models.TaskLogs, 'gzip_logs', autospec=True, side_effect=gzip_logs):
+            # returns while the logs are still being compressed
+            task.close_task()
+            self.assertEqual(gzipped, [])
+            release.set()
+            models.log_compressor.join()
+
+        self.assertEqual(gzipped, [task.id])
+
+    def test_recount_subtasks_migration(self):
+        migration = importlib.import_module('kobo.hub.migrations.0007_recount_subtasks')
+        parent = Task.objects.create(arch=self._arch, channel=self._channel, owner=self._user, method='DummyTask')
+        other = Task.objects.create(arch=self._arch, channel=self._channel, owner=self._user, method='DummyTask')
+        for _ in range(3):
+            Task.objects.create(arch=self._arch, channel=self._channel, owner=self._user, method='DummyTask', parent=parent)
+        Task.objects.filter(id=parent.id).update(subtask_count=5)
+        Task.objects.filter(id=other.id).update(subtask_count=2)
+
+        with patch.object(migration, 'BATCH_SIZE', 1):
+            migration.recount_subtasks(django.apps.apps, None)
+
+        self.assertEqual(Task.objects.get(id=parent.id).subtask_count, 3)
+        self.assertEqual(Task.objects.get(id=other.id).subtask_count, 0)
+        self.assertEqual(Task.objects.filter(parent=parent, subtask_count=0).count(), 3)
+
+    def test_compress_task_logs_command(self):
+        task_dir = tempfile.mkdtemp(prefix='kobo-test-')
+        self.addCleanup(shutil.rmtree, task_dir)
+        tasks = [
+            Task.objects.create(arch=self._arch, channel=self._channel, owner=self._user, method='DummyTask', state=state)
+            for state in (TASK_STATES['CLOSED'], TASK_STATES['FAILED'], TASK_STATES['OPEN'])
+        ]
+
+        out = StringIO()
+        with override_settings(TASK_DIR=task_dir):
+            for task in tasks:
+                task.logs['stdout.log'] = b'This is a log message.'
+                task.logs.save()
+            call_command('compress_task_logs', stdout=out)
+            paths = [os.path.join(task.task_dir(), 'stdout.log') for task in tasks]
+
+        self.assertIn('Compressed 2 logs', out.getvalue())
+        for path in paths[:2]:
+            self.assertFalse(os.path.exists(path))
+            with gzip.open(path + '.gz', 'rb') as f:
+                self.assertEqual(f.read(), b'This is a log message.')
+        # logs of running tasks are still being written
+        self.assertTrue(os.path.exists(paths[2]))
+
     def test_close_task_with_invalid_initial_state(self):
         task = Task.objects.create(
             worker=self._worker,
@@ -1369,6 +1746,163 @@ class TestTask(django.test.TransactionTestCase):
         self.assertEqual(child1.state, TASK_STATES['CANCELED'])
         self.assertEqual(child2.state, TASK_STATES['CANCELED'])
 
+    def _create_tree(self, parent, depth, width, state=TASK_STATES['OPEN']):
+        """Create a task tree under parent, return all created tasks."""
+        created = []
+        for _ in range(width):
+            task = Task.objects.create(
+                worker=self._worker,
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                state=state,
+                parent=parent,
+            )
+            created.append(task)
+            if depth > 1:
+                created.extend(self._create_tree(task, depth - 1, width, state))
+        return created
+
+    def _create_root(self, state=TASK_STATES['OPEN']):
+        return Task.objects.create(
+            worker=self._worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=state,
+        )
+
+    def test_cancel_task_tree(self):
+        root = self._create_root()
+        tree = self._create_tree(root, depth=3, width=2)
+        closed = tree[0]
+        Task.objects.filter(id=closed.id).update(state=TASK_STATES['CLOSED'])
+
+        root.cancel_task(self._user)
+
+        states = dict(Task.objects.values_list('id', 'state'))
+        self.assertEqual(states.pop(closed.id), TASK_STATES['CLOSED'])
+        self.assertEqual(set(states.values()), set([TASK_STATES['CANCELED']]))
+        self.assertEqual(Task.objects.exclude(id=closed.id).filter(canceled_by=self._user).count(), len(tree))
+        self.assertEqual(Task.objects.filter(dt_finished__isnull=True).count(), 1)
+
+    def test_cancel_task_tree_checks_owner(self):
+        user = User.objects.create(username='owner')
+        root = Task.objects.create(arch=self._arch, channel=self._channel, owner=user, state=TASK_STATES['FREE'])
+        child = Task.objects.create(arch=self._arch, channel=self._channel, owner=self._user, state=TASK_STATES['FREE'], parent=root)
+
+        with self.assertRaises(Exception):
+            root.cancel_task(user)
+
+        self.assertEqual(Task.objects.get(id=root.id).state, TASK_STATES['FREE'])
+        self.assertEqual(Task.objects.get(id=child.id).state, TASK_STATES['FREE'])
+
+    def test_interrupt_task_tree_skips_ineligible(self):
+        root = self._create_root()
+        opened = self._create_tree(root, depth=2, width=2)
+        free = self._create_tree(opened[0], depth=1, width=1, state=TASK_STATES['FREE'])
+
+        root.interrupt_task()
+
+        self.assertEqual(Task.objects.get(id=free[0].id).state, TASK_STATES['FREE'])
+        self.assertEqual(Task.objects.filter(state=TASK_STATES['INTERRUPTED']).count(), len(opened) + 1)
+
+    def test_timeout_task_tree_updates_worker_counters(self):
+        self._worker.max_load = 10
+        self._worker.save()
+        root = self._create_root(state=TASK_STATES['ASSIGNED'])
+        root.open_task()
+        for task in self._create_tree(root, depth=2, width=2, state=TASK_STATES['ASSIGNED']):
+            task.open_task()
+        self.assertEqual(Worker.objects.get(id=self._worker.id).task_count, 7)
+
+        root.timeout_task()
+
+        worker = Worker.objects.get(id=self._worker.id)
+        self.assertEqual((worker.task_count, worker.current_load, worker.ready), (0, 0, True))
+        self.assertEqual(Task.objects.filter(state=TASK_STATES['TIMEOUT']).count(), 7)
+
+    def test_cancel_task_tree_query_count(self):
+        root = self._create_root()
+        self._create_tree(root, depth=2, width=3)
+        with CaptureQueriesContext(connection) as small:
+            root.cancel_task(self._user)
+
+        root = self._create_root()
+        self._create_tree(root, depth=3, width=5)
+        with CaptureQueriesContext(connection) as big:
+            root.cancel_task(self._user)
+
+        self.assertEqual(len(small.captured_queries), len(big.captured_queries))
+
+    def test_cancel_task_tree_gzips_logs_later(self):
+        root = self._create_root()
+        tree = self._create_tree(root, depth=2, width=2)
+        gzipped = []
+
+        with patch.object(models.TaskLogs, 'gzip_logs', autospec=True, side_effect=lambda logs: gzipped.append(logs.task.id)):
+            root.cancel_task(self._user)
+            models.log_compressor.join()
+
+        self.assertEqual(sorted(gzipped), sorted([root.id] + [i.id for i in tree]))
+
+    def _subtask_count(self, task):
+        return Task.objects.get(id=task.id).subtask_count
+
+    def test_subtask_count(self):
+        root = self._create_root()
+        child1, grandchild, _, child2, _, _ = self._create_tree(root, depth=2, width=2)
+
+        self.assertEqual(self._subtask_count(root), 2)
+        self.assertEqual(self._subtask_count(child1), 2)
+        self.assertEqual(self._subtask_count(grandchild), 0)
+
+        grandchild.parent = child2
+        grandchild.save()
+        self.assertEqual(self._subtask_count(child1), 1)
+        self.assertEqual(self._subtask_count(child2), 3)
+
+        grandchild = Task.objects.get(id=grandchild.id)
+        grandchild.parent = root
+        grandchild.save()
+        self.assertEqual(self._subtask_count(child2), 2)
+        self.assertEqual(self._subtask_count(root), 3)
+
+        child2.delete()
+        self.assertEqual(self._subtask_count(root), 2)
+
+    def test_subtask_count_deferred_parent(self):
+        root = self._create_root()
+        child1, grandchild, _, child2, _, _ = self._create_tree(root, depth=2, width=2)
+
+        # loading tasks without their parent doesn't query it
+        with self.assertNumQueries(1):
+            tasks = list(Task.objects.only('id', 'state'))
+        self.assertEqual(len(tasks), 7)
+
+        grandchild = Task.objects.only('id').get(id=grandchild.id)
+        grandchild.parent = child2
+        grandchild.save()
+        self.assertEqual(self._subtask_count(child1), 1)
+        self.assertEqual(self._subtask_count(child2), 3)
+
+        Task.objects.only('id').get(id=grandchild.id).delete()
+        self.assertEqual(self._subtask_count(child2), 2)
+
+    def test_save_does_not_touch_parent(self):
+        root = self._create_root()
+        child = self._create_tree(root, depth=1, width=1)[0]
+        child = Task.objects.get(id=child.id)
+        child.label = 'changed'
+
+        with CaptureQueriesContext(connection) as ctx:
+            child.save()
+
+        updates = [i['sql'] for i in ctx.captured_queries if i['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('WHERE "hub_task"."id" = %s' % child.id, updates[0])
+        self.assertFalse([i for i in ctx.captured_queries if 'COUNT' in i['sql']])
+
     def test_resubmit_task(self):
         task = Task.objects.create(
             worker=self._worker,
@@ -1655,3 +2189,156 @@ class TestTask(django.test.TransactionTestCase):
             task.delete()
 
             shutil_mock.rmtree.assert_called_once_with(task_dir)
+
+
+class TestTaskSearchToken(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        self._arch = Arch.objects.create(name='noarch', pretty_name='noarch')
+        self._channel = Channel.objects.create(name='default')
+        self._user = User.objects.create(username='testuser', is_superuser=True)
+
+    def _tokens(self, task_id):
+        return set(TaskSearchToken.objects.filter(task=task_id).values_list('token', flat=True))
+
+    def test_search_tokens(self):
+        self.assertEqual(models.search_tokens('AbcD', None, 'xy', 'xyz'), set(['abc', 'bcd', 'xyz']))
+
+    def test_tokens_maintained(self):
+        task_id = Task.create_task(self._user.username, 'Label', 'Method')
+        self.assertEqual(self._tokens(task_id), models.search_tokens('Label', 'Method'))
+
+        # unchanged tokens are not rewritten
+        task = Task.objects.get(id=task_id)
+        with CaptureQueriesContext(connection) as ctx:
+            task.save()
+        self.assertFalse([i for i in ctx.captured_queries if 'hub_tasksearchtoken' in i['sql']])
+
+        task.label = 'other'
+        task.save()
+        self.assertEqual(self._tokens(task_id), models.search_tokens('other', 'Method'))
+
+        task = Task.objects.only('id', 'label').get(id=task_id)
+        task.label = 'new label'
+        task.save()
+        self.assertEqual(self._tokens(task_id), models.search_tokens('new label', 'Method'))
+
+        Task.objects.get(id=task_id).delete()
+        self.assertEqual(TaskSearchToken.objects.count(), 0)
+
+    def test_not_maintained_on_postgresql(self):
+        with patch.object(models.TaskSearchTokenManager, 'enabled', return_value=False):
+            Task.create_task(self._user.username, 'Label', 'Method')
+        self.assertEqual(TaskSearchToken.objects.count(), 0)
+
+    def test_rebuild_command(self):
+        task_ids = [Task.create_task(self._user.username, 'label %s' % i, 'method') for i in range(3)]
+        Task.objects.filter(id=task_ids[0]).update(label='changed')
+        TaskSearchToken.objects.filter(task=task_ids[1]).delete()
+
+        out = StringIO()
+        call_command('rebuild_task_search_index', batch_size=2, stdout=out)
+
+        self.assertIn('Indexed 3 tasks', out.getvalue())
+        self.assertEqual(self._tokens(task_ids[0]), models.search_tokens('changed', 'method'))
+        self.assertEqual(self._tokens(task_ids[1]), models.search_tokens('label 1', 'method'))
+
+
+class TestTaskEvent(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        self._arch = Arch.objects.create(name='noarch', pretty_name='noarch')
+        self._channel = Channel.objects.create(name='default')
+        self._user = User.objects.create(username='testuser', is_superuser=True)
+        self._worker = Worker.objects.create(worker_key='worker', name='Worker')
+
+    def _events(self):
+        return list(TaskEvent.objects.values_list('task_id', 'old_state', 'state', 'worker_id', 'waiting'))
+
+    def test_state_transitions(self):
+        task_id = Task.create_task(self._user.username, 'label', 'method')
+        task = Task.objects.get(id=task_id)
+        task.assign_task(self._worker.id)
+        task.open_task(self._worker.id)
+        task.wait()
+        task.close_task()
+
+        self.assertEqual(self._events(), [
+            (task_id, None, TASK_STATES['FREE'], None, False),
+            (task_id, TASK_STATES['FREE'], TASK_STATES['ASSIGNED'], self._worker.id, False),
+            (task_id, TASK_STATES['ASSIGNED'], TASK_STATES['OPEN'], self._worker.id, False),
+            (task_id, TASK_STATES['OPEN'], TASK_STATES['OPEN'], self._worker.id, True),
+            (task_id, TASK_STATES['OPEN'], TASK_STATES['CLOSED'], self._worker.id, False),
+        ])
+        seqs = list(TaskEvent.objects.values_list('id', flat=True))
+        self.assertEqual(seqs, sorted(seqs))
+
+    def test_cancel_task_tree(self):
+        root_id = Task.create_task(self._user.username, 'root', 'method')
+        child_ids = [Task.create_task(self._user.username, 'child', 'method', parent_id=root_id) for _ in range(3)]
+        TaskEvent.objects.all().delete()
+
+        Task.objects.get(id=root_id).cancel_task()
+
+        self.assertEqual(sorted(self._events()), sorted(
+            [(i, TASK_STATES['FREE'], TASK_STATES['CANCELED'], None, False) for i in [root_id] + child_ids]
+        ))
+
+    def test_failed_transition_records_nothing(self):
+        task_id = Task.create_task(self._user.username, 'label', 'method')
+        task = Task.objects.get(id=task_id)
+
+        with self.assertRaises(Exception):
+            task.close_task()
+
+        self.assertEqual(TaskEvent.objects.count(), 1)
+
+    def test_after(self):
+        task_ids = [Task.create_task(self._user.username, 'label', 'method') for _ in range(5)]
+        seqs = list(TaskEvent.objects.values_list('id', flat=True))
+
+        events = TaskEvent.objects.after(seqs[1], limit=2)
+
+        self.assertEqual([i.task_id for i in events], task_ids[2:4])
+
+    def test_after_stops_at_recent_gap(self):
+        for _ in range(5):
+            Task.create_task(self._user.username, 'label', 'method')
+        seqs = list(TaskEvent.objects.values_list('id', flat=True))
+        # event of a transaction which hasn't committed yet
+        TaskEvent.objects.filter(id=seqs[2]).delete()
+
+        self.assertEqual([i.id for i in TaskEvent.objects.after(seqs[0], gap_timeout=60)], seqs[1:2])
+        self.assertEqual([i.id for i in TaskEvent.objects.after(seqs[1], gap_timeout=60)], [])
+        self.assertEqual([i.id for i in TaskEvent.objects.after(seqs[1])], seqs[3:])
+
+        # the event has been rolled back
+        TaskEvent.objects.filter(id=seqs[3]).update(dt_created=datetime.now() - timedelta(seconds=61))
+        self.assertEqual([i.id for i in TaskEvent.objects.after(seqs[1], gap_timeout=60)], seqs[3:])
+
+    def test_gaps(self):
+        for _ in range(6):
+            Task.create_task(self._user.username, 'label', 'method')
+        seqs = list(TaskEvent.objects.values_list('id', flat=True))
+        TaskEvent.objects.filter(id__in=[seqs[1], seqs[3], seqs[4]]).delete()
+
+        events = TaskEvent.objects.after(seqs[0], until=seqs[5])
+
+        self.assertEqual([i.id for i in events], [seqs[2], seqs[5]])
+        self.assertEqual(TaskEvent.objects.gaps(seqs[0], events), [(seqs[1], seqs[1]), (seqs[3], seqs[4])])
+        self.assertEqual(TaskEvent.objects.gaps(0, events), [(seqs[3], seqs[4])])
+
+    def test_trim_task_events(self):
+        for _ in range(5):
+            Task.create_task(self._user.username, 'label', 'method')
+        old = list(TaskEvent.objects.values_list('id', flat=True))[:3]
+        TaskEvent.objects.filter(id__in=old).update(dt_created=datetime.now() - timedelta(days=40))
+
+        out = StringIO()
+        call_command('trim_task_events', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Deleted 3 task events', out.getvalue())
+        self.assertEqual(TaskEvent.objects.filter(id__in=old).count(), 0)
+        self.assertEqual(TaskEvent.objects.count(), 2)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import django
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from mock import Mock, PropertyMock
+from six import StringIO
+
+import kobo.hub.last_seen
+from kobo.client.constants import TASK_STATES
+from kobo.hub.models import Arch, Channel, Task, TaskEvent, Worker
+from kobo.hub.scheduler import free_stale_tasks, schedule_tasks
+from kobo.hub.xmlrpc import worker
+
+from .utils import DjangoRunner
+
+runner = DjangoRunner()
+setup_module = runner.start
+teardown_module = runner.stop
+
+
+class TestScheduleTasks(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        super(TestScheduleTasks, self).setUp()
+
+        self._user = User.objects.create(username='testuser')
+        self._arch = Arch.objects.create(name='testarch')
+        self._channel = Channel.objects.create(name='testchannel')
+
+    def _create_worker(self, name, max_load=1, **kwargs):
+        w = Worker.objects.create(worker_key=name, name=name, max_load=max_load, **kwargs)
+        w.arches.add(self._arch)
+        w.channels.add(self._channel)
+        kobo.hub.last_seen.update_last_seen(w, force=True)
+        return w
+
+    def _create_task(self, **kwargs):
+        kwargs.setdefault('arch', self._arch)
+        kwargs.setdefault('channel', self._channel)
+        kwargs.setdefault('state', TASK_STATES['FREE'])
+        return Task.objects.create(owner=self._user, **kwargs)
+
+    def _assign_task(self, worker, **kwargs):
+        # as a worker or the scheduler takes a FREE task
+        task = self._create_task(**kwargs)
+        task.assign_task(worker.id)
+        return task
+
+    def test_assign_up_to_max_load(self):
+        w = self._create_worker('worker', max_load=2)
+        for _ in range(5):
+            self._create_task()
+
+        result = schedule_tasks()
+
+        self.assertEqual(result['assigned'], 2)
+        self.assertEqual(result['conflicts'], 0)
+        self.assertEqual(Task.objects.filter(state=TASK_STATES['ASSIGNED'], worker=w).count(), 2)
+        self.assertEqual(Task.objects.free().count(), 3)
+        self.assertEqual(
+            list(TaskEvent.objects.values_list('old_state', 'state', 'worker')),
+            [(TASK_STATES['FREE'], TASK_STATES['ASSIGNED'], w.id)] * 2,
+        )
+
+    def test_running_tasks_count_to_load(self):
+        w = self._create_worker('worker', max_load=2)
+        self._create_task(state=TASK_STATES['OPEN'], worker=w)
+        self._create_task(state=TASK_STATES['ASSIGNED'], worker=w)
+        self._create_task()
+
+        self.assertEqual(schedule_tasks()['assigned'], 0)
+
+    def test_highest_priority_first(self):
+        w = self._create_worker('worker')
+        self._create_task(priority=10)
+        task = self._create_task(priority=20)
+
+        schedule_tasks()
+
+        self.assertEqual(list(w.assigned_tasks().values_list('id', flat=True)), [task.id])
+
+    def test_spread_tasks_among_workers(self):
+        w1 = self._create_worker('worker1', max_load=2)
+        w2 = self._create_worker('worker2', max_load=2)
+        for _ in range(2):
+            self._create_task()
+
+        schedule_tasks()
+
+        self.assertEqual(w1.assigned_tasks().count(), 1)
+        self.assertEqual(w2.assigned_tasks().count(), 1)
+
+    def test_skip_unsupported_tasks(self):
+        w = self._create_worker('worker', max_load=5, min_priority=10)
+        other_arch = Arch.objects.create(name='otherarch', pretty_name='otherarch')
+        other_channel = Channel.objects.create(name='otherchannel')
+        self._create_task(arch=other_arch)
+        self._create_task(channel=other_channel)
+        self._create_task(priority=5)
+        # awaited tasks ignore channel and priority
+        awaited = self._create_task(channel=other_channel, priority=5, awaited=True)
+
+        self.assertEqual(schedule_tasks()['assigned'], 1)
+        self.assertEqual(list(w.assigned_tasks().values_list('id', flat=True)), [awaited.id])
+
+    def test_skip_disabled_workers(self):
+        self._create_worker('worker', enabled=False)
+        self._create_task()
+
+        self.assertEqual(schedule_tasks()['assigned'], 0)
+
+    def test_skip_busy_workers(self):
+        w = self._create_worker('worker', max_load=2)
+        Worker.objects.filter(id=w.id).update(ready=False)
+        self._create_task()
+
+        self.assertEqual(schedule_tasks()['assigned'], 0)
+
+    @override_settings(TASK_SCHEDULER_WORKER_TIMEOUT=0)
+    def test_skip_workers_not_seen_recently(self):
+        self._create_worker('worker')
+        self._create_task()
+
+        self.assertEqual(schedule_tasks()['assigned'], 0)
+
+    def test_free_stale_tasks(self):
+        alive = self._create_worker('alive', max_load=2)
+        stale = self._create_worker('stale')
+        disabled = self._create_worker('disabled')
+        Worker.objects.filter(id=disabled.id).update(enabled=False)
+        for w in (alive, stale, disabled):
+            self._assign_task(w)
+
+        self.assertEqual(free_stale_tasks(), 1)
+        self.assertEqual(stale.assigned_tasks().count(), 1)
+
+        os.utime(stale._state_path, (0, 0))
+        kobo.hub.last_seen._get_cache().delete(kobo.hub.last_seen._cache_key(stale))
+
+        result = schedule_tasks()
+
+        # the tasks are freed and the one with free capacity gets them
+        self.assertEqual(result['freed'], 1)
+        self.assertEqual(result['assigned'], 1)
+        self.assertEqual(alive.assigned_tasks().count(), 2)
+        self.assertEqual(Task.objects.free().count(), 1)
+        self.assertEqual(stale.assigned_tasks().count(), 0)
+        self.assertEqual(disabled.assigned_tasks().count(), 0)
+
+    def test_keep_pinned_tasks_of_stale_workers(self):
+        self._create_worker('alive', max_load=5)
+        stale = self._create_worker('stale')
+        Worker.objects.filter(id=stale.id).update(enabled=False)
+        Arch.objects.create(name='noarch', pretty_name='noarch')
+        Channel.objects.create(name='default')
+        shutdown_id = Task.create_shutdown_task(self._user.username, stale.name)
+        parent = self._assign_task(stale)
+        subtask_id = Task.create_task(self._user.username, 'subtask', 'method', parent_id=parent.id, worker_name=stale.name, arch_name='testarch', channel_name='testchannel')
+
+        result = schedule_tasks()
+
+        self.assertEqual(result['freed'], 1)
+        self.assertEqual(
+            sorted(stale.assigned_tasks().values_list('id', flat=True)),
+            sorted([shutdown_id, subtask_id]),
+        )
+        self.assertEqual(Task.objects.get(id=parent.id).state, TASK_STATES['ASSIGNED'])
+        self.assertNotEqual(Task.objects.get(id=parent.id).worker_id, stale.id)
+
+    def test_skip_exclusive_tasks(self):
+        self._create_worker('worker', max_load=5)
+        self._create_task(exclusive=True)
+
+        self.assertEqual(schedule_tasks()['assigned'], 0)
+
+    def test_management_command(self):
+        self._create_worker('worker')
+        self._create_task()
+
+        out = StringIO()
+        call_command('schedule_tasks', stdout=out)
+
+        self.assertIn('Assigned 1 tasks, 0 conflicts', out.getvalue())
+
+    @override_settings(TASK_SCHEDULER_ENABLED=True)
+    def test_get_tasks_to_assign_push_mode(self):
+        w = self._create_worker('worker', max_load=5)
+        self._create_task()
+        self._create_task(awaited=True)
+        assigned = self._create_task(state=TASK_STATES['ASSIGNED'], worker=w)
+
+        req = PropertyMock(worker=w, user=Mock(is_authenticated=Mock(return_value=True)))
+        tasks = worker.get_tasks_to_assign(req)
+
+        self.assertEqual([t['id'] for t in tasks], [assigned.id])
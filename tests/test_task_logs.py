@@ -9,6 +9,8 @@ from shutil import rmtree
 
 import django.conf
 import django.test
+from django.http import Http404
+from django.test import override_settings
 from django.test.utils import get_runner
 from django.shortcuts import get_object_or_404
 
@@ -139,3 +141,46 @@ class TestTaskLogs(django.test.TransactionTestCase):
         # given the same result as reading prior to the character
         self.assertEqual(chunk_min1, chunk_min3)
         self.assertEqual(chunk_min2, chunk_min3)
+
+    def test_iter_chunks(self):
+        for log_name in ('test.log', 'test_compressed.log'):
+            chunks = list(self.task_logs().iter_chunks(log_name, offset=2, chunk_size=5))
+            self.assertEqual(b''.join(chunks), self.log_content[2:])
+            self.assertEqual(max(len(i) for i in chunks), 5)
+
+    def test_iter_lines(self):
+        for log_name in ('test.log', 'test_compressed.log'):
+            lines = list(self.task_logs().iter_lines(log_name))
+            self.assertEqual(lines, [b'Line 1 \xe2\x98\xba\n', b'Line 2 \xe2\x98\xba\n', b'Line 3'])
+
+            lines = list(self.task_logs().iter_lines(log_name, offset=7, max_line_size=4))
+            self.assertEqual(lines, [b'\xe2\x98\xba\n', b'Line', b' 2 \xe2', b'\x98\xba\n', b'Line', b' 3'])
+
+    def test_iter_lines_missing(self):
+        with self.assertRaises(Http404):
+            list(self.task_logs().iter_lines('notexist.log'))
+
+    def test_open_stream_unsaved(self):
+        task_logs = self.task_logs()
+        task_logs['new.log'] = u'unsaved ☺'
+
+        with task_logs.open_stream('new.log') as f:
+            self.assertEqual(f.read(), b'unsaved \xe2\x98\xba')
+
+    def test_cache_size_limit(self):
+        task_logs = self.task_logs()
+        task_logs['new.log'] = b'x' * 100
+
+        with override_settings(TASK_LOG_CACHE_SIZE=len(self.log_content) + 10):
+            self.assertEqual(task_logs['test.log'], self.log_content)
+            self.assertEqual(task_logs['test_compressed.log'], self.log_content)
+
+        # the least recently read log is dropped, unsaved logs are kept
+        self.assertEqual(list(task_logs.cache), ['new.log', 'test_compressed.log'])
+        self.assertEqual(task_logs['test.log'], self.log_content)
+        self.assertTrue(task_logs.changed['new.log'])
+
+    def test_logs_created_on_access(self):
+        task = Task.objects.get(id=TASK_ID)
+        self.assertIsNone(task._logs)
+        self.assertIs(task.logs, task.logs)
@@ -3,6 +3,7 @@
 import errno
 import os
 import signal
+import socket
 import logging
 
 import django
@@ -21,7 +22,7 @@ from kobo.hub.models import Arch, Channel, Task, Worker
 from kobo.worker import TaskBase
 from kobo.worker.task import FailTaskException
 from kobo.worker.taskmanager import TaskManager, TaskContainer
-from six.moves.xmlrpc_client import ProtocolError
+from six.moves.xmlrpc_client import Fault, ProtocolError
 
 from .rpc import HubProxyMock, RpcServiceMock
 from .utils import DjangoRunner
@@ -387,6 +388,117 @@ class TestTaskManager(django.test.TransactionTestCase):
         self.assertEqual(len(tm.pid_dict.keys()), 0)
         self.assertEqual(len(tm.task_dict.keys()), 0)
 
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_heartbeat_runs_free_task(self):
+        t = Task.objects.create(
+            worker=self._worker.worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyForegroundTask',
+            state=TASK_STATES['FREE'],
+        )
+
+        tm = TaskManager(conf={'worker': self._worker})
+        tm.hub.worker.get_tasks_to_assign = Mock()
+        tm.hub.worker.get_worker_tasks = Mock()
+
+        self.assertTrue(tm.heartbeat())
+
+        tm.hub.worker.get_tasks_to_assign.assert_not_called()
+        tm.hub.worker.get_worker_tasks.assert_not_called()
+
+        # reload task info
+        t = Task.objects.get(id=t.id)
+        self.assertEqual(t.state, TASK_STATES['CLOSED'])
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_heartbeat_cleanup_finished_tasks(self):
+        t = Task.objects.create(
+            worker=self._worker.worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyForkTask',
+            state=TASK_STATES['FREE'],
+        )
+
+        tm = TaskManager(conf={'worker': self._worker})
+        task_info = t.export(False)
+
+        with patch('kobo.worker.taskmanager.os', fork=Mock(return_value=9999)) as os_mock:
+            tm.take_task(task_info)
+
+        tm.run_task(task_info)
+
+        tm.hub.worker.get_task = Mock()
+        tm.finish_task = Mock()
+
+        with patch('kobo.worker.taskmanager.os', waitpid=Mock(return_value=(123, 0))) as os_mock:
+            self.assertTrue(tm.heartbeat())
+            os_mock.waitpid.assert_called_once()
+
+        self.assertFalse(t.id in tm.pid_dict)
+        self.assertFalse(t.id in tm.task_dict)
+        # task info is part of the heartbeat result
+        tm.hub.worker.get_task.assert_not_called()
+        tm.finish_task.assert_called_once()
+        self.assertEqual(tm.finish_task.call_args[0][0]['state'], TASK_STATES['CLOSED'])
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_heartbeat_not_supported(self):
+        tm = TaskManager(conf={'worker': self._worker})
+        tm.hub.worker.heartbeat = Mock(side_effect=Fault(1, 'method "worker.heartbeat" is not supported'))
+
+        self.assertFalse(tm.heartbeat())
+        self.assertFalse(tm.heartbeat())
+
+        self.assertFalse(tm.use_heartbeat)
+        tm.hub.worker.heartbeat.assert_called_once()
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_heartbeat_failure_keeps_finished_tasks(self):
+        t = Task.objects.create(
+            worker=self._worker.worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            method='DummyForkTask',
+            state=TASK_STATES['FREE'],
+        )
+
+        tm = TaskManager(conf={'worker': self._worker})
+        task_info = t.export(False)
+
+        with patch('kobo.worker.taskmanager.os', fork=Mock(return_value=9999)):
+            tm.take_task(task_info)
+
+        tm.run_task(task_info)
+        tm.finish_task = Mock()
+        heartbeat = tm.hub.worker.heartbeat
+        errors = [
+            ProtocolError('hub', 502, 'Bad Gateway', {}),
+            socket.error('Connection refused'),
+            Fault(1, "<class 'OperationalError'>: database is locked"),
+        ]
+        tm.hub.worker.heartbeat = Mock(side_effect=errors)
+
+        with patch('kobo.worker.taskmanager.os', waitpid=Mock(return_value=(123, 0))):
+            for _ in errors:
+                self.assertTrue(tm.heartbeat())
+
+        self.assertFalse(t.id in tm.pid_dict)
+        self.assertTrue(tm.use_heartbeat)
+        tm.finish_task.assert_not_called()
+        for call in tm.hub.worker.heartbeat.call_args_list:
+            self.assertEqual(call[0][3], [t.id])
+
+        tm.hub.worker.heartbeat = heartbeat
+        self.assertTrue(tm.heartbeat())
+        tm.finish_task.assert_called_once()
+        self.assertEqual(tm.finish_task.call_args[0][0]['id'], t.id)
+        self.assertEqual(tm._finished_tasks, set())
+
     @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
     def test_get_next_task_runs_free_task(self):
         t = Task.objects.create(
@@ -1004,6 +1116,56 @@ class TestTaskManager(django.test.TransactionTestCase):
         self.assertTrue(tm.worker_info['enabled'])
         self.assertTrue(tm.worker_info['ready'])
 
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_sleep(self):
+        tm = TaskManager(conf={'worker': self._worker, 'SLEEP_TIME': 5})
+        tm.hub.worker.wait_for_tasks = Mock()
+
+        with patch('kobo.worker.taskmanager.time') as time_mock:
+            tm.sleep()
+            time_mock.sleep.assert_called_once_with(5)
+        tm.hub.worker.wait_for_tasks.assert_not_called()
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_sleep_long_poll(self):
+        tm = TaskManager(conf={'worker': self._worker, 'SLEEP_TIME': 5, 'LONG_POLL': True})
+        tm.hub.worker.wait_for_tasks = Mock(side_effect=['token1', 'token2'])
+
+        with patch('kobo.worker.taskmanager.time') as time_mock:
+            tm.sleep()
+            tm.sleep()
+            time_mock.sleep.assert_not_called()
+
+        tm.hub.worker.wait_for_tasks.assert_any_call(5, None)
+        tm.hub.worker.wait_for_tasks.assert_called_with(5, 'token1')
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_sleep_long_poll_not_supported(self):
+        tm = TaskManager(conf={'worker': self._worker, 'SLEEP_TIME': 5, 'LONG_POLL': True})
+        tm.hub.worker.wait_for_tasks = Mock(side_effect=Fault(1, 'method "worker.wait_for_tasks" is not supported'))
+
+        with patch('kobo.worker.taskmanager.time') as time_mock:
+            tm.sleep()
+            tm.sleep()
+            self.assertEqual(time_mock.sleep.call_count, 2)
+
+        self.assertFalse(tm.long_poll)
+        tm.hub.worker.wait_for_tasks.assert_called_once()
+
+    @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
+    def test_sleep_long_poll_fault(self):
+        tm = TaskManager(conf={'worker': self._worker, 'SLEEP_TIME': 5, 'LONG_POLL': True})
+        tm.hub.worker.wait_for_tasks = Mock(side_effect=[Fault(1, "<class 'OperationalError'>: database is locked"), 'token'])
+
+        with patch('kobo.worker.taskmanager.time') as time_mock:
+            tm.sleep()
+            time_mock.sleep.assert_called_once_with(5)
+            tm.sleep()
+            time_mock.sleep.assert_called_once_with(5)
+
+        self.assertTrue(tm.long_poll)
+        self.assertEqual(tm.hub.worker.wait_for_tasks.call_count, 2)
+
     @patch('kobo.worker.taskmanager.HubProxy', HubProxyMock)
     def test_lock(self):
         tm = TaskManager(conf={'worker': self._worker})
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import django
+import six.moves.xmlrpc_client as xmlrpclib
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import override_settings
+from mock import Mock, patch
+
+from kobo.client import HubProxy
+from kobo.conf import PyConfigParser
+from kobo.django.upload import xmlrpc as upload_xmlrpc
+from kobo.django.upload.models import UPLOAD_STATES, FileUpload, FileUploadRange
+
+from .utils import DjangoRunner
+
+runner = DjangoRunner()
+setup_module = runner.start
+teardown_module = runner.stop
+
+
+def _make_request(user):
+    return Mock(user=user or AnonymousUser(), META={})
+
+
+class _HubTransport(object):
+    """XML-RPC transport calling upload.* functions of the hub directly."""
+
+    def __init__(self, user):
+        self.user = user
+        self.cookiejar = None
+
+    def request(self, host, handler, request_body, verbose=False):
+        params, method = xmlrpclib.loads(request_body)
+        if not method.startswith("upload."):
+            return (True, )
+        func = getattr(upload_xmlrpc, method.split(".", 1)[1])
+        try:
+            return (func(_make_request(self.user), *params), )
+        except Exception as ex:
+            raise xmlrpclib.Fault(1, "%s: %s" % (type(ex).__name__, ex))
+
+
+class TestRangedUpload(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        self.user = User.objects.create(username='testuser')
+        self.client = django.test.Client()
+
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        settings_override = override_settings(UPLOAD_DIR=self.upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.data = os.urandom(1000)
+
+    def _register(self, size=None):
+        request = _make_request(self.user)
+        if size is None:
+            size = len(self.data)
+        upload_id, upload_key = upload_xmlrpc.register_ranged_upload(request, 'file.bin', size, 'target')
+        return FileUpload.objects.get(id=upload_id)
+
+    def _put(self, upload, offset, data, checksum=None):
+        url = '/upload/?upload_id=%s&upload_key=%s&offset=%s' % (upload.id, upload.upload_key, offset)
+        checksum = checksum or hashlib.sha256(data).hexdigest()
+        return self.client.put(url, data, content_type='application/octet-stream', HTTP_X_KOBO_CHECKSUM=checksum)
+
+    def _finish(self, upload):
+        return upload_xmlrpc.finish_upload(_make_request(self.user), upload.id, hashlib.sha256(self.data).hexdigest())
+
+    def test_upload_ranges(self):
+        upload = self._register()
+
+        # any order
+        self.assertEqual(self._put(upload, 600, self.data[600:]).status_code, 200)
+        self.assertEqual(self._put(upload, 0, self.data[:600]).status_code, 200)
+
+        ranges = upload_xmlrpc.get_upload_ranges(_make_request(self.user), upload.id)
+        self.assertEqual(ranges, [
+            ['0', '600', hashlib.sha256(self.data[:600]).hexdigest()],
+            ['600', '400', hashlib.sha256(self.data[600:]).hexdigest()],
+        ])
+
+        self.assertTrue(self._finish(upload))
+
+        upload = FileUpload.objects.get(id=upload.id)
+        self.assertEqual(upload.state, UPLOAD_STATES['FINISHED'])
+        self.assertEqual(upload.checksum, hashlib.sha256(self.data).hexdigest())
+        self.assertFalse(upload.ranges.exists())
+        self.assertFalse(os.path.exists(upload.get_part_path()))
+        with open(upload.get_full_path(), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_upload_empty_file(self):
+        self.data = b''
+        upload = self._register()
+        self.assertTrue(self._finish(upload))
+
+        with open(FileUpload.objects.get(id=upload.id).get_full_path(), 'rb') as f:
+            self.assertEqual(f.read(), b'')
+
+    def test_missing_range(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data[:500]).status_code, 200)
+
+        with self.assertRaises(RuntimeError):
+            self._finish(upload)
+
+        # resume
+        self.assertEqual(self._put(upload, 500, self.data[500:]).status_code, 200)
+        self.assertTrue(self._finish(upload))
+
+    def test_range_sent_again(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data[:500]).status_code, 200)
+        self.assertEqual(self._put(upload, 0, self.data[:500]).status_code, 200)
+        self.assertEqual(self._put(upload, 500, self.data[500:]).status_code, 200)
+
+        self.assertEqual(FileUploadRange.objects.filter(upload=upload).count(), 2)
+        self.assertTrue(self._finish(upload))
+
+    def test_checksum_mismatch(self):
+        upload = self._register()
+        response = self._put(upload, 0, self.data, checksum=hashlib.sha256(b'other').hexdigest())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(upload.ranges.exists())
+
+    def test_range_exceeds_file_size(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 1, self.data).status_code, 400)
+
+    def test_range_body_exceeds_file_size(self):
+        # the body of a chunked request is longer than Content-Length says
+        upload = self._register()
+        with patch('kobo.django.upload.views._read_request_body', return_value=iter([self.data[:600], self.data[600:], b'x'])):
+            self.assertEqual(self._put(upload, 0, self.data[:10]).status_code, 400)
+
+        with open(upload.get_part_path(), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(upload.ranges.exists())
+
+    def test_whole_file_checksum_mismatch(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 200)
+
+        with self.assertRaises(RuntimeError):
+            upload_xmlrpc.finish_upload(_make_request(self.user), upload.id, hashlib.sha256(b'other').hexdigest())
+
+        upload = FileUpload.objects.get(id=upload.id)
+        self.assertEqual(upload.state, UPLOAD_STATES['FAILED'])
+        self.assertFalse(os.path.exists(upload.get_full_path()))
+
+    def test_whole_file_checksum_outside_lock(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 200)
+
+        def compute_file_checksums(*args, **kwargs):
+            self.assertFalse(connection.in_atomic_block)
+            return {'sha256': hashlib.sha256(self.data).hexdigest()}
+
+        with patch('kobo.django.upload.xmlrpc.compute_file_checksums', side_effect=compute_file_checksums) as compute_mock:
+            self.assertTrue(self._finish(upload))
+
+        compute_mock.assert_called_once()
+        self.assertEqual(FileUpload.objects.get(id=upload.id).state, UPLOAD_STATES['FINISHED'])
+
+    def test_invalid_offset(self):
+        upload = self._register()
+        checksum = hashlib.sha256(self.data).hexdigest()
+        for query in ('&offset=abc', ''):
+            url = '/upload/?upload_id=%s&upload_key=%s%s' % (upload.id, upload.upload_key, query)
+            response = self.client.put(url, self.data, content_type='application/octet-stream', HTTP_X_KOBO_CHECKSUM=checksum)
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_upload_key(self):
+        upload = self._register()
+        upload.upload_key = 'invalid'
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 403)
+
+    def test_finished_upload(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 200)
+        self._finish(upload)
+
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 403)
+        with self.assertRaises(RuntimeError):
+            self._finish(upload)
+
+    def test_file_exists(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data).status_code, 200)
+        open(upload.get_full_path(), 'w').close()
+
+        with self.assertRaises(RuntimeError):
+            self._finish(upload)
+        self.assertEqual(FileUpload.objects.get(id=upload.id).state, UPLOAD_STATES['FAILED'])
+
+    def test_delete_removes_part_file(self):
+        upload = self._register()
+        self.assertEqual(self._put(upload, 0, self.data[:10]).status_code, 200)
+        self.assertTrue(os.path.exists(upload.get_part_path()))
+
+        upload.delete()
+        self.assertFalse(os.path.exists(upload.get_part_path()))
+
+    def test_other_user(self):
+        upload = self._register()
+        other = User.objects.create(username='otheruser')
+
+        with self.assertRaises(FileUpload.DoesNotExist):
+            upload_xmlrpc.get_upload_ranges(_make_request(other), upload.id)
+
+    def test_login_required(self):
+        with self.assertRaises(PermissionDenied):
+            upload_xmlrpc.register_ranged_upload(_make_request(None), 'file.bin', 0, 'target')
+
+
+class TestHubProxyUploadFile(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        self.user = User.objects.create(username='testuser')
+        self.client = django.test.Client()
+
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        settings_override = override_settings(UPLOAD_DIR=self.upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        fd, self.file_name = tempfile.mkstemp()
+        self.data = os.urandom(10 * 1024 + 1)
+        os.write(fd, self.data)
+        os.close(fd)
+        self.addCleanup(os.unlink, self.file_name)
+
+        conf = PyConfigParser()
+        conf.load_from_dict({
+            'HUB_URL': 'http://localhost/hub',
+            'AUTH_METHOD': 'password',
+            'USERNAME': 'testuser',
+            'UPLOAD_RANGE_SIZE': 1024,
+            'UPLOAD_PARALLEL': 3,
+        })
+        self.hub = HubProxy(conf, transport=_HubTransport(self.user))
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def _send_pooled(self, connection_pool, host, port, secure, send):
+        request = Mock()
+        send(request)
+        method, selector, body, headers = request.request.call_args[0]
+        # in-memory sqlite database locks tables of concurrent requests
+        with self.lock:
+            self.sent.append(body)
+            response = django.test.Client().generic(
+                method, selector.replace('/hub/upload/', '/upload/'), body,
+                content_type='application/octet-stream', HTTP_X_KOBO_CHECKSUM=headers['X-Kobo-Checksum'],
+            )
+        return response.status_code, response.content
+
+    def _uploaded_file(self, upload_id):
+        upload = FileUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.state, UPLOAD_STATES['FINISHED'])
+        self.assertEqual(upload.checksum, hashlib.sha256(self.data).hexdigest())
+        with open(upload.get_full_path(), 'rb') as f:
+            return f.read()
+
+    def test_upload_file(self):
+        with patch('kobo.http.send_pooled', self._send_pooled):
+            upload_id, status, body = self.hub.upload_file(self.file_name, 'target')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(self.sent), 11)
+        self.assertEqual(self._uploaded_file(upload_id), self.data)
+
+    def test_upload_file_resume(self):
+        failures = set([2048, 5120])
+
+        def send_pooled(connection_pool, host, port, secure, send):
+            request = Mock()
+            send(request)
+            selector = request.request.call_args[0][1]
+            offset = int(selector.rsplit('offset=', 1)[1])
+            if offset in failures:
+                failures.remove(offset)
+                raise IOError("Connection reset by peer")
+            return self._send_pooled(connection_pool, host, port, secure, send)
+
+        with patch('kobo.http.send_pooled', send_pooled):
+            upload_id, status, body = self.hub.upload_file(self.file_name, 'target')
+
+        self.assertEqual(status, 200)
+        # 9 ranges in the first attempt, 2 failed ones in the second
+        self.assertEqual(len(self.sent), 11)
+        self.assertEqual(self._uploaded_file(upload_id), self.data)
+
+    def test_upload_file_range_refused(self):
+        with patch('kobo.http.send_pooled', return_value=(403, b'Not allowed to upload the file.')):
+            upload_id, status, body = self.hub.upload_file(self.file_name, 'target')
+
+        self.assertEqual((status, body), (403, b'Not allowed to upload the file.'))
+        self.assertEqual(FileUpload.objects.get(id=upload_id).state, UPLOAD_STATES['NEW'])
+
+    def test_upload_file_old_hub(self):
+        with patch.object(self.hub._transport, 'request', side_effect=xmlrpclib.Fault(1, 'method "upload.register_ranged_upload" is not supported')):
+            with patch.object(HubProxy, '_upload_file_post', return_value=(1, 200, b'Upload finished.')) as post_mock:
+                self.assertEqual(self.hub.upload_file(self.file_name, 'target'), (1, 200, b'Upload finished.'))
+
+        post_mock.assert_called_once_with(self.file_name, 'target')
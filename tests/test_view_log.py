@@ -18,8 +18,12 @@ import django.test
 from django.http import HttpResponse
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from kobo.hub.models import Task, Arch, Channel, TASK_STATES
+from kobo.hub.views import _log_stream_events
+from kobo.hub.wakeup import notify_tasks_changed
 
 from .utils import DjangoRunner, profile
 
@@ -175,6 +179,17 @@ class TestViewLog(django.test.TransactionTestCase):
             expected_content=full_content[offset:]
         )
 
+    def test_view_zipped_big_raw_offset(self):
+        """Fetching a compressed log with an offset should return the
+        uncompressed content from that offset to the end of the log."""
+        offset = len(self.big_log_content) - 3 * 1024 ** 2
+
+        self.assertGetLog(
+            'zipped_big.log',
+            data={'format': 'raw', 'offset': offset},
+            expected_content=self.big_log_content[offset:]
+        )
+
     def test_view_html_passthrough(self):
         """Fetching an HTML log yields exactly the HTML content,
         not wrapped in any template (even if format: raw is not requested)."""
@@ -457,6 +472,89 @@ class TestViewLog(django.test.TransactionTestCase):
 
         self.assertEqual(all_content, self.big_log_content)
 
+    def stream_events(self, response):
+        """Parse server-sent events from a streaming response as (event, id, data)."""
+        events = []
+        for chunk in response.streaming_content:
+            for block in chunk.decode().split('\n\n'):
+                fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+                if fields:
+                    events.append((fields.get('event', 'message'), fields.get('id'), json.loads(fields['data'])))
+        return events
+
+    def test_view_stream_finished_task(self):
+        """Streaming a log of a finished task sends the whole log and
+        a 'finished' event."""
+        Task.objects.filter(id=TASK_ID).update(state=TASK_STATES['CLOSED'])
+        content = small_log_content()
+
+        response = self.get_log('small.log', view_type='log-stream')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(self.stream_events(response), [
+            ('message', str(len(content)), {'content': content, 'new_offset': len(content)}),
+            ('finished', None, {}),
+        ])
+
+    def test_view_stream_last_event_id(self):
+        """Reconnecting streams continue from Last-Event-ID."""
+        Task.objects.filter(id=TASK_ID).update(state=TASK_STATES['CLOSED'])
+        content = small_log_content()
+
+        response = self.client.get('/task/%s/log-stream/zipped_small.log' % TASK_ID, HTTP_LAST_EVENT_ID='10')
+
+        events = self.stream_events(response)
+        self.assertEqual(events[0][2], {'content': content[10:], 'new_offset': len(content)})
+
+    @django.test.override_settings(LOG_STREAM_POLL_INTERVAL=0.01)
+    def test_view_stream_follows_log(self):
+        """Streams send the log as it grows until the task finishes."""
+        response = self.get_log('new.log', view_type='log-stream')
+        events = iter(response.streaming_content)
+        log_path = Task.objects.get(id=TASK_ID).logs._get_absolute_log_path('new.log')
+
+        with open(log_path, 'w') as f:
+            f.write('first\n')
+        self.assertIn(b'"content": "first\\n", "new_offset": 6', next(events))
+
+        with open(log_path, 'a') as f:
+            f.write('second\n')
+        Task.objects.filter(id=TASK_ID).update(state=TASK_STATES['CLOSED'])
+        # as state transitions of tasks do
+        notify_tasks_changed()
+        self.assertIn(b'"content": "second\\n", "new_offset": 13', next(events))
+        self.assertEqual(next(events), b'event: finished\ndata: {}\n\n')
+        self.assertEqual(list(events), [])
+
+    def test_view_stream_idle_no_queries(self):
+        """Idle streams don't check the task state until tasks change."""
+        class Stop(Exception):
+            pass
+
+        polls = []
+
+        def wait_for_log_change():
+            polls.append(1)
+            if len(polls) == 5:
+                raise Stop()
+
+        events = _log_stream_events(Task.objects.get(id=TASK_ID), 'new.log', 0)
+        with mock.patch('kobo.hub.views.wait_for_log_change', wait_for_log_change):
+            with CaptureQueriesContext(connection) as queries:
+                with self.assertRaises(Stop):
+                    list(events)
+
+        self.assertEqual(len([i for i in queries if 'hub_task' in i['sql']]), 1)
+
+    def test_view_stream_timeout(self):
+        """Streams of running tasks are closed after LOG_STREAM_TIMEOUT."""
+        with mock.patch('kobo.hub.views.LOG_STREAM_TIMEOUT', 0):
+            response = self.get_log('small.log', view_type='log-stream')
+            events = self.stream_events(response)
+
+        self.assertEqual([i[0] for i in events], ['message'])
+
     def assertGetLog(self, log_name, view_type='log', test_content_length=True,
                      expected_content=None, data={}):
         """Verify log can be successfully retrieved and response has certain properties.
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+import hashlib
+import json
+import os
+
 import django
 
 from django.contrib.auth import REDIRECT_FIELD_NAME
@@ -296,7 +301,115 @@ class TestWorkerView(django.test.TransactionTestCase):
         self.assertTrue(self.worker1.name in str(response.content))
         self.assertTrue(self.worker2.name in str(response.content))
 
+    def test_list_last_seen(self):
+        with patch('kobo.hub.last_seen.get_last_seen', return_value={
+            self.worker1.id: datetime.datetime(2021, 7, 7, 22, 9, 28),
+            self.worker2.id: None,
+        }) as mock_get:
+            response = self.client.get('/info/worker/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('2021-07-07T22:09:28Z', str(response.content))
+        self.assertEqual(mock_get.call_count, 1)
+
     def test_detail(self):
         response = self.client.get('/info/worker/%d/' % self.worker1.id)
         self.assertEqual(response.status_code, 200)
         self.assertTrue('#%d: %s' % (self.worker1.id, self.worker1.name) in str(response.content))
+
+
+class TestTaskLogUploadView(django.test.TransactionTestCase):
+
+    def setUp(self):
+        self._fixture_teardown()
+        user = User.objects.create(username='testuser')
+        arch = Arch.objects.create(name='testarch')
+        channel = Channel.objects.create(name='testchannel')
+
+        self.worker = Worker.objects.create(worker_key='mock-worker', name='mock-worker')
+        self.task = Task.objects.create(
+            worker=self.worker,
+            arch=arch,
+            channel=channel,
+            owner=user,
+            state=TASK_STATES['OPEN'],
+        )
+
+        self.client = django.test.Client()
+        self.client.force_login(User.objects.create(username='worker/mock-worker'))
+
+    def _put(self, data, log_name='logs/stdout.log', checksum=None, **query):
+        url = '/task/%d/log-upload/%s' % (self.task.id, log_name)
+        if query:
+            url += '?' + '&'.join('%s=%s' % i for i in query.items())
+        checksum = checksum or hashlib.sha256(data).hexdigest()
+        return self.client.put(url, data, content_type='application/octet-stream', HTTP_X_KOBO_CHECKSUM=checksum)
+
+    def _read(self, log_name='logs/stdout.log'):
+        with open(os.path.join(self.task.task_dir(), log_name), 'rb') as f:
+            return f.read()
+
+    def test_append(self):
+        response = self._put(b'line 1\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {
+            'size': 7,
+            'checksum': hashlib.sha256(b'line 1\n').hexdigest(),
+        })
+
+        self.assertEqual(self._put(b'line 2\n').status_code, 200)
+        self.assertEqual(self._read(), b'line 1\nline 2\n')
+
+    def test_offset(self):
+        self.assertEqual(self._put(b'line 1\nline 2\n').status_code, 200)
+        self.assertEqual(self._put(b'LINE 2\n', offset=7).status_code, 200)
+        self.assertEqual(self._read(), b'line 1\nLINE 2\n')
+
+        self.assertEqual(self._put(b'', offset=0).status_code, 200)
+        self.assertEqual(self._read(), b'')
+
+    def test_offset_beyond_end(self):
+        self.assertEqual(self._put(b'line 2\n', offset=7).status_code, 416)
+        self.assertFalse(os.path.exists(os.path.join(self.task.task_dir(), 'logs/stdout.log')))
+
+        self.assertEqual(self._put(b'line 1\n').status_code, 200)
+        self.assertEqual(self._put(b'line 3\n', offset=14).status_code, 416)
+        self.assertEqual(self._read(), b'line 1\n')
+        # the end of the log is fine
+        self.assertEqual(self._put(b'line 2\n', offset=7).status_code, 200)
+        self.assertEqual(self._read(), b'line 1\nline 2\n')
+
+    def test_mode(self):
+        self.assertEqual(self._put(b'secret', log_name='traceback.log', mode='600').status_code, 200)
+        path = os.path.join(self.task.task_dir(), 'traceback.log')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_checksum_mismatch(self):
+        self.assertEqual(self._put(b'line 1\n').status_code, 200)
+
+        response = self._put(b'line 2\n', checksum=hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        # the chunk is not kept
+        self.assertEqual(self._read(), b'line 1\n')
+
+    def test_missing_checksum(self):
+        url = '/task/%d/log-upload/stdout.log' % self.task.id
+        response = self.client.put(url, b'data', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_path(self):
+        self.assertEqual(self._put(b'data', log_name='../stdout.log').status_code, 400)
+        self.assertEqual(self._put(b'data', log_name='foo/../../stdout.log').status_code, 400)
+
+    def test_task_not_open(self):
+        self.task.state = TASK_STATES['CLOSED']
+        self.task.save()
+        self.assertEqual(self._put(b'data').status_code, 400)
+
+    def test_not_worker(self):
+        self.client.force_login(User.objects.create(username='otheruser'))
+        self.assertEqual(self._put(b'data').status_code, 403)
+
+    def test_method_not_allowed(self):
+        response = self.client.post('/task/%d/log-upload/stdout.log' % self.task.id)
+        self.assertEqual(response.status_code, 405)
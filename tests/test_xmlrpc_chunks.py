@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+from mock import patch
+
+import kobo.shortcuts
+from kobo.xmlrpc import _FileChecksumStates, decode_xmlrpc_chunk, encode_xmlrpc_chunks_iterator, get_file_checksum, write_chunk
+
+
+class TestXmlRpcChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "sub", "file")
+        self.data = os.urandom(3 * 1024 ** 2 + 123)
+
+    def _chunks(self):
+        return list(encode_xmlrpc_chunks_iterator(BytesIO(self.data)))
+
+    def _upload(self, chunks):
+        for chunk in chunks:
+            decode_xmlrpc_chunk(*chunk, write_to=self.path)
+
+    def test_upload(self):
+        with patch("kobo.shortcuts.compute_file_checksums") as compute_mock:
+            self._upload(self._chunks())
+            # whole file checksum has been computed while writing chunks
+            compute_mock.assert_not_called()
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["file"])
+
+    def test_upload_again(self):
+        self._upload(self._chunks())
+        with patch("kobo.shortcuts.compute_file_checksums") as compute_mock:
+            self._upload(self._chunks())
+            compute_mock.assert_not_called()
+
+    def test_out_of_order_chunks(self):
+        chunks = self._chunks()
+        chunks[1], chunks[2] = chunks[2], chunks[1]
+
+        self.assertRaises(ValueError, self._upload, chunks)
+
+    def test_missing_chunk(self):
+        chunks = self._chunks()
+        del chunks[1]
+
+        self.assertRaises(ValueError, self._upload, chunks)
+
+    def test_modified_file(self):
+        chunks = self._chunks()
+        self._upload(chunks[:-1])
+
+        # modified within the timestamp granularity: the times don't change
+        stat = os.stat(self.path)
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertRaises(ValueError, self._upload, chunks[-1:])
+
+    def test_truncated_file(self):
+        chunks = self._chunks()
+        self._upload(chunks[:2])
+
+        with open(self.path, "r+b") as f:
+            f.truncate(10)
+
+        self.assertRaises(ValueError, self._upload, chunks[2:])
+
+    def test_chunk_sent_again(self):
+        chunks = self._chunks()
+        self._upload(chunks[:2])
+        # e.g. a retry after a timeout; rewinds the file to the chunk start
+        with patch("kobo.shortcuts.compute_file_checksums", wraps=kobo.shortcuts.compute_file_checksums) as compute_mock:
+            self._upload(chunks[1:])
+            compute_mock.assert_called_once()
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_state_of_other_process(self):
+        chunks = self._chunks()
+        self._upload(chunks[:2])
+
+        # chunk written by another hub process, state is unknown here
+        with patch("kobo.xmlrpc._file_checksum_states._states", {}):
+            self._upload(chunks[2:3])
+
+        self._upload(chunks[3:])
+
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_finished_by_other_process(self):
+        chunks = self._chunks()
+        self._upload(chunks[:-1])
+        self.assertTrue(os.path.exists(_FileChecksumStates.state_path(self.path)))
+
+        # the final chunk is handled by another hub process
+        with patch("kobo.xmlrpc._file_checksum_states._states", {}):
+            with patch("kobo.shortcuts.compute_file_checksums") as compute_mock:
+                self._upload(chunks[-1:])
+                compute_mock.assert_not_called()
+
+        self.assertFalse(os.path.exists(_FileChecksumStates.state_path(self.path)))
+
+    def test_modified_file_of_other_process(self):
+        chunks = self._chunks()
+        self._upload(chunks[:-1])
+
+        stat = os.stat(self.path)
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        with patch("kobo.xmlrpc._file_checksum_states._states", {}):
+            self.assertRaises(ValueError, self._upload, chunks[-1:])
+
+    def test_write_chunk_checksum_mismatch(self):
+        write_chunk(self.path, [b"abc"], 0)
+
+        self.assertRaises(ValueError, write_chunk, self.path, [b"def"], 3, "0" * 64)
+        self.assertEqual(get_file_checksum(self.path), write_chunk(self.path + "2", [b"abc"])[1])
@@ -2,15 +2,18 @@
 
 import django
 
+from datetime import datetime, timedelta
+
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.models import User
 
-from mock import PropertyMock
+from mock import PropertyMock, patch
+from six.moves import xmlrpc_client
 import pytest
 import logging
 
 from kobo.client.constants import TASK_STATES
-from kobo.hub.models import Arch, Channel, Task, Worker
+from kobo.hub.models import Arch, Channel, Task, TaskEvent, Worker
 from kobo.hub.xmlrpc import client
 
 from .utils import DjangoRunner
@@ -185,6 +188,195 @@ class TestXmlRpcClient(django.test.TransactionTestCase):
         self.assertEqual(len(task_list), 2)
         self.assertEqual(set([t['id'] for t in task_list]), set([t1, t2]))
 
+    def test_get_tasks_pagination(self):
+        ids = [Task.create_task(self._user.username, 'task-%s' % i, 'method') for i in range(5)]
+
+        page1 = client.get_tasks(_make_request(), None, None, {'limit': 2})
+        page2 = client.get_tasks(_make_request(), None, None, {'limit': 2, 'after_id': page1[-1]['id']})
+        page3 = client.get_tasks(_make_request(), None, None, {'limit': 2, 'after_id': page2[-1]['id']})
+
+        self.assertEqual([t['id'] for t in page1 + page2 + page3], ids)
+        self.assertEqual(len(page3), 1)
+        self.assertEqual(client.get_tasks(_make_request(), None, None, {'after_id': ids[-1]}), [])
+
+    def test_get_tasks_max_limit(self):
+        ids = [Task.create_task(self._user.username, 'task-%s' % i, 'method') for i in range(3)]
+
+        with patch('kobo.hub.xmlrpc.client.GET_TASKS_MAX_LIMIT', 2):
+            self.assertEqual([t['id'] for t in client.get_tasks(_make_request(), None, None)], ids[:2])
+            self.assertEqual([t['id'] for t in client.get_tasks(_make_request(), None, None, {'limit': 5})], ids[:2])
+            self.assertEqual([t['id'] for t in client.get_tasks(_make_request(), None, None, {'after_id': ids[1]})], ids[2:])
+            # listed tasks are bounded by the request
+            self.assertEqual(len(client.get_tasks(_make_request(), ids, None)), 3)
+
+    def test_get_tasks_fields(self):
+        task_id = Task.create_task(self._user.username, 'task-1', 'method', args={'x': 1})
+
+        task_list = client.get_tasks(_make_request(), None, None, {'fields': ['id', 'owner', 'state_label', 'resubmitted_by']})
+
+        self.assertEqual(task_list, [{'id': task_id, 'owner': 'testuser', 'state_label': 'FREE', 'resubmitted_by': None}])
+
+    def test_get_tasks_fields_same_as_export(self):
+        task_id = Task.create_task(self._user.username, 'task-1', 'method', args={'x': 1})
+        full = client.get_tasks(_make_request(), None, None)[0]
+
+        task_list = client.get_tasks(_make_request(), None, None, {'fields': list(full)})
+
+        self.assertEqual(task_list, [full])
+        self.assertEqual(full, Task.objects.get(id=task_id).export(flat=True))
+
+    def test_get_tasks_num_queries(self):
+        other = User.objects.create(username='otheruser')
+        Task.create_task(self._user.username, 'task-1', 'method')
+
+        for options in ({}, {'fields': ['id', 'owner', 'resubmitted_by']}):
+            with self.assertNumQueries(1):
+                client.get_tasks(_make_request(), None, None, options)
+
+        for _ in range(5):
+            Task.create_task(other.username, 'task', 'method')
+        for options in ({}, {'fields': ['id', 'owner', 'resubmitted_by']}):
+            with self.assertNumQueries(1):
+                self.assertEqual(len(client.get_tasks(_make_request(), None, None, options)), 6)
+
+    def test_get_tasks_unknown_field(self):
+        with self.assertRaises(ValueError):
+            client.get_tasks(_make_request(), None, None, {'fields': ['id', 'no-such-field']})
+
+    def test_get_tasks_unknown_option(self):
+        with self.assertRaises(ValueError):
+            client.get_tasks(_make_request(), None, None, {'no-such-option': 1})
+
+    def test_get_tasks_filter_by_method_and_owner(self):
+        other = User.objects.create(username='otheruser')
+        t1 = Task.create_task(self._user.username, 'task-1', 'method')
+        Task.create_task(self._user.username, 'task-2', 'other-method')
+        Task.create_task(other.username, 'task-3', 'method')
+
+        task_list = client.get_tasks(_make_request(), None, None, {'method': 'method', 'owner': 'testuser'})
+
+        self.assertEqual([t['id'] for t in task_list], [t1])
+
+    def test_get_tasks_filter_by_time(self):
+        t1 = Task.create_task(self._user.username, 'task-1', 'method')
+        t2 = Task.create_task(self._user.username, 'task-2', 'method')
+        t3 = Task.create_task(self._user.username, 'task-3', 'method')
+        Task.objects.filter(id=t1).update(dt_created='2020-01-01 10:00:00')
+        Task.objects.filter(id=t2).update(dt_created='2020-01-02 10:00:00')
+        Task.objects.filter(id=t3).update(dt_created='2020-01-03 10:00:00')
+
+        task_list = client.get_tasks(_make_request(), None, None, {
+            'created_after': '2020-01-01 12:00:00',
+            'created_before': '2020-01-03',
+        })
+        self.assertEqual([t['id'] for t in task_list], [t2])
+
+        with self.assertRaises(ValueError):
+            client.get_tasks(_make_request(), None, None, {'created_after': 'yesterday'})
+
+    def test_get_task_changes(self):
+        root =Task.create_task(self._user.username, 'root', 'method')
+        child = Task.create_task(self._user.username, 'child', 'method', parent_id=root)
+        other = Task.create_task(self._user.username, 'other', 'method')
+
+        result = client.get_task_changes(_make_request(), [root, 999], '')
+
+        self.assertEqual([t['id'] for t in result['tasks']], [root, child])
+        self.assertEqual(result['tasks'][1]['parent'], root)
+        self.assertEqual(result['tasks'][1]['state_label'], 'FREE')
+        self.assertEqual(result['missing'], [999])
+        self.assertFalse(result['finished'])
+
+        # nothing changed
+        token = result['token']
+        result = client.get_task_changes(_make_request(), [root], token)
+        self.assertEqual(result['tasks'], [])
+        self.assertEqual(result['token'], token)
+
+        grandchild = Task.create_task(self._user.username, 'grandchild', 'method', parent_id=child)
+        Task.objects.filter(id=child).update(state=TASK_STATES['OPEN'])
+        Task.objects.filter(id=other).update(state=TASK_STATES['OPEN'])
+
+        result = client.get_task_changes(_make_request(), [root], token)
+
+        self.assertEqual([(t['id'], t['state']) for t in result['tasks']], [
+            (child, TASK_STATES['OPEN']),
+            (grandchild, TASK_STATES['FREE']),
+        ])
+
+        Task.objects.filter(id__in=[root, child, grandchild]).update(state=TASK_STATES['CLOSED'])
+        result = client.get_task_changes(_make_request(), [root], result['token'])
+        self.assertEqual(len(result['tasks']), 3)
+        self.assertTrue(result['finished'])
+
+    def test_get_task_changes_invalid_token(self):
+        root = Task.create_task(self._user.username, 'root', 'method')
+
+        result = client.get_task_changes(_make_request(), [root], '1.invalid')
+
+        self.assertEqual([t['id'] for t in result['tasks']], [root])
+
+    def test_get_task_events(self):
+        t1 = Task.create_task(self._user.username, 'task-1', 'method')
+        t2 = Task.create_task(self._user.username, 'task-2', 'method')
+        Task.objects.get(id=t1).cancel_task()
+
+        result = client.get_task_events(_make_request(), '0', 2)
+
+        self.assertEqual([(e['task_id'], e['state']) for e in result['events']], [
+            (t1, TASK_STATES['FREE']),
+            (t2, TASK_STATES['FREE']),
+        ])
+        self.assertEqual(result['last_seq'], result['events'][-1]['seq'])
+
+        result = client.get_task_events(_make_request(), result['last_seq'])
+        self.assertEqual([(e['task_id'], e['old_state'], e['state']) for e in result['events']], [
+            (t1, TASK_STATES['FREE'], TASK_STATES['CANCELED']),
+        ])
+
+        last_seq = result['last_seq']
+        result = client.get_task_events(_make_request(), last_seq)
+        self.assertEqual(result, {'events': [], 'last_seq': last_seq, 'skipped': []})
+
+    def test_get_task_events_committed_after_gap_timeout(self):
+        for i in range(4):
+            Task.create_task(self._user.username, 'task-%s' % i, 'method')
+        seqs = list(TaskEvent.objects.values_list('id', flat=True))
+        # event of a transaction which hasn't committed yet
+        late = TaskEvent.objects.get(id=seqs[2])
+        late.delete()
+        TaskEvent.objects.filter(id=seqs[3]).update(dt_created=datetime.now() - timedelta(seconds=61))
+
+        with self.settings(TASK_EVENTS_GAP_TIMEOUT=60):
+            result = client.get_task_events(_make_request(), str(seqs[1]))
+
+        self.assertEqual([e['seq'] for e in result['events']], [str(seqs[3])])
+        self.assertEqual(result['skipped'], [[str(seqs[2]), str(seqs[2])]])
+
+        # the transaction commits after the timeout
+        late.id = seqs[2]
+        late.save(force_insert=True)
+
+        # not returned when following the events...
+        last_seq = result['last_seq']
+        self.assertEqual(client.get_task_events(_make_request(), last_seq)['events'], [])
+        # ...but found by looking at the skipped numbers again
+        first, last = result['skipped'][0]
+        result = client.get_task_events(_make_request(), str(int(first) - 1), 1000, last)
+        self.assertEqual([e['seq'] for e in result['events']], [str(seqs[2])])
+        self.assertEqual(result['skipped'], [])
+
+    def test_get_task_events_large_seq(self):
+        Task.create_task(self._user.username, 'task-1', 'method')
+        TaskEvent.objects.update(id=2 ** 40)
+
+        result = client.get_task_events(_make_request(), str(2 ** 40 - 1))
+
+        self.assertEqual([e['seq'] for e in result['events']], [str(2 ** 40)])
+        self.assertEqual(result['last_seq'], str(2 ** 40))
+        # the result can be marshalled
+        xmlrpc_client.dumps((result, ), methodresponse=True, allow_none=True)
+
     def test_cancel_task(self):
         task_id = Task.create_task(self._user.username, 'task', 'method')
         ret = client.cancel_task(_make_request(self._user), task_id)
@@ -2,6 +2,7 @@
 
 import base64
 import hashlib
+import re
 import tempfile
 import unittest
 
@@ -12,6 +13,8 @@ import six
 from datetime import datetime, timedelta
 
 from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 
 from mock import Mock, PropertyMock, patch
@@ -138,6 +141,29 @@ class TestXmlRpcWorker(django.test.TransactionTestCase):
         self.assertEqual(tasks[0]['id'], t_parent.id)
         self.assertTrue(tasks[0]['alert'])
 
+    def test_get_worker_tasks_num_queries(self):
+        def create_tasks(count):
+            for _ in range(count):
+                Task.objects.create(
+                    worker=self._worker,
+                    arch=self._arch,
+                    channel=self._channel,
+                    owner=self._user,
+                    state=TASK_STATES['OPEN'],
+                    resubmitted_by=self._user,
+                )
+
+        req = _make_request(self._worker)
+
+        create_tasks(1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(worker.get_worker_tasks(req)), 1)
+        expected = len(ctx.captured_queries)
+
+        create_tasks(10)
+        with self.assertNumQueries(expected):
+            self.assertEqual(len(worker.get_worker_tasks(req)), 11)
+
     def test_get_worker_tasks_returns_empty_list_if_no_tasks(self):
         req = _make_request(self._worker)
         tasks = worker.get_worker_tasks(req)
@@ -858,6 +884,324 @@ class TestXmlRpcWorker(django.test.TransactionTestCase):
         self.assertEqual(len(tasks), 10)
         self.assertEqual(len([t for t in tasks if t['state'] == TASK_STATES['ASSIGNED'] and t['exclusive']]), 10)
 
+    def test_get_tasks_to_assign_multiple_channels(self):
+        other_channel = Channel.objects.create(name='otherchannel')
+        self._worker.channels.add(other_channel)
+
+        # the busy channel has more tasks than max_tasks, the other one
+        # must still get a chance to be picked
+        for _ in range(15):
+            Task.objects.create(
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                state=TASK_STATES['FREE'],
+            )
+
+        other_tasks = [
+            Task.objects.create(
+                arch=self._arch,
+                channel=other_channel,
+                owner=self._user,
+                state=TASK_STATES['FREE'],
+                priority=20,
+            ) for _ in range(3)
+        ]
+
+        req = _make_request(self._worker)
+        with CaptureQueriesContext(connection) as ctx:
+            tasks = worker.get_tasks_to_assign(req)
+
+        # MySQL doesn't support LIMIT in IN subqueries
+        for query in ctx.captured_queries:
+            for match in re.finditer(r'IN \(SELECT ', query['sql']):
+                depth = 0
+                for end, char in enumerate(query['sql'][match.start() + 3:]):
+                    depth += {'(': 1, ')': -1}.get(char, 0)
+                    if not depth:
+                        break
+                subquery = query['sql'][match.start():match.start() + 3 + end]
+                self.assertNotIn(' LIMIT ', subquery)
+        self.assertEqual(len(tasks), 10)
+        # higher priority tasks from the other channel are always first
+        self.assertEqual(sorted(t['id'] for t in tasks[:3]), sorted(t.id for t in other_tasks))
+        self.assertTrue(all(t['channel']['id'] == self._channel.id for t in tasks[3:]))
+
+    def test_get_tasks_to_assign_same_export(self):
+        parent = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['OPEN'],
+            worker=self._worker,
+        )
+        task = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+            parent=parent,
+            resubmitted_by=self._user,
+        )
+        Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+            parent=task,
+        )
+
+        req = _make_request(self._worker)
+        tasks = worker.get_tasks_to_assign(req)
+
+        self.assertEqual(len(tasks), 2)
+        for task_info in tasks:
+            self.assertEqual(task_info, Task.objects.get(id=task_info['id']).export(flat=False))
+
+    def test_get_tasks_to_assign_num_queries(self):
+        def create_tasks(count):
+            for _ in range(count):
+                Task.objects.create(
+                    arch=self._arch,
+                    channel=self._channel,
+                    owner=self._user,
+                    state=TASK_STATES['FREE'],
+                    worker=self._worker,
+                )
+
+        req = _make_request(self._worker)
+
+        create_tasks(1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(worker.get_tasks_to_assign(req)), 1)
+        expected = len(ctx.captured_queries)
+
+        # number of queries doesn't depend on number of tasks
+        create_tasks(20)
+        with self.assertNumQueries(expected):
+            self.assertEqual(len(worker.get_tasks_to_assign(req)), 10)
+
+    def test_heartbeat(self):
+        self._worker.max_load = 2
+        self._worker.save()
+
+        running = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['OPEN'],
+            worker=self._worker,
+        )
+        finished = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['CLOSED'],
+            worker=self._worker,
+        )
+        free = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+        )
+
+        req = _make_request(self._worker)
+        result = worker.heartbeat(req, True, True, [running.id], [finished.id])
+
+        self.assertEqual(result['worker_info'], self._worker.export())
+        self.assertEqual(result['tasks'], worker.get_worker_tasks(req))
+        self.assertEqual(
+            sorted(result['task_info_list'], key=lambda i: i['id']),
+            [running.export(), finished.export()],
+        )
+        self.assertEqual([t['id'] for t in result['tasks_to_assign']], [free.id])
+
+    def test_heartbeat_skip_tasks_to_assign(self):
+        Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+        )
+
+        req = _make_request(self._worker)
+        self.assertEqual(worker.heartbeat(req, True, True, [], [], False)['tasks_to_assign'], [])
+
+        self._worker.enabled = False
+        self._worker.save()
+        self.assertEqual(worker.heartbeat(req, True, True, [], [])['tasks_to_assign'], [])
+
+    def test_heartbeat_finished_task_of_other_worker(self):
+        w = Worker.objects.create(worker_key='other-worker', name='other-worker')
+        t = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['CLOSED'],
+            worker=w,
+        )
+
+        req = _make_request(self._worker)
+        self.assertEqual(worker.heartbeat(req, True, True, [], [t.id])['task_info_list'], [])
+
+    def test_get_hub_features(self):
+        features = worker.get_hub_features(_make_request(self._worker))
+        self.assertEqual(features['upload_task_log_url'], '/task/%(task_id)s/log-upload/%(path)s')
+
+    def test_wait_for_tasks_returns_on_new_task(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        # nothing has changed, wait until timeout
+        with patch('kobo.hub.xmlrpc.worker.time.sleep') as sleep_mock:
+            self.assertEqual(worker.wait_for_tasks(req, 0, token), token)
+            sleep_mock.assert_not_called()
+
+        Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+        )
+
+        self.assertNotEqual(worker.wait_for_tasks(req, 60, token), token)
+
+    def _fake_clock(self, time_mock, on_sleep=None):
+        clock = [0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+            if on_sleep is not None:
+                on_sleep()
+
+        time_mock.time.side_effect = lambda: clock[0]
+        time_mock.sleep.side_effect = sleep
+
+    def test_wait_for_tasks_waits(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        with patch('kobo.hub.xmlrpc.worker.time') as time_mock:
+            with patch('kobo.hub.xmlrpc.worker._wakeup_token', wraps=worker._wakeup_token) as token_mock:
+                self._fake_clock(time_mock)
+                self.assertEqual(worker.wait_for_tasks(req, 2, token), token)
+
+        self.assertEqual(time_mock.sleep.call_count, 2)
+        # nothing has changed, tasks are not looked up again
+        self.assertEqual(token_mock.call_count, 1)
+
+    def test_wait_for_tasks_wakes_up_on_change(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        def create_task():
+            Task.objects.create(
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                state=TASK_STATES['FREE'],
+            )
+
+        with patch('kobo.hub.xmlrpc.worker.time') as time_mock:
+            self._fake_clock(time_mock, create_task)
+            self.assertNotEqual(worker.wait_for_tasks(req, 10, token), token)
+
+        self.assertEqual(time_mock.sleep.call_count, 1)
+
+    def test_wait_for_tasks_rechecks(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        with self.settings(WORKER_LONG_POLL_RECHECK=1):
+            with patch('kobo.hub.xmlrpc.worker.time') as time_mock:
+                with patch('kobo.hub.xmlrpc.worker._wakeup_token', wraps=worker._wakeup_token) as token_mock:
+                    self._fake_clock(time_mock)
+                    self.assertEqual(worker.wait_for_tasks(req, 3, token), token)
+
+        self.assertEqual(token_mock.call_count, 4)
+
+    def test_wait_for_tasks_not_woken_by_other_arches(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+        other_arch = Arch.objects.create(name='otherarch', pretty_name='otherarch')
+
+        def create_task():
+            Task.objects.create(
+                arch=other_arch,
+                channel=self._channel,
+                owner=self._user,
+                state=TASK_STATES['FREE'],
+            )
+
+        with patch('kobo.hub.xmlrpc.worker.time') as time_mock:
+            with patch('kobo.hub.xmlrpc.worker._wakeup_token', wraps=worker._wakeup_token) as token_mock:
+                self._fake_clock(time_mock, create_task)
+                self.assertEqual(worker.wait_for_tasks(req, 2, token), token)
+
+        # tasks of the worker are not looked up again
+        self.assertEqual(token_mock.call_count, 1)
+
+    def test_wait_for_tasks_tasks_replaced(self):
+        other_channel = Channel.objects.create(name='otherchannel')
+        tasks = [
+            Task.objects.create(
+                arch=self._arch,
+                channel=channel,
+                owner=self._user,
+                state=TASK_STATES['FREE'],
+            )
+            for channel in (self._channel, other_channel, other_channel, self._channel)
+        ]
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        # the same count and sum of IDs of tasks the worker could take
+        for task, channel in zip(tasks, (other_channel, self._channel, self._channel, other_channel)):
+            task.channel = channel
+            task.save()
+
+        self.assertNotEqual(worker.wait_for_tasks(req, 0, token), token)
+
+    def test_wait_for_tasks_ignores_other_channels(self):
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        Task.objects.create(
+            arch=self._arch,
+            channel=Channel.objects.create(name='otherchannel'),
+            owner=self._user,
+            state=TASK_STATES['FREE'],
+        )
+
+        self.assertEqual(worker.wait_for_tasks(req, 0, token), token)
+
+    def test_wait_for_tasks_subtask_finished(self):
+        parent = Task.objects.create(
+            worker=self._worker,
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['OPEN'],
+            waiting=True,
+        )
+        child = Task.objects.create(
+            arch=self._arch,
+            channel=self._channel,
+            owner=self._user,
+            state=TASK_STATES['OPEN'],
+            parent=parent,
+            awaited=True,
+        )
+
+        req = _make_request(self._worker)
+        token = worker.wait_for_tasks(req, 0)
+
+        child.state = TASK_STATES['CLOSED']
+        child.save()
+
+        self.assertNotEqual(worker.wait_for_tasks(req, 0, token), token)
+
     def test_get_awaited_tasks(self):
         t1 = Task.objects.create(
             worker=self._worker,
@@ -882,6 +1226,41 @@ class TestXmlRpcWorker(django.test.TransactionTestCase):
         self.assertEqual(len(tasks), 1)
         self.assertEqual(tasks[0]['id'], t2.id)
 
+    def test_get_awaited_tasks_num_queries(self):
+        def create_tasks(count):
+            parent = Task.objects.create(
+                worker=self._worker,
+                arch=self._arch,
+                channel=self._channel,
+                owner=self._user,
+                state=TASK_STATES['OPEN'],
+            )
+            for _ in range(count):
+                Task.objects.create(
+                    worker=self._worker,
+                    arch=self._arch,
+                    channel=self._channel,
+                    owner=self._user,
+                    state=TASK_STATES['FREE'],
+                    awaited=True,
+                    parent=parent,
+                )
+            return parent
+
+        req = _make_request(self._worker)
+
+        parents = [create_tasks(1).export()]
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(worker.get_awaited_tasks(req, parents)), 1)
+        expected = len(ctx.captured_queries)
+
+        parents.append(create_tasks(10).export())
+        with self.assertNumQueries(expected):
+            tasks = worker.get_awaited_tasks(req, parents)
+        self.assertEqual(len(tasks), 11)
+        for task_info in tasks:
+            self.assertEqual(task_info, Task.objects.get(id=task_info['id']).export(flat=False))
+
     def test_get_awaited_tasks_if_empty_task_list(self):
         t_parent = Task.objects.create(
             worker=self._worker,
@@ -1297,6 +1676,18 @@ class TestXmlRpcWorkerNotAuthenticated(django.test.TransactionTestCase):
         with self.assertRaises(PermissionDenied):
             worker.get_tasks_to_assign(_make_request(None, False))
 
+    def test_wait_for_tasks(self):
+        with self.assertRaises(PermissionDenied):
+            worker.wait_for_tasks(_make_request(None, False), 0)
+
+    def test_get_hub_features(self):
+        with self.assertRaises(PermissionDenied):
+            worker.get_hub_features(_make_request(None, False))
+
+    def test_heartbeat(self):
+        with self.assertRaises(PermissionDenied):
+            worker.heartbeat(_make_request(None, False), True, True, [], [])
+
     def test_get_awaited_tasks(self):
         with self.assertRaises(PermissionDenied):
             worker.get_awaited_tasks(_make_request(None, False), [])
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+Measure hub.worker.get_tasks_to_assign: queries and latency per worker poll.
+
+Usage: python tools/benchmarks/bench_dispatch.py [free_task_count ...]
+"""
+
+
+import sys
+
+from common import database, measure, report
+
+from django.contrib.auth.models import User
+from mock import Mock, PropertyMock
+
+from kobo.client.constants import TASK_STATES
+from kobo.hub.models import Arch, Channel, Task, Worker
+from kobo.hub.xmlrpc import worker
+
+
+CHANNEL_COUNT = 20
+
+
+def populate(free_task_count):
+    user = User.objects.create(username="bench-user")
+    arch = Arch.objects.create(name="x86_64", pretty_name="x86_64")
+    channels = [Channel.objects.create(name="channel-%s" % i) for i in range(CHANNEL_COUNT)]
+
+    bench_worker = Worker.objects.create(name="bench-worker")
+    bench_worker.arches.add(arch)
+    bench_worker.channels.add(*channels)
+
+    tasks = []
+    for i in range(free_task_count):
+        tasks.append(Task(
+            owner=user,
+            arch=arch,
+            channel=channels[i % CHANNEL_COUNT],
+            method="DummyTask",
+            state=TASK_STATES["FREE"],
+            priority=10 + i % 3,
+        ))
+        if len(tasks) >= 5000:
+            Task.objects.bulk_create(tasks)
+            tasks = []
+    Task.objects.bulk_create(tasks)
+
+    return bench_worker
+
+
+def main(argv):
+    counts = [int(i) for i in argv] or [10000, 100000]
+    for count in counts:
+        with database():
+            bench_worker = populate(count)
+            request = PropertyMock(
+                worker=bench_worker,
+                user=Mock(is_authenticated=Mock(return_value=True)),
+            )
+            queries, seconds = measure(lambda: worker.get_tasks_to_assign(request))
+            report("get_tasks_to_assign (%s free tasks)" % count, queries, seconds)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
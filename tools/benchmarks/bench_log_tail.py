@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+Measure TaskLogs.tail (the task log HTML view) on big plain and compressed
+logs: the seek-from-end tail and the line-by-line tail reading whole logs.
+
+Usage: python tools/benchmarks/bench_log_tail.py [size_mb ...]
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common  # noqa: F401, sets up Django
+
+from kobo.hub import models
+from kobo.hub.views import HTML_LOG_MAX_SIZE
+
+
+def make_log(path, size_mb):
+    line = b"".join(b"%-99s\n" % (b"build output line %d" % i) for i in range(10486))
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(line[:1024 ** 2])
+
+
+def measure(open_log, tail):
+    start = time.time()
+    with open_log() as f:
+        content, offset = tail(f, HTML_LOG_MAX_SIZE, 8192)
+    return time.time() - start
+
+
+def main(argv):
+    tmp_dir = tempfile.mkdtemp(prefix="bench-log-tail-")
+    try:
+        for size_mb in [int(i) for i in argv] or [1024]:
+            path = os.path.join(tmp_dir, "%s.log" % size_mb)
+            make_log(path, size_mb)
+            gz_path = path + ".gz"
+            with open(path, "rb") as src:
+                models._write_compressed_log(src, gz_path, os.stat(path))
+
+            logs = (
+                ("plain", lambda: open(path, "rb", models.LOG_BUFFER_SIZE)),
+                ("compressed", lambda: models._open_gzip_log(gz_path)),
+            )
+            for name, open_log in logs:
+                for tail in (models._tail_lines, models._tail):
+                    seconds = measure(open_log, tail)
+                    print("%-40s %10.3f s" % ("%s %s %s MB" % (tail.__name__, name, size_mb), seconds))
+
+            os.unlink(path)
+            os.unlink(gz_path)
+            os.unlink(gz_path + ".idx")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
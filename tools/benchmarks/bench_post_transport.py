@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+Measure kobo.http.POSTTransport throughput and client CPU time per GB,
+sending files with sendfile() (zero_copy=True) and with the read()/send()
+loop (zero_copy=False).
+
+The files are sent to a local HTTP server (running in a separate process)
+which discards them.  Pass a PEM file with a certificate and its key to
+measure sending over TLS.
+
+Usage: python tools/benchmarks/bench_post_transport.py [--tls CERT_AND_KEY.pem] [size_mb ...]
+"""
+
+
+import argparse
+import multiprocessing
+import os
+import resource
+import ssl
+import sys
+import tempfile
+import time
+
+TOP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from kobo.http import POSTTransport
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024**2)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    server.serve_forever()
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_file(size_mb):
+    fd, file_name = tempfile.mkstemp(prefix="bench-post-transport-")
+    block = os.urandom(1024**2)
+    for _ in range(size_mb):
+        os.write(fd, block)
+    os.close(fd)
+    return file_name
+
+
+def measure(file_name, port, secure, zero_copy, repeat=3):
+    """Send the file repeatedly, return (MB/s, CPU seconds per GB)."""
+    size = os.path.getsize(file_name)
+    transport = POSTTransport(zero_copy=zero_copy)
+    elapsed = 0
+    cpu = 0
+    for _ in range(repeat):
+        transport.add_file("file", file_name)
+        start, start_cpu = time.time(), cpu_time()
+        status, _ = transport.send_to_host("localhost", "/upload/", port=port, secure=secure)
+        elapsed += time.time() - start
+        cpu += cpu_time() - start_cpu
+        assert status == 200, status
+
+    return size * repeat / elapsed / 1024**2, cpu / (float(size) * repeat / 1024**3)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tls", metavar="CERT_AND_KEY.pem")
+    parser.add_argument("size_mb", type=int, nargs="*")
+    args = parser.parse_args(argv)
+
+    server = HTTPServer(("localhost", 0), DiscardHandler)
+    if args.tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.tls)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        # the benchmark server uses a self-signed certificate
+        ssl._create_default_https_context = ssl._create_unverified_context  # nosec B323
+    process = multiprocessing.Process(target=serve, args=(server, ))
+    process.daemon = True
+    process.start()
+    port = server.server_port
+    server.server_close()
+
+    try:
+        for size_mb in args.size_mb or [256, 1024]:
+            file_name = make_file(size_mb)
+            try:
+                for zero_copy in (False, True):
+                    name = "%s %s MB (zero_copy=%s)" % (args.tls and "https" or "http", size_mb, zero_copy)
+                    throughput, cpu_per_gb = measure(file_name, port, bool(args.tls), zero_copy)
+                    print("%-40s %10.1f MB/s %10.2f CPU s/GB" % (name, throughput, cpu_per_gb))
+            finally:
+                os.unlink(file_name)
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
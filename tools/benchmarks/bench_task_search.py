@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+Measure task list searches: queries and latency of the previous plain
+icontains lookups and of kobo.hub.task_search.
+
+Usage: python tools/benchmarks/bench_task_search.py [task_count ...]
+"""
+
+
+import sys
+
+from common import database, measure, report
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+from kobo.client.constants import TASK_STATES
+from kobo.hub.models import Arch, Channel, Task, TaskSearchToken
+from kobo.hub.task_search import search_query
+
+
+METHODS = ["BuildTask", "CheckTask", "ComposeTask", "DummyTask", "ScanTask"]
+SEARCHES = ["buildtask", "release-17", "user-3", "method:ScanTask state:failed", "nothing-like-this"]
+
+
+def populate(task_count):
+    users = [User.objects.create(username="user-%s" % i) for i in range(10)]
+    arch = Arch.objects.create(name="x86_64", pretty_name="x86_64")
+    channel = Channel.objects.create(name="default")
+
+    tasks = []
+    for i in range(task_count):
+        tasks.append(Task(
+            owner=users[i % len(users)],
+            arch=arch,
+            channel=channel,
+            method=METHODS[i % len(METHODS)],
+            label="package-%s release-%s" % (i, i % 1000),
+            state=TASK_STATES["CLOSED"] if i % 7 else TASK_STATES["FAILED"],
+        ))
+        if len(tasks) >= 5000:
+            TaskSearchToken.objects.index(Task.objects.bulk_create(tasks))
+            tasks = []
+    TaskSearchToken.objects.index(Task.objects.bulk_create(tasks))
+
+
+def icontains_query(search):
+    return Q(method__icontains=search) | Q(owner__username__icontains=search) | Q(label__icontains=search)
+
+
+def run(query):
+    # the first page of the task list
+    return list(Task.objects.filter(parent__isnull=True).filter(query).order_by("-id")[:50])
+
+
+def main(argv):
+    counts = [int(i) for i in argv] or [10000, 100000]
+    for count in counts:
+        with database():
+            populate(count)
+            for search in SEARCHES:
+                for name, query in (("icontains", icontains_query), ("task_search", search_query)):
+                    queries, seconds = measure(lambda: run(query(search)))
+                    report("%s %r (%s tasks)" % (name, search, count), queries, seconds)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
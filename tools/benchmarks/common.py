@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Shared helpers for hub benchmarks.
+
+The benchmarks run against the test settings (tests/settings.py) and
+a throw-away test database.  Run them from the top of the source tree:
+
+    python tools/benchmarks/bench_dispatch.py
+"""
+
+
+import os
+import sys
+import time
+
+TOP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tests.utils import DjangoRunner
+
+
+__all__ = (
+    "database",
+    "measure",
+    "report",
+)
+
+
+class database(object):
+    """Context manager creating (and destroying) the test database."""
+
+    def __enter__(self):
+        self.runner = DjangoRunner()
+        self.runner.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.runner.stop()
+
+
+def measure(func, repeat=10):
+    """Call func repeatedly, return (queries per call, average seconds per call)."""
+    func()  # warm up caches
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.time()
+        for _ in range(repeat):
+            func()
+        elapsed = time.time() - start
+
+    return len(ctx.captured_queries) // repeat, elapsed / repeat
+
+
+def report(name, queries, seconds):
+    print("%-40s %6d queries %10.2f ms" % (name, queries, seconds * 1000))